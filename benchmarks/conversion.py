@@ -0,0 +1,328 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import gc
+import itertools
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any
+
+import numpy as np
+from PIL import Image
+from utils import (
+    DEFAULT_TOLERANCE,
+    REPO_DIR,
+    compare_measurements,
+    load_results,
+    save_results,
+)
+
+from source.conversion import convert_image
+from source.dithering import DITHERING_METHOD_NAMES, get_dithering_method
+from source.matching import DEFAULT_WORKER_COUNT, clear_palette_caches
+from source.metrics import COLOR_METRIC_NAMES, get_color_metric
+from source.palettes import load_palette_store
+from source.resampling import RESAMPLING_MODE_NAMES, get_resampling_mode
+from source.typing import RGBColor
+
+EXAMPLE_IMAGE_PATH = REPO_DIR / "docs" / "example.png"
+
+DEFAULT_REPEAT_COUNT = 3
+DEFAULT_SIZES = ["512x512", "1024x1024", "2048x2048"]
+
+SYNTHETIC_IMAGE_KINDS = ["noise", "gradient", "flat"]
+FACTORS = [1, 4, 16]
+ADJUSTMENTS = [(0.0, 0.0), (0.2, 0.3)]
+PALETTE_SIZES = [2, 4, 8, 16]
+WORKER_COUNTS = sorted({1, DEFAULT_WORKER_COUNT})
+
+# Every parameter is swept separately while all others keep these values (and
+# the middle image size), unless the full cartesian product is requested
+BASE_CASE = {
+    "image": "noise",
+    "factor": 4,
+    "resampling": "NEAREST",
+    "grayscale": False,
+    "adjustments": (0.0, 0.0),
+    "palette_size": 8,
+    "dithering": "none",
+    "metric": "rgb",
+    "workers": 1,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure the performance of convert_image"
+    )
+    parser.add_argument(
+        "-n",
+        "--repeats",
+        type=int,
+        default=DEFAULT_REPEAT_COUNT,
+        help="number of timed runs per case",
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="synthetic image sizes as WIDTHxHEIGHT",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="run the full cartesian product of all parameters",
+    )
+    parser.add_argument(
+        "-k", "--filter", help="only run cases whose name contains this string"
+    )
+    parser.add_argument("-o", "--output", help="save the results as JSON")
+    parser.add_argument(
+        "-c", "--compare", help="JSON results of a previous run to compare against"
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="relative slowdown that is reported as a regression",
+    )
+    args = parser.parse_args()
+
+    palettes = _get_palettes_by_size()
+    cases = _get_cases(args.sizes, args.full)
+
+    if args.filter is not None:
+        cases = [case for case in cases if args.filter in _get_case_name(case)]
+
+    results: dict[str, Any] = {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "numpy": np.__version__,
+        "pillow": Image.__version__,
+        "repeats": args.repeats,
+        "cases": {},
+    }
+
+    images: dict[tuple[str, str], Image.Image] = {}
+
+    for case_index, case in enumerate(cases, start=1):
+        image_key = (case["image"], case["size"])
+
+        if image_key not in images:
+            images[image_key] = _create_image(case["image"], case["size"])
+
+        case_name = _get_case_name(case)
+        case_results = _run_case(
+            images[image_key], case, palettes[case["palette_size"]], args.repeats
+        )
+        results["cases"][case_name] = case_results
+
+        print(
+            f"[{case_index}/{len(cases)}] {case_name}: "
+            f"{case_results['time_s'] * 1000:.1f} ms, "
+            f"{case_results['megapixels_per_s']:.1f} MP/s, "
+            f"{case_results['peak_memory_bytes'] / 1024**2:.1f} MiB"
+        )
+
+    if args.output is not None:
+        save_results(results, args.output)
+
+    if args.compare is not None:
+        baseline_results = load_results(args.compare)
+
+        if not _compare_results(results, baseline_results, args.tolerance):
+            sys.exit(1)
+
+
+def _get_palettes_by_size() -> dict[int, list[RGBColor]]:
+    palette_store = load_palette_store()
+    palettes: dict[int, list[RGBColor]] = {}
+
+    # The first bundled palette of each size is used so that runs are comparable
+    for palette_index in range(len(palette_store)):
+        colors = palette_store.get_colors(palette_index)
+        palettes.setdefault(len(colors), colors)
+
+    return palettes
+
+
+def _get_cases(sizes: list[str], full: bool) -> list[dict[str, Any]]:
+    parameter_values: dict[str, list[Any]] = {
+        "image": [*SYNTHETIC_IMAGE_KINDS, "example"],
+        "size": sizes,
+        "factor": FACTORS,
+        "resampling": RESAMPLING_MODE_NAMES,
+        "grayscale": [False, True],
+        "adjustments": ADJUSTMENTS,
+        "palette_size": PALETTE_SIZES,
+        "dithering": DITHERING_METHOD_NAMES,
+        "metric": COLOR_METRIC_NAMES,
+        "workers": WORKER_COUNTS,
+    }
+
+    if full:
+        cases = [
+            dict(zip(parameter_values, values))
+            for values in itertools.product(*parameter_values.values())
+        ]
+    else:
+        base_case = {**BASE_CASE, "size": sizes[len(sizes) // 2]}
+        cases = []
+
+        for parameter, values in parameter_values.items():
+            for value in values:
+                cases.append({**base_case, parameter: value})
+
+    # The bundled example image has a fixed size
+    for case in cases:
+        if case["image"] == "example":
+            case["size"] = "example"
+
+    unique_cases = {_get_case_name(case): case for case in cases}
+
+    return list(unique_cases.values())
+
+
+def _get_case_name(case: dict[str, Any]) -> str:
+    brightness, contrast = case["adjustments"]
+
+    return (
+        f"{case['image']}-{case['size']}/factor-{case['factor']}/"
+        f"{case['resampling'].lower()}/grayscale-{int(case['grayscale'])}/"
+        f"bc{brightness:+.1f}{contrast:+.1f}/colors-{case['palette_size']}/"
+        f"dither-{case['dithering']}/{case['metric']}/workers-{case['workers']}"
+    )
+
+
+def _create_image(kind: str, size: str) -> Image.Image:
+    if kind == "example":
+        with Image.open(EXAMPLE_IMAGE_PATH) as example_image:
+            return example_image.convert("RGBA")
+
+    width, height = (int(value) for value in size.split("x"))
+    rng = np.random.default_rng(0)
+
+    match kind:
+        case "noise":
+            image_array = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        case "gradient":
+            x = np.linspace(0, 255, width, dtype=np.float32)
+            y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+            image_array = np.stack(
+                np.broadcast_arrays(x + 0 * y, y + 0 * x, (x + y) / 2), axis=-1
+            ).astype(np.uint8)
+        case "flat":
+            # Large single-colored blocks with few distinct colors, similar to
+            # pixel art and flat-shaded assets
+            block_colors = rng.integers(0, 256, (64, 3), dtype=np.uint8)
+            block_indices = rng.integers(0, 64, (height // 32 + 1, width // 32 + 1))
+            image_array = block_colors[
+                np.repeat(np.repeat(block_indices, 32, axis=0), 32, axis=1)
+            ][:height, :width]
+        case _:
+            raise ValueError(f"Unknown image kind: '{kind}'")
+
+    return Image.fromarray(image_array)
+
+
+def _run_case(
+    image: Image.Image,
+    case: dict[str, Any],
+    colors: list[RGBColor],
+    repeat_count: int,
+) -> dict[str, Any]:
+    brightness, contrast = case["adjustments"]
+
+    conversion_kwargs = {
+        "downsampling_factor": case["factor"] if case["factor"] > 1 else None,
+        "resampling_mode": get_resampling_mode(case["resampling"]),
+        "grayscale": case["grayscale"],
+        "brightness_adjustment": brightness,
+        "contrast_adjustment": contrast,
+        "colors": colors,
+        "dithering": get_dithering_method(case["dithering"]),
+        "color_metric": get_color_metric(case["metric"]),
+        "workers": case["workers"],
+    }
+
+    times: list[float] = []
+
+    # Each run is measured without palette tables built by previous runs
+    for _ in range(repeat_count):
+        clear_palette_caches()
+        gc.collect()
+
+        start_time = time.perf_counter()
+        convert_image(image, **conversion_kwargs)
+        times.append(time.perf_counter() - start_time)
+
+    # Memory is traced in a separate run since tracing slows down the conversion.
+    # Allocations made by Pillow itself are not tracked by tracemalloc.
+    clear_palette_caches()
+    gc.collect()
+
+    tracemalloc.start()
+    convert_image(image, **conversion_kwargs)
+    _, peak_memory_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median_time = statistics.median(times)
+    megapixels = image.width * image.height / 1e6
+
+    return {
+        "time_s": median_time,
+        "min_time_s": min(times),
+        "megapixels": megapixels,
+        "megapixels_per_s": megapixels / median_time,
+        "peak_memory_bytes": peak_memory_bytes,
+    }
+
+
+def _compare_results(
+    results: dict[str, Any], baseline_results: dict[str, Any], tolerance: float
+) -> bool:
+    cases = results["cases"]
+    baseline_cases = baseline_results["cases"]
+
+    print("Time:")
+    times_passed = compare_measurements(
+        {name: case["time_s"] * 1000 for name, case in cases.items()},
+        {name: case["time_s"] * 1000 for name, case in baseline_cases.items()},
+        tolerance,
+        "ms",
+    )
+
+    print("Peak memory:")
+    memory_passed = compare_measurements(
+        {name: case["peak_memory_bytes"] / 1024**2 for name, case in cases.items()},
+        {
+            name: case["peak_memory_bytes"] / 1024**2
+            for name, case in baseline_cases.items()
+        },
+        tolerance,
+        "MiB",
+    )
+
+    return times_passed and memory_passed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from utils import (
+    DEFAULT_TOLERANCE,
+    REPO_DIR,
+    compare_measurements,
+    load_results,
+    save_results,
+)
+
+DEFAULT_RUN_COUNT = 5
+CHILD_TIMEOUT = 30
+
+# Top-level imports that are reported individually in the results
+REPORTED_IMPORTS = ["PyQt6", "PIL", "numpy", "source"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure the import time and time to first paint of the GUI"
+    )
+    parser.add_argument(
+        "-n", "--runs", type=int, default=DEFAULT_RUN_COUNT, help="number of runs"
+    )
+    parser.add_argument("-o", "--output", help="save the results as JSON")
+    parser.add_argument(
+        "-c", "--compare", help="JSON results of a previous run to compare against"
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="relative slowdown that is reported as a regression",
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _run_child()
+        return
+
+    results = {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "runs": args.runs,
+        **_measure_import_times(args.runs),
+        **_measure_startup_times(args.runs),
+    }
+
+    print(json.dumps(results, indent=4))
+
+    if args.output is not None:
+        save_results(results, args.output)
+
+    if args.compare is not None:
+        baseline_results = load_results(args.compare)
+
+        if not _compare_results(results, baseline_results, args.tolerance):
+            sys.exit(1)
+
+
+def _get_child_env() -> dict[str, str]:
+    env = os.environ.copy()
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    return env
+
+
+def _measure_import_times(run_count: int) -> dict[str, float | bool]:
+    total_times: list[float] = []
+    package_times: dict[str, list[float]] = {name: [] for name in REPORTED_IMPORTS}
+    numpy_imported = False
+
+    for _ in range(run_count):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import source.gui"],
+            cwd=REPO_DIR,
+            env=_get_child_env(),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        total_time = 0.0
+        run_package_times = {name: 0.0 for name in REPORTED_IMPORTS}
+
+        # Lines look like "import time: self [us] | cumulative | module". Self
+        # times are summed since cumulative times of nested imports overlap.
+        for line in process.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+
+            self_column, _, module_column = line.split("|")
+            self_ms = int(self_column.removeprefix("import time:")) / 1000
+            package_name = module_column.strip().split(".")[0]
+
+            total_time += self_ms
+
+            if package_name in run_package_times:
+                run_package_times[package_name] += self_ms
+
+            if package_name == "numpy":
+                numpy_imported = True
+
+        total_times.append(total_time)
+
+        for package_name, package_time in run_package_times.items():
+            package_times[package_name].append(package_time)
+
+    results: dict[str, float | bool] = {
+        "import_time_ms": statistics.median(total_times),
+        "numpy_imported_by_gui": numpy_imported,
+    }
+
+    for package_name, times in package_times.items():
+        results[f"import_time_{package_name.lower()}_ms"] = statistics.median(times)
+
+    return results
+
+
+def _measure_startup_times(run_count: int) -> dict[str, float | bool]:
+    first_paint_times: list[float] = []
+    palettes_loaded_times: list[float] = []
+    numpy_loaded_at_first_paint = False
+
+    for _ in range(run_count):
+        # time.monotonic() uses a system-wide clock, so timestamps of the child
+        # process can be compared with the start time of this process
+        start_time = time.monotonic()
+
+        process = subprocess.run(
+            [sys.executable, __file__, "--child"],
+            cwd=REPO_DIR,
+            env=_get_child_env(),
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=CHILD_TIMEOUT,
+        )
+
+        child_results = json.loads(process.stdout.splitlines()[-1])
+
+        first_paint_times.append(1000 * (child_results["first_paint"] - start_time))
+        palettes_loaded_times.append(
+            1000 * (child_results["palettes_loaded"] - start_time)
+        )
+        numpy_loaded_at_first_paint |= child_results["numpy_loaded_at_first_paint"]
+
+    return {
+        "first_paint_ms": statistics.median(first_paint_times),
+        "palettes_loaded_ms": statistics.median(palettes_loaded_times),
+        "numpy_loaded_at_first_paint": numpy_loaded_at_first_paint,
+    }
+
+
+def _run_child() -> None:
+    from PyQt6.QtCore import QEvent, QObject, QTimer
+    from PyQt6.QtGui import QIcon
+    from PyQt6.QtWidgets import QApplication
+
+    from pixelart_palette_converter import ICON_PATH, MINIMUM_WINDOW_SIZE, WINDOW_TITLE
+    from source.gui import MainWindow, PaletteGroupBox
+
+    timestamps: dict[str, float | bool] = {}
+
+    class FirstPaintFilter(QObject):
+        def eventFilter(self, watched: QObject | None, event: QEvent | None) -> bool:
+            if (
+                event is not None
+                and event.type() == QEvent.Type.Paint
+                and "first_paint" not in timestamps
+            ):
+                timestamps["first_paint"] = time.monotonic()
+                timestamps["numpy_loaded_at_first_paint"] = "numpy" in sys.modules
+
+            return False
+
+    def on_palettes_loaded() -> None:
+        timestamps["palettes_loaded"] = time.monotonic()
+
+        # Let pending paint events through before quitting
+        QTimer.singleShot(0, app.quit)
+
+    app = QApplication(sys.argv[:1])
+
+    first_paint_filter = FirstPaintFilter()
+    app.installEventFilter(first_paint_filter)
+
+    window = MainWindow(WINDOW_TITLE, QIcon(ICON_PATH), MINIMUM_WINDOW_SIZE)
+
+    palette_group_box = window.findChild(PaletteGroupBox)
+
+    if palette_group_box is not None:
+        palette_group_box.palettes_loaded.connect(on_palettes_loaded)
+
+    window.show()
+
+    QTimer.singleShot(1000 * CHILD_TIMEOUT, app.quit)
+    app.exec()
+
+    print(json.dumps(timestamps))
+
+
+def _compare_results(
+    results: dict[str, float | bool],
+    baseline_results: dict[str, float | bool],
+    tolerance: float,
+) -> bool:
+    times = {
+        key: value
+        for key, value in results.items()
+        if key.endswith("_ms") and not isinstance(value, bool)
+    }
+    baseline_times = {
+        key: value
+        for key, value in baseline_results.items()
+        if key.endswith("_ms") and not isinstance(value, bool)
+    }
+
+    passed = compare_measurements(times, baseline_times, tolerance, "ms")
+
+    if results.get("numpy_loaded_at_first_paint"):
+        print("NumPy is imported before the first paint")
+        passed = False
+
+    return passed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import sys
+from pathlib import Path
+from typing import Any
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+DEFAULT_TOLERANCE = 0.2
+
+# Allows importing the application modules when running a benchmark script
+if str(REPO_DIR) not in sys.path:
+    sys.path.insert(0, str(REPO_DIR))
+
+
+def save_results(results: dict[str, Any], output_path: str) -> None:
+    with open(output_path, "w") as output_file:
+        json.dump(results, output_file, indent=4)
+
+
+def load_results(results_path: str) -> dict[str, Any]:
+    with open(results_path) as results_file:
+        return json.load(results_file)
+
+
+def compare_measurements(
+    measurements: dict[str, float],
+    baseline_measurements: dict[str, float],
+    tolerance: float,
+    unit: str,
+) -> bool:
+    # Lower values are better for all measurements, anything that increased by
+    # more than the tolerance is reported as a regression
+    passed = True
+
+    for key, value in measurements.items():
+        baseline_value = baseline_measurements.get(key)
+
+        if baseline_value is None:
+            continue
+
+        ratio = value / baseline_value if baseline_value > 0 else 1
+        regression = ratio > 1 + tolerance
+
+        print(
+            f"{key:<48} {baseline_value:10.2f} -> {value:10.2f} {unit} ({ratio:5.2f}x)"
+            + ("  REGRESSION" if regression else "")
+        )
+
+        passed &= not regression
+
+    return passed
@@ -16,17 +16,30 @@
 
 import sys
 
-from PyQt6.QtGui import QIcon
-from PyQt6.QtWidgets import QApplication
-
-from source.gui import MainWindow
-
 WINDOW_TITLE = "Pixel Art Palette Converter"
 ICON_PATH = "resources/icon.png"
 MINIMUM_WINDOW_SIZE = (960, 540)
 
+CLI_COMMAND = "convert"
+
 
 def main() -> None:
+    # The convert command starts the headless batch converter, which must not
+    # depend on PyQt6. Any other arguments are passed on to Qt.
+    if len(sys.argv) > 1 and sys.argv[1] == CLI_COMMAND:
+        from source.cli import main as cli_main
+
+        sys.exit(cli_main(sys.argv[2:]))
+
+    run_gui()
+
+
+def run_gui() -> None:
+    from PyQt6.QtGui import QIcon
+    from PyQt6.QtWidgets import QApplication
+
+    from source.gui import MainWindow
+
     app = QApplication(sys.argv)
 
     window = MainWindow(WINDOW_TITLE, QIcon(ICON_PATH), MINIMUM_WINDOW_SIZE)
@@ -0,0 +1,458 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any
+
+from PIL import Image
+
+from .conversion import (
+    convert_image,
+    convert_image_with_palettes,
+    create_contact_sheet,
+    decode_image,
+    save_image,
+)
+from .dithering import DITHERING_METHOD_NAMES, get_dithering_method
+from .metrics import COLOR_METRIC_NAMES, get_color_metric
+from .palettes import load_palette_store, parse_hex_colors
+from .profiling import ConversionProfiler, StageRecord, get_image_shape
+from .resampling import RESAMPLING_MODE_NAMES, get_resampling_mode
+from .typing import RGBColor
+
+DEFAULT_OUTPUT_EXTENSION = "png"
+
+# Errors raised for unreadable, malformed or overly large images, which only fail
+# the conversion of the affected file
+_CONVERSION_ERRORS = (OSError, ValueError, MemoryError, Image.DecompressionBombError)
+
+
+def main(args: list[str] | None = None) -> int:
+    parsed_args = _parse_args(args)
+
+    input_paths = _collect_input_paths(parsed_args.inputs)
+
+    if not input_paths:
+        print("No input images found")
+        return 1
+
+    # Bundled palettes are keyed by their lospec slug, which also names the
+    # output images of each palette
+    palettes: dict[str, list[RGBColor]] = {}
+
+    try:
+        if parsed_args.palette is not None:
+            palette_store = load_palette_store()
+
+            for palette_name in parsed_args.palette:
+                palette_index = palette_store.find(palette_name)
+                palettes[palette_store.keys[palette_index]] = palette_store.get_colors(
+                    palette_index
+                )
+        elif parsed_args.colors is not None:
+            palettes["colors"] = parse_hex_colors(parsed_args.colors.split(","))
+    except ValueError as exception:
+        print(exception)
+        return 1
+
+    if parsed_args.contact_sheet and not palettes:
+        print("A contact sheet requires at least one palette")
+        return 1
+
+    separate_palette_images = len(palettes) > 1 and not parsed_args.contact_sheet
+    output_dir = Path(parsed_args.output_dir)
+
+    try:
+        output_paths = _get_output_paths(
+            input_paths,
+            output_dir,
+            parsed_args.extension,
+            list(palettes) if separate_palette_images else [],
+        )
+    except ValueError as exception:
+        print(exception)
+        return 1
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    downsampling_factor = parsed_args.factor
+
+    if downsampling_factor == 1:
+        downsampling_factor = None
+
+    conversion_kwargs: dict[str, Any] = {
+        "downsampling_factor": downsampling_factor,
+        "resampling_mode": get_resampling_mode(parsed_args.resampling),
+        "grayscale": parsed_args.grayscale,
+        "brightness_adjustment": parsed_args.brightness / 100,
+        "contrast_adjustment": parsed_args.contrast / 100,
+        "dithering": get_dithering_method(parsed_args.dithering),
+        "color_metric": get_color_metric(parsed_args.metric),
+        "workers": parsed_args.threads,
+        "indexed_output": True,
+    }
+
+    # Several palettes share the preprocessing of each image
+    if len(palettes) > 1 or parsed_args.contact_sheet:
+        conversion_kwargs["palettes"] = palettes
+        conversion_kwargs["contact_sheet"] = parsed_args.contact_sheet
+    else:
+        conversion_kwargs["colors"] = next(iter(palettes.values()), None)
+
+    return _run_batch(
+        output_paths,
+        conversion_kwargs,
+        parsed_args.jobs,
+        parsed_args.profile,
+    )
+
+
+def _parse_args(args: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} convert",
+        description="Convert images into pixel art without starting the GUI",
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="input image files, directories or glob patterns"
+    )
+    parser.add_argument(
+        "-o", "--output-dir", required=True, help="directory for converted images"
+    )
+    parser.add_argument(
+        "-f", "--factor", type=int, default=1, help="downsampling factor"
+    )
+    parser.add_argument(
+        "-r",
+        "--resampling",
+        choices=[mode.lower() for mode in RESAMPLING_MODE_NAMES],
+        default="nearest",
+        help=(
+            "resampling mode used for downsampling (mean, median and majority "
+            "reduce whole blocks of pixels)"
+        ),
+    )
+    parser.add_argument(
+        "-g", "--grayscale", action="store_true", help="enable grayscale conversion"
+    )
+    parser.add_argument(
+        "-b",
+        "--brightness",
+        type=int,
+        default=0,
+        help="brightness adjustment from -100 to 100",
+    )
+    parser.add_argument(
+        "-c",
+        "--contrast",
+        type=int,
+        default=0,
+        help="contrast adjustment from -100 to 100",
+    )
+
+    palette_group = parser.add_mutually_exclusive_group()
+    palette_group.add_argument(
+        "-p",
+        "--palette",
+        action="append",
+        help=(
+            "name of a bundled lospec palette (e.g. sweetie-16), can be repeated to "
+            "write one image per palette"
+        ),
+    )
+    palette_group.add_argument(
+        "--colors", help="comma-separated hex colors (e.g. #000000,#ffffff)"
+    )
+
+    parser.add_argument(
+        "-d",
+        "--dithering",
+        choices=DITHERING_METHOD_NAMES,
+        default="none",
+        help="dithering method used when recoloring with a palette",
+    )
+    parser.add_argument(
+        "-m",
+        "--metric",
+        choices=COLOR_METRIC_NAMES,
+        default="rgb",
+        help="color distance used to find the closest palette colors",
+    )
+    parser.add_argument(
+        "--contact-sheet",
+        action="store_true",
+        help="combine the images of all palettes into one contact sheet per input",
+    )
+    parser.add_argument(
+        "-e",
+        "--extension",
+        default=DEFAULT_OUTPUT_EXTENSION,
+        help="file extension (format) of the converted images",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="report the time and memory of each conversion stage",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes (defaults to the number of CPUs)",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="number of threads used to recolor each image (useful with few jobs)",
+    )
+
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.factor < 1:
+        parser.error("downsampling factor must not be smaller than 1")
+
+    for adjustment in (parsed_args.brightness, parsed_args.contrast):
+        if not -100 <= adjustment <= 100:
+            parser.error("brightness and contrast must be between -100 and 100")
+
+    if parsed_args.jobs is not None and parsed_args.jobs < 1:
+        parser.error("number of jobs must not be smaller than 1")
+
+    if parsed_args.threads < 1:
+        parser.error("number of threads must not be smaller than 1")
+
+    return parsed_args
+
+
+def _collect_input_paths(inputs: list[str]) -> list[Path]:
+    image_extensions = set(Image.registered_extensions())
+    input_paths: list[Path] = []
+
+    for input_str in inputs:
+        input_path = Path(input_str)
+
+        if input_path.is_dir():
+            candidate_paths = sorted(input_path.iterdir())
+        elif input_path.is_file():
+            input_paths.append(input_path)
+            continue
+        else:
+            candidate_paths = [Path(path) for path in sorted(glob.glob(input_str))]
+
+        for candidate_path in candidate_paths:
+            if (
+                candidate_path.is_file()
+                and candidate_path.suffix.lower() in image_extensions
+            ):
+                input_paths.append(candidate_path)
+
+    # Remove duplicates from overlapping inputs while preserving the order
+    return list(dict.fromkeys(input_paths))
+
+
+def _get_output_paths(
+    input_paths: list[Path],
+    output_dir: Path,
+    extension: str,
+    palette_keys: list[str],
+) -> dict[Path, Path]:
+    # Returns the output path of each input. With palette keys, one image per
+    # palette is written next to each output path instead.
+    extension = extension.lstrip(".")
+    stem_counts = Counter(input_path.stem for input_path in input_paths)
+    output_paths: dict[Path, Path] = {}
+
+    for input_path in input_paths:
+        output_stem = input_path.stem
+
+        # Inputs that only differ in their format keep it in the output name
+        if stem_counts[output_stem] > 1:
+            output_stem += f"-{input_path.suffix.lstrip('.').lower()}"
+
+        output_paths[input_path] = output_dir / f"{output_stem}.{extension}"
+
+    resolved_input_paths = {input_path.resolve() for input_path in input_paths}
+    resolved_output_paths: dict[Path, Path] = {}
+
+    for input_path, output_path in output_paths.items():
+        if palette_keys:
+            written_paths = [
+                _get_palette_output_path(output_path, palette_key)
+                for palette_key in palette_keys
+            ]
+        else:
+            written_paths = [output_path]
+
+        for written_path in written_paths:
+            resolved_output_path = written_path.resolve()
+
+            if resolved_output_path in resolved_input_paths:
+                raise ValueError(
+                    f"Output {written_path} would overwrite an input image"
+                )
+
+            if resolved_output_path in resolved_output_paths:
+                raise ValueError(
+                    f"Inputs {resolved_output_paths[resolved_output_path]} and "
+                    f"{input_path} would both be written to {written_path}"
+                )
+
+            resolved_output_paths[resolved_output_path] = input_path
+
+    return output_paths
+
+
+def _get_palette_output_path(output_path: Path, palette_key: str) -> Path:
+    return output_path.with_stem(f"{output_path.stem}-{palette_key}")
+
+
+def _run_batch(
+    output_paths: dict[Path, Path],
+    conversion_kwargs: dict[str, Any],
+    jobs: int | None,
+    profile: bool,
+) -> int:
+    failure_count = 0
+    total_pixels = 0
+    stage_records: list[StageRecord] = []
+
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures: dict[Future[tuple[int, list[StageRecord]]], Path] = {}
+
+        for input_path, output_path in output_paths.items():
+            future = executor.submit(
+                _convert_file, input_path, output_path, conversion_kwargs, profile
+            )
+            futures[future] = input_path
+
+        for finished_count, future in enumerate(as_completed(futures), start=1):
+            input_path = futures[future]
+            progress_str = f"[{finished_count}/{len(futures)}]"
+
+            try:
+                pixel_count, file_stage_records = future.result()
+            except _CONVERSION_ERRORS as exception:
+                failure_count += 1
+                print(f"{progress_str} {input_path}: failed ({exception})")
+                continue
+
+            total_pixels += pixel_count
+            stage_records.extend(file_stage_records)
+            print(f"{progress_str} {input_path}")
+
+    elapsed_time = time.perf_counter() - start_time
+    converted_count = len(output_paths) - failure_count
+
+    print(
+        f"Converted {converted_count} image(s) ({total_pixels / 1e6:.1f} MP) in "
+        f"{elapsed_time:.2f} s: {converted_count / elapsed_time:.2f} images/s, "
+        f"{total_pixels / 1e6 / elapsed_time:.2f} MP/s"
+    )
+
+    if profile:
+        _print_stage_profile(stage_records)
+
+    if failure_count > 0:
+        print(f"Failed to convert {failure_count} image(s)")
+        return 1
+
+    return 0
+
+
+def _print_stage_profile(stage_records: list[StageRecord]) -> None:
+    stage_names = list(dict.fromkeys(record.name for record in stage_records))
+    total_duration = sum(record.duration for record in stage_records)
+
+    print(
+        f"{'Stage':<20} {'Runs':>6} {'Total s':>9} {'Mean ms':>9} {'Share':>7} "
+        f"{'Max alloc MiB':>14}"
+    )
+
+    for stage_name in stage_names:
+        records = [record for record in stage_records if record.name == stage_name]
+        stage_duration = sum(record.duration for record in records)
+        max_allocated_bytes = max(record.allocated_bytes or 0 for record in records)
+
+        print(
+            f"{stage_name:<20} {len(records):>6} {stage_duration:>9.3f} "
+            f"{stage_duration / len(records) * 1000:>9.1f} "
+            f"{stage_duration / total_duration:>7.1%} "
+            f"{max_allocated_bytes / 1024**2:>14.1f}"
+        )
+
+
+def _convert_file(
+    input_path: Path,
+    output_path: Path,
+    conversion_kwargs: dict[str, Any],
+    profile: bool,
+) -> tuple[int, list[StageRecord]]:
+    conversion_kwargs = conversion_kwargs.copy()
+    profiler = ConversionProfiler(trace_memory=True) if profile else None
+
+    # Downsampling is done while decoding, which lets large JPEG images be
+    # decoded at a reduced size. It is profiled as part of the decode stage.
+    with Image.open(input_path) as input_image:
+        pixel_count = input_image.width * input_image.height
+        input_shape = get_image_shape(input_image)
+
+        if profiler is not None:
+            profiler.begin_stage()
+
+        image = decode_image(
+            input_image,
+            conversion_kwargs.pop("downsampling_factor"),
+            conversion_kwargs.pop("resampling_mode"),
+        )
+
+        if profiler is not None:
+            profiler.end_stage(
+                "decode", input_image, image, cached=False, input_shape=input_shape
+            )
+
+    if "palettes" in conversion_kwargs:
+        palettes: dict[str, list[RGBColor]] = conversion_kwargs.pop("palettes")
+        contact_sheet: bool = conversion_kwargs.pop("contact_sheet")
+
+        converted_images = convert_image_with_palettes(
+            image, list(palettes.values()), profiler=profiler, **conversion_kwargs
+        )
+
+        if contact_sheet:
+            save_image(create_contact_sheet(converted_images), output_path)
+        else:
+            for palette_key, converted_image in zip(palettes, converted_images):
+                save_image(
+                    converted_image, _get_palette_output_path(output_path, palette_key)
+                )
+    else:
+        converted_image = convert_image(image, profiler=profiler, **conversion_kwargs)
+        save_image(converted_image, output_path)
+
+    stage_records = profiler.records if profiler is not None else []
+
+    return pixel_count, stage_records
@@ -14,44 +14,565 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import itertools
+import math
+import os
+import weakref
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from functools import lru_cache, partial
+from pathlib import Path
+from threading import Lock
+from typing import Any
+
 import numpy as np
+from numpy.typing import NDArray
 from PIL import Image
 
-from .typing import RGBColor
+from .dithering import DitheringMethod
+from .extraction import PaletteExtractionMethod, extract_palette_colors, rank_palettes
+from .matching import (
+    RECOLOR_MEMORY_BUDGET,
+    MatchingMethod,
+    find_closest_color_indices,
+    find_dithered_color_indices,
+    find_unique_colors,
+)
+from .metrics import ColorMetric
+from .palettes import PaletteStore
+from .profiling import ConversionProfiler
+from .resampling import BlockResampling, ResamplingMode
+from .typing import ProgressCallback, RGBColor
+
+STAGE_CACHE_MAX_BYTES = 512 * 1024**2
+BRIGHTNESS_CONTRAST_CACHE_SIZE = 256
+
+# JPEG images can be decoded at 1/2, 1/4 or 1/8 scale when downsampling. The
+# decoded image is kept at least this many times larger than the downsampled
+# size so that the final resampling filter still has pixels to work with.
+REDUCED_DECODING_OVERSAMPLING = 2
+
+# Indexed images store one byte per pixel, so larger palettes are returned as RGB
+INDEXED_OUTPUT_MAX_COLORS = 256
+
+CONTACT_SHEET_SPACING = 8
+CONTACT_SHEET_BACKGROUND_COLOR: RGBColor = (255, 255, 255)
+
+# Image formats that support neither palettes nor alpha channels
+_RGB_ONLY_FORMATS = {"JPEG"}
+
+
+class StageCache:
+    def __init__(self, max_bytes: int = STAGE_CACHE_MAX_BYTES) -> None:
+        self._max_bytes = max_bytes
+        self._size_bytes = 0
+        self._entries: OrderedDict[Hashable, Image.Image] = OrderedDict()
+
+        # Source images are identified by object identity. Weak references make
+        # sure that a recycled object id is never mistaken for a previous image.
+        self._source_keys: dict[int, tuple[weakref.ref[Image.Image], int]] = {}
+        self._source_key_counter = itertools.count()
+
+        # Conversions may run concurrently on worker threads
+        self._lock = Lock()
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    def get_source_key(self, image: Image.Image) -> Hashable:
+        with self._lock:
+            source_entry = self._source_keys.get(id(image))
+
+            if source_entry is not None and source_entry[0]() is image:
+                return ("source", source_entry[1])
+
+            source_key = next(self._source_key_counter)
+            image_ref = weakref.ref(image, self._create_source_remover(id(image)))
+            self._source_keys[id(image)] = (image_ref, source_key)
+
+            return ("source", source_key)
+
+    def get(self, key: Hashable) -> Image.Image | None:
+        with self._lock:
+            image = self._entries.get(key)
+
+            if image is not None:
+                self._entries.move_to_end(key)
+
+            return image
+
+    def put(self, key: Hashable, image: Image.Image) -> None:
+        image_size_bytes = _get_image_size_bytes(image)
+
+        if image_size_bytes > self._max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._size_bytes -= _get_image_size_bytes(self._entries.pop(key))
+
+            self._entries[key] = image
+            self._size_bytes += image_size_bytes
+
+            while self._size_bytes > self._max_bytes:
+                _, evicted_image = self._entries.popitem(last=False)
+                self._size_bytes -= _get_image_size_bytes(evicted_image)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def _create_source_remover(
+        self, image_id: int
+    ) -> Callable[[weakref.ref[Image.Image]], None]:
+        def remove_source(image_ref: weakref.ref[Image.Image]) -> None:
+            with self._lock:
+                source_entry = self._source_keys.get(image_id)
+
+                if source_entry is not None and source_entry[0] is image_ref:
+                    del self._source_keys[image_id]
+
+        return remove_source
 
 
 def convert_image(
     image: Image.Image,
     downsampling_factor: int | None = None,
-    resampling_mode: Image.Resampling = Image.Resampling.NEAREST,
+    resampling_mode: ResamplingMode = Image.Resampling.NEAREST,
     grayscale: bool = False,
     brightness_adjustment: float = 0,
     contrast_adjustment: float = 0,
     colors: list[RGBColor] | None = None,
+    dithering: DitheringMethod = DitheringMethod.NONE,
+    color_metric: ColorMetric = ColorMetric.RGB,
+    memory_budget: int = RECOLOR_MEMORY_BUDGET,
+    matching_method: MatchingMethod = MatchingMethod.AUTO,
+    workers: int = 1,
+    indexed_output: bool = False,
+    progress_callback: ProgressCallback | None = None,
+    stage_cache: StageCache | None = None,
+    fused: bool | None = None,
+    profiler: ConversionProfiler | None = None,
 ) -> Image.Image:
+    adjust_brightness_and_contrast = (
+        brightness_adjustment != 0 or contrast_adjustment != 0
+    )
+
+    # Fusing folds grayscale conversion and brightness/contrast adjustments into
+    # the recoloring stage, so it is only possible if a palette is set and by
+    # default only used if there is anything to fold
+    if fused is None:
+        fused = grayscale or adjust_brightness_and_contrast
+
+    fused = fused and colors is not None
+
+    if fused:
+        stage_count = sum([downsampling_factor is not None, True])
+    else:
+        stage_count = sum(
+            [
+                downsampling_factor is not None,
+                grayscale,
+                adjust_brightness_and_contrast,
+                colors is not None,
+            ]
+        )
+
+    pipeline = _ConversionPipeline(
+        image, stage_count, stage_cache, progress_callback, profiler
+    )
+
     if downsampling_factor is not None:
-        image = _downsample_image(image, downsampling_factor, resampling_mode)
+        pipeline.run_stage(
+            "downsample",
+            _downsample_image,
+            factor=downsampling_factor,
+            resampling_mode=resampling_mode,
+        )
+
+    if fused:
+        pipeline.run_stage(
+            "fused_recolor",
+            _recolor_image_fused,
+            grayscale=grayscale,
+            brightness_adjustment=brightness_adjustment,
+            contrast_adjustment=contrast_adjustment,
+            colors=colors,
+            dithering=dithering,
+            color_metric=color_metric,
+            memory_budget=memory_budget,
+            matching_method=matching_method,
+            workers=workers,
+            indexed=indexed_output,
+        )
+
+        return pipeline.image
 
     if grayscale:
-        image = image.convert("L").convert("RGB")
+        pipeline.run_stage("grayscale", _convert_to_grayscale)
 
-    if brightness_adjustment != 0 or contrast_adjustment != 0:
-        image = _adjust_brightness_and_contrast(
-            image, brightness_adjustment, contrast_adjustment
+    if adjust_brightness_and_contrast:
+        pipeline.run_stage(
+            "brightness_contrast",
+            _adjust_brightness_and_contrast,
+            brightness_adjustment=brightness_adjustment,
+            contrast_adjustment=contrast_adjustment,
         )
 
     if colors is not None:
-        image = _recolor_image(image, colors)
+        pipeline.run_stage(
+            "recolor",
+            _recolor_image,
+            colors=colors,
+            dithering=dithering,
+            color_metric=color_metric,
+            memory_budget=memory_budget,
+            matching_method=matching_method,
+            workers=workers,
+            indexed=indexed_output,
+        )
+
+    return pipeline.image
+
+
+def convert_image_with_palettes(
+    image: Image.Image,
+    palettes: list[list[RGBColor]],
+    downsampling_factor: int | None = None,
+    resampling_mode: ResamplingMode = Image.Resampling.NEAREST,
+    grayscale: bool = False,
+    brightness_adjustment: float = 0,
+    contrast_adjustment: float = 0,
+    dithering: DitheringMethod = DitheringMethod.NONE,
+    color_metric: ColorMetric = ColorMetric.RGB,
+    memory_budget: int = RECOLOR_MEMORY_BUDGET,
+    matching_method: MatchingMethod = MatchingMethod.AUTO,
+    workers: int = 1,
+    indexed_output: bool = False,
+    progress_callback: ProgressCallback | None = None,
+    stage_cache: StageCache | None = None,
+    profiler: ConversionProfiler | None = None,
+) -> list[Image.Image]:
+    adjust_brightness_and_contrast = (
+        brightness_adjustment != 0 or contrast_adjustment != 0
+    )
+
+    # Downsampling and preprocessing run once, only recoloring runs per palette
+    stage_count = sum(
+        [downsampling_factor is not None, grayscale, adjust_brightness_and_contrast]
+    ) + len(palettes)
+
+    pipeline = _ConversionPipeline(
+        image, stage_count, stage_cache, progress_callback, profiler
+    )
+
+    if downsampling_factor is not None:
+        pipeline.run_stage(
+            "downsample",
+            _downsample_image,
+            factor=downsampling_factor,
+            resampling_mode=resampling_mode,
+        )
+
+    if grayscale:
+        pipeline.run_stage("grayscale", _convert_to_grayscale)
+
+    if adjust_brightness_and_contrast:
+        pipeline.run_stage(
+            "brightness_contrast",
+            _adjust_brightness_and_contrast,
+            brightness_adjustment=brightness_adjustment,
+            contrast_adjustment=contrast_adjustment,
+        )
+
+    recolor_kwargs: dict[str, Any] = {
+        "color_metric": color_metric,
+        "memory_budget": memory_budget,
+        "matching_method": matching_method,
+        "workers": workers,
+        "indexed": indexed_output,
+    }
+
+    if dithering is DitheringMethod.NONE:
+        # The distinct colors of the preprocessed image are found once and only
+        # they are matched with each palette
+        unique_colors, inverse_indices = find_unique_colors(
+            _get_rgb_array(pipeline.image)
+        )
+        recolor_function: Callable[..., Image.Image] = partial(
+            _recolor_unique_colors,
+            unique_colors=unique_colors,
+            inverse_indices=inverse_indices,
+        )
+    else:
+        # Dithering depends on the position of every pixel
+        recolor_function = _recolor_image
+        recolor_kwargs["dithering"] = dithering
+
+    return [
+        pipeline.run_branch_stage(
+            "recolor", recolor_function, colors=colors, **recolor_kwargs
+        )
+        for colors in palettes
+    ]
+
+
+def create_contact_sheet(
+    images: list[Image.Image],
+    column_count: int | None = None,
+    spacing: int = CONTACT_SHEET_SPACING,
+    background_color: RGBColor = CONTACT_SHEET_BACKGROUND_COLOR,
+) -> Image.Image:
+    if not images:
+        raise ValueError("A contact sheet needs at least one image")
+
+    # Images are arranged row by row in an approximately square grid by default
+    if column_count is None:
+        column_count = math.ceil(math.sqrt(len(images)))
+
+    row_count = math.ceil(len(images) / column_count)
+
+    cell_width = max(image.width for image in images)
+    cell_height = max(image.height for image in images)
+
+    contact_sheet = Image.new(
+        "RGB",
+        (
+            column_count * cell_width + (column_count + 1) * spacing,
+            row_count * cell_height + (row_count + 1) * spacing,
+        ),
+        background_color,
+    )
+
+    for image_index, image in enumerate(images):
+        row, column = divmod(image_index, column_count)
+
+        contact_sheet.paste(
+            image.convert("RGB"),
+            (
+                spacing + column * (cell_width + spacing),
+                spacing + row * (cell_height + spacing),
+            ),
+        )
+
+    return contact_sheet
+
+
+def can_decode_reduced(
+    image_file: Image.Image,
+    downsampling_factor: int | None,
+    resampling_mode: ResamplingMode = Image.Resampling.NEAREST,
+) -> bool:
+    # DCT scaling averages blocks of pixels, which is close to the result of the
+    # filtering resampling modes but not to picking single pixels or block modes
+    return (
+        image_file.format == "JPEG"
+        and downsampling_factor is not None
+        and downsampling_factor >= 2
+        and isinstance(resampling_mode, Image.Resampling)
+        and resampling_mode != Image.Resampling.NEAREST
+        and min(image_file.size) // downsampling_factor >= 1
+    )
+
+
+def decode_image(
+    image_file: Image.Image,
+    downsampling_factor: int | None = None,
+    resampling_mode: ResamplingMode = Image.Resampling.NEAREST,
+) -> Image.Image:
+    if (
+        downsampling_factor is not None
+        and isinstance(resampling_mode, Image.Resampling)
+        and can_decode_reduced(image_file, downsampling_factor, resampling_mode)
+    ):
+        new_width = image_file.width // downsampling_factor
+        new_height = image_file.height // downsampling_factor
+
+        # The target size has to be computed before drafting since drafting
+        # changes the size of the image
+        image_file.draft(
+            "RGB",
+            (
+                new_width * REDUCED_DECODING_OVERSAMPLING,
+                new_height * REDUCED_DECODING_OVERSAMPLING,
+            ),
+        )
+
+        return image_file.convert("RGB").resize(
+            (new_width, new_height),
+            resample=resampling_mode,
+            reducing_gap=REDUCED_DECODING_OVERSAMPLING,
+        )
+
+    image_mode = "RGBA" if image_file.has_transparency_data else "RGB"
+    image = image_file.convert(image_mode)
+
+    if downsampling_factor is not None:
+        image = _downsample_image(image, downsampling_factor, resampling_mode)
 
     return image
 
 
+def save_image(image: Image.Image, file_path: str | os.PathLike[str]) -> None:
+    image_format = Image.registered_extensions().get(Path(file_path).suffix.lower())
+
+    if image_format in _RGB_ONLY_FORMATS and image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+
+    image.save(file_path)
+
+
+def extract_palette(
+    image: Image.Image,
+    color_count: int,
+    method: PaletteExtractionMethod = PaletteExtractionMethod.K_MEANS,
+) -> list[RGBColor]:
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+    return extract_palette_colors(np.asarray(image), color_count, method)
+
+
+def suggest_palettes(
+    image: Image.Image, palette_store: PaletteStore, count: int
+) -> list[int]:
+    # All palettes of the store are scored against the image at once and the
+    # indices of the best fitting ones are returned
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+    errors = rank_palettes(np.asarray(image), _get_padded_palette_colors(palette_store))
+
+    return np.argsort(errors, kind="stable")[:count].tolist()
+
+
+@lru_cache(maxsize=1)
+def _get_padded_palette_colors(palette_store: PaletteStore) -> NDArray[np.uint8]:
+    # Palettes are stacked into a single (palettes, max colors, 3) array. Shorter
+    # palettes are padded by repeating their last color, which does not change
+    # their closest colors.
+    color_offsets = np.asarray(palette_store.color_offsets)
+    palette_sizes = np.diff(color_offsets)
+    colors = np.frombuffer(palette_store.color_data, dtype=np.uint8).reshape(-1, 3)
+
+    slot_indices = color_offsets[:-1, np.newaxis] + np.minimum(
+        np.arange(palette_sizes.max()), palette_sizes[:, np.newaxis] - 1
+    )
+
+    return colors[slot_indices]
+
+
+class _ConversionPipeline:
+    def __init__(
+        self,
+        image: Image.Image,
+        stage_count: int,
+        stage_cache: StageCache | None,
+        progress_callback: ProgressCallback | None,
+        profiler: ConversionProfiler | None,
+    ) -> None:
+        self.image = image
+
+        self._stage_count = stage_count
+        self._completed_stage_count = 0
+        self._stage_cache = stage_cache
+        self._progress_callback = progress_callback
+        self._profiler = profiler
+
+        self._stage_key: Hashable = None
+
+        if stage_cache is not None:
+            self._stage_key = stage_cache.get_source_key(image)
+
+    def run_stage(
+        self,
+        stage_name: str,
+        stage_function: Callable[..., Image.Image],
+        **stage_kwargs: Any,
+    ) -> None:
+        self.image, self._stage_key = self._run_stage(
+            stage_name, stage_function, stage_kwargs
+        )
+
+    def run_branch_stage(
+        self,
+        stage_name: str,
+        stage_function: Callable[..., Image.Image],
+        **stage_kwargs: Any,
+    ) -> Image.Image:
+        # Branch stages all start from the current image (e.g. to recolor the same
+        # preprocessed image with several palettes) and do not advance it
+        output_image, _ = self._run_stage(stage_name, stage_function, stage_kwargs)
+
+        return output_image
+
+    def _run_stage(
+        self,
+        stage_name: str,
+        stage_function: Callable[..., Image.Image],
+        stage_kwargs: dict[str, Any],
+    ) -> tuple[Image.Image, Hashable]:
+        input_image = self.image
+        cached_image: Image.Image | None = None
+        stage_key: Hashable = None
+
+        if self._profiler is not None:
+            self._profiler.begin_stage()
+
+        if self._stage_cache is None:
+            output_image = stage_function(input_image, **stage_kwargs)
+        else:
+            # Each key includes the key of the previous stage, so a changed
+            # parameter invalidates the cached results of all following stages
+            stage_key = (
+                self._stage_key,
+                stage_name,
+                _get_hashable_kwargs(stage_kwargs),
+            )
+
+            cached_image = self._stage_cache.get(stage_key)
+
+            if cached_image is None:
+                output_image = stage_function(input_image, **stage_kwargs)
+                self._stage_cache.put(stage_key, output_image)
+            else:
+                output_image = cached_image
+
+        if self._profiler is not None:
+            self._profiler.end_stage(
+                stage_name, input_image, output_image, cached_image is not None
+            )
+
+        self._completed_stage_count += 1
+
+        if self._progress_callback is not None:
+            self._progress_callback(self._completed_stage_count / self._stage_count)
+
+        return output_image, stage_key
+
+
+def _get_hashable_kwargs(kwargs: dict[str, Any]) -> Hashable:
+    return tuple(
+        (name, tuple(value) if isinstance(value, list) else value)
+        for name, value in sorted(kwargs.items())
+    )
+
+
+def _get_image_size_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
 def _downsample_image(
-    image: Image.Image, factor: int, resampling_mode: Image.Resampling
+    image: Image.Image, factor: int, resampling_mode: ResamplingMode
 ) -> Image.Image:
     if factor < 1:
         raise ValueError("Downsampling factor must not be smaller than 1")
 
+    if isinstance(resampling_mode, BlockResampling):
+        return _downsample_image_blocks(image, factor, resampling_mode)
+
     img_width, img_height = image.size
 
     new_width = img_width // factor
@@ -60,41 +581,321 @@ def _downsample_image(
     return image.resize((new_width, new_height), resample=resampling_mode)
 
 
+def _downsample_image_blocks(
+    image: Image.Image, factor: int, resampling_mode: BlockResampling
+) -> Image.Image:
+    image_array = np.asarray(image)
+    band_shape = image_array.shape[2:]
+
+    # Single-band images get a band axis so that all modes can treat the bands
+    # of a pixel as its color
+    image_array = image_array.reshape(*image_array.shape[:2], -1)
+    img_height, img_width, band_count = image_array.shape
+
+    new_width = img_width // factor
+    new_height = img_height // factor
+
+    # Same error as resizing with the other modes
+    if new_width < 1 or new_height < 1:
+        raise ValueError("height and width must be > 0")
+
+    # Pixels at the right and bottom edges that do not fill a whole block are
+    # cropped, which gives the same size as resizing with the other modes
+    cropped_array = image_array[: new_height * factor, : new_width * factor]
+    block_view = cropped_array.reshape(
+        new_height, factor, new_width, factor, band_count
+    )
+
+    new_image_array: NDArray[np.number]
+
+    match resampling_mode:
+        case BlockResampling.MEAN:
+            # Adding the block rows and columns as slices is much faster than
+            # reducing the short block axes with sum()
+            row_sums = block_view[:, 0].astype(np.uint32)
+
+            for block_row in range(1, factor):
+                row_sums += block_view[:, block_row]
+
+            block_sums = row_sums[:, :, 0].copy()
+
+            for block_column in range(1, factor):
+                block_sums += row_sums[:, :, block_column]
+
+            block_size = factor * factor
+
+            # Integer division with rounding to the nearest value
+            new_image_array = (block_sums + block_size // 2) // block_size
+        case BlockResampling.MEDIAN:
+            new_image_array = np.median(_get_block_pixels(block_view), axis=-1).round()
+        case BlockResampling.MAJORITY:
+            new_image_array = _get_block_majority_colors(_get_block_pixels(block_view))
+        case _:
+            raise ValueError(f"Unsupported resampling mode: {resampling_mode}")
+
+    return Image.fromarray(
+        new_image_array.astype(np.uint8).reshape(new_height, new_width, *band_shape)
+    )
+
+
+def _get_block_pixels(block_view: NDArray[np.uint8]) -> NDArray[np.uint8]:
+    # (rows, block rows, columns, block columns, bands) to
+    # (rows, columns, bands, pixels in block) so that the pixels of each block
+    # and band are contiguous
+    new_height, factor, new_width, _, band_count = block_view.shape
+
+    return block_view.transpose(0, 2, 4, 1, 3).reshape(
+        new_height, new_width, band_count, factor * factor
+    )
+
+
+def _get_block_majority_colors(
+    block_pixels: NDArray[np.uint8],
+) -> NDArray[np.uint8]:
+    new_height, new_width, band_count, block_pixel_count = block_pixels.shape
+    position_bits = (block_pixel_count - 1).bit_length()
+
+    # Sorting 32-bit keys is considerably faster, which covers RGB images with
+    # downsampling factors of up to 16
+    key_dtype: type[np.unsignedinteger] = (
+        np.uint32 if 8 * band_count + position_bits <= 32 else np.uint64
+    )
+
+    packed_colors = np.zeros((new_height, new_width, block_pixel_count), key_dtype)
+
+    for band_index in range(band_count):
+        packed_colors |= block_pixels[:, :, band_index].astype(key_dtype) << (
+            8 * band_index
+        )
+
+    # Sorting makes equal colors of a block adjacent, so the number of occurrences
+    # of each color is the length of its run. The position of each pixel in its
+    # block is stored in the low bits, so that the first pixel of a run is the
+    # first occurrence of its color in the block.
+    pixel_positions = np.arange(block_pixel_count, dtype=key_dtype)
+    sort_keys = np.sort((packed_colors << position_bits) | pixel_positions, axis=-1)
+    sort_keys = sort_keys.reshape(-1)
+
+    sorted_colors = sort_keys >> position_bits
+    sorted_positions = sort_keys & ((1 << position_bits) - 1)
+
+    is_run_start = np.empty(len(sort_keys), dtype=np.bool_)
+    is_run_start[0] = True
+    np.not_equal(sorted_colors[1:], sorted_colors[:-1], out=is_run_start[1:])
+
+    # Runs never span multiple blocks
+    is_run_start[::block_pixel_count] = True
+
+    run_starts = np.flatnonzero(is_run_start)
+    run_lengths = np.diff(run_starts, append=len(sort_keys)).astype(key_dtype)
+
+    # The longest run wins and ties resolve to the color that occurs first in the
+    # block (in row-major order). Scores are unique within each block since the
+    # first occurrences of different colors are at different positions.
+    run_scores = (run_lengths << position_bits) | (
+        block_pixel_count - 1 - sorted_positions[run_starts]
+    )
+
+    block_run_counts = np.count_nonzero(
+        is_run_start.reshape(-1, block_pixel_count), axis=-1
+    )
+    block_first_runs = np.cumsum(block_run_counts) - block_run_counts
+    block_max_scores = np.maximum.reduceat(run_scores, block_first_runs)
+
+    is_majority_run = run_scores == np.repeat(block_max_scores, block_run_counts)
+    majority_colors = sorted_colors[run_starts[is_majority_run]]
+
+    shifts = np.arange(0, 8 * band_count, 8, dtype=key_dtype)
+    majority_pixels = (majority_colors[:, np.newaxis] >> shifts) & 0xFF
+
+    return majority_pixels.reshape(new_height, new_width, band_count)
+
+
+def _convert_to_grayscale(image: Image.Image) -> Image.Image:
+    return image.convert("L").convert("RGB")
+
+
 def _adjust_brightness_and_contrast(
     image: Image.Image, brightness_adjustment: float, contrast_adjustment: float
 ) -> Image.Image:
+    # The adjustment only depends on the value of each channel, so it is applied
+    # as a lookup table in a single uint8 pass
+    lookup_table = _get_brightness_and_contrast_lookup_table(
+        brightness_adjustment, contrast_adjustment
+    )
+
+    return image.point(list(lookup_table) * len(image.getbands()))
+
+
+@lru_cache(maxsize=BRIGHTNESS_CONTRAST_CACHE_SIZE)
+def _get_brightness_and_contrast_lookup_table(
+    brightness_adjustment: float, contrast_adjustment: float
+) -> tuple[int, ...]:
     # Algorithm adapted from GIMP (GNU Image Manipulation Program):
     # https://github.com/GNOME/gimp/blob/master/app/operations/gimpoperationbrightnesscontrast.c
 
-    image_array = np.asarray(image) / 255
+    values = np.arange(256) / 255
 
     if brightness_adjustment == 0:
         pass
     elif brightness_adjustment < 0:
-        image_array *= 1 + 0.5 * brightness_adjustment
+        values *= 1 + 0.5 * brightness_adjustment
     else:
-        image_array = image_array + (1 - image_array) * 0.5 * brightness_adjustment
+        values = values + (1 - values) * 0.5 * brightness_adjustment
 
     if contrast_adjustment != 0:
         contrast_factor = np.tan(0.25 * (1 + contrast_adjustment) * np.pi)
-        image_array = (image_array - 0.5) * contrast_factor + 0.5
+        values = (values - 0.5) * contrast_factor + 0.5
+
+    return tuple((values.clip(min=0, max=1) * 255).astype(np.uint8).tolist())
+
+
+def _recolor_image(
+    image: Image.Image,
+    colors: list[RGBColor],
+    dithering: DitheringMethod = DitheringMethod.NONE,
+    color_metric: ColorMetric = ColorMetric.RGB,
+    memory_budget: int = RECOLOR_MEMORY_BUDGET,
+    matching_method: MatchingMethod = MatchingMethod.AUTO,
+    deduplicate: bool | None = None,
+    workers: int = 1,
+    indexed: bool = False,
+) -> Image.Image:
+    image_array = _get_rgb_array(image)
+    colors_array = np.asarray(colors)
+
+    if dithering is DitheringMethod.NONE:
+        closest_color_indices = find_closest_color_indices(
+            image_array,
+            colors_array,
+            memory_budget,
+            matching_method,
+            deduplicate,
+            workers,
+            color_metric,
+        )
+    else:
+        closest_color_indices = find_dithered_color_indices(
+            image_array,
+            colors_array,
+            dithering,
+            memory_budget,
+            matching_method,
+            workers,
+            color_metric,
+        )
+
+    return _create_recolored_image(closest_color_indices, colors_array, indexed)
+
 
-    image_array = (image_array.clip(min=0, max=1) * 255).astype(np.uint8)
+def _recolor_unique_colors(
+    image: Image.Image,
+    colors: list[RGBColor],
+    unique_colors: NDArray[np.uint8],
+    inverse_indices: NDArray[np.intp],
+    color_metric: ColorMetric = ColorMetric.RGB,
+    memory_budget: int = RECOLOR_MEMORY_BUDGET,
+    matching_method: MatchingMethod = MatchingMethod.AUTO,
+    workers: int = 1,
+    indexed: bool = False,
+) -> Image.Image:
+    # The closest colors of the distinct colors of the image are scattered back
+    # to its pixels
+    colors_array = np.asarray(colors)
+    unique_color_indices = find_closest_color_indices(
+        unique_colors,
+        colors_array,
+        memory_budget,
+        matching_method,
+        deduplicate=False,
+        workers=workers,
+        metric=color_metric,
+    )
+    closest_color_indices = unique_color_indices[inverse_indices].reshape(
+        image.height, image.width
+    )
 
-    return Image.fromarray(image_array)
+    return _create_recolored_image(closest_color_indices, colors_array, indexed)
 
 
-def _recolor_image(image: Image.Image, colors: list[RGBColor]) -> Image.Image:
+def _recolor_image_fused(
+    image: Image.Image,
+    grayscale: bool,
+    brightness_adjustment: float,
+    contrast_adjustment: float,
+    colors: list[RGBColor],
+    dithering: DitheringMethod = DitheringMethod.NONE,
+    color_metric: ColorMetric = ColorMetric.RGB,
+    memory_budget: int = RECOLOR_MEMORY_BUDGET,
+    matching_method: MatchingMethod = MatchingMethod.AUTO,
+    workers: int = 1,
+    indexed: bool = False,
+) -> Image.Image:
+    colors_array = np.asarray(colors)
+    adjustment_table = np.asarray(
+        _get_brightness_and_contrast_lookup_table(
+            brightness_adjustment, contrast_adjustment
+        ),
+        dtype=np.uint8,
+    )
+
+    if grayscale and dithering is DitheringMethod.NONE:
+        # Grayscale images can only contain 256 different values, so the
+        # adjusted and recolored result of every value is combined into a single
+        # table that is applied to all pixels at once
+        adjusted_gray_colors = np.repeat(adjustment_table[:, np.newaxis], 3, axis=-1)
+        color_index_table = find_closest_color_indices(
+            adjusted_gray_colors,
+            colors_array,
+            memory_budget,
+            matching_method,
+            metric=color_metric,
+        )
+
+        closest_color_indices = color_index_table[np.asarray(image.convert("L"))]
+    else:
+        # The adjustments are applied with a single gather while matching then
+        # uses the cached per-palette lookup table for large images
+        if grayscale:
+            gray_image_array = np.asarray(image.convert("L"))
+            image_array = np.repeat(gray_image_array[:, :, np.newaxis], 3, axis=-1)
+        else:
+            image_array = np.asarray(image)[:, :, :3]
+
+        adjusted_image_array = adjustment_table[image_array]
+
+        closest_color_indices = find_dithered_color_indices(
+            adjusted_image_array,
+            colors_array,
+            dithering,
+            memory_budget,
+            matching_method,
+            workers,
+            color_metric,
+        )
+
+    return _create_recolored_image(closest_color_indices, colors_array, indexed)
+
+
+def _get_rgb_array(image: Image.Image) -> NDArray[np.uint8]:
     image_array = np.asarray(image)
 
     # Alpha channel workaround
     if image_array.shape[-1] == 4:
         image_array = image_array[:, :, :3]
 
-    colors_array = np.asarray(colors)
-    rgb_difference_vectors = image_array[:, :, np.newaxis, :] - colors_array
-    rgb_distances = np.linalg.norm(rgb_difference_vectors, axis=-1)
-    closest_color_indices = rgb_distances.argmin(axis=-1)
-    new_image_array = colors_array[closest_color_indices].astype(np.uint8)
+    return image_array
+
+
+def _create_recolored_image(
+    closest_color_indices: NDArray[np.intp],
+    colors_array: NDArray[np.integer],
+    indexed: bool,
+) -> Image.Image:
+    if indexed and len(colors_array) <= INDEXED_OUTPUT_MAX_COLORS:
+        indexed_image = Image.fromarray(closest_color_indices.astype(np.uint8))
+        indexed_image.putpalette(colors_array.astype(np.uint8).tobytes())
+
+        return indexed_image
 
-    return Image.fromarray(new_image_array)
+    return Image.fromarray(colors_array.astype(np.uint8)[closest_color_indices])
@@ -0,0 +1,51 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from enum import Enum, auto
+
+
+class DitheringMethod(Enum):
+    NONE = auto()
+    BAYER_2X2 = auto()
+    BAYER_4X4 = auto()
+    BAYER_8X8 = auto()
+    BLUE_NOISE = auto()
+    FLOYD_STEINBERG = auto()
+    ATKINSON = auto()
+
+
+DITHERING_METHOD_LABELS = {
+    DitheringMethod.NONE: "None",
+    DitheringMethod.BAYER_2X2: "Bayer 2x2",
+    DitheringMethod.BAYER_4X4: "Bayer 4x4",
+    DitheringMethod.BAYER_8X8: "Bayer 8x8",
+    DitheringMethod.BLUE_NOISE: "Blue noise",
+    DitheringMethod.FLOYD_STEINBERG: "Floyd-Steinberg",
+    DitheringMethod.ATKINSON: "Atkinson",
+}
+
+DITHERING_METHOD_NAMES = [
+    method.name.lower().replace("_", "-") for method in DitheringMethod
+]
+
+
+def get_dithering_method(name: str) -> DitheringMethod:
+    member_name = name.upper().replace("-", "_")
+
+    if member_name in DitheringMethod.__members__:
+        return DitheringMethod[member_name]
+
+    raise ValueError(f"Unknown dithering method: '{name}'")
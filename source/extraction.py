@@ -0,0 +1,251 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from enum import Enum, auto
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .matching import get_cell_indices, get_distance_scores
+from .typing import RGBColor
+
+# Palettes are extracted from a random sample of the pixels, which is reduced to
+# a weighted color histogram with 2^HISTOGRAM_BITS values per channel
+PALETTE_SAMPLE_SIZE = 2**18
+HISTOGRAM_BITS = 5
+
+KMEANS_BATCH_SIZE = 1024
+KMEANS_BATCH_COUNT = 64
+
+# Palettes are ranked with a coarser histogram since every bin is compared with
+# every color of every palette. With mean bin colors, this still ranks palettes
+# almost exactly like their full recoloring errors.
+RANKING_HISTOGRAM_BITS = 3
+
+# Upper bound for the temporary bin-color distance arrays while ranking
+RANKING_MEMORY_BUDGET = 64 * 1024**2
+
+_PALETTE_SEED = 0
+
+
+class PaletteExtractionMethod(Enum):
+    MEDIAN_CUT = auto()
+    K_MEANS = auto()
+
+
+def extract_palette_colors(
+    image_array: NDArray[np.uint8],
+    color_count: int,
+    method: PaletteExtractionMethod = PaletteExtractionMethod.K_MEANS,
+) -> list[RGBColor]:
+    rng = np.random.default_rng(_PALETTE_SEED)
+    bin_colors, bin_weights = _get_color_histogram(
+        _sample_pixels(image_array, rng), HISTOGRAM_BITS
+    )
+
+    if len(bin_colors) == 0:
+        return []
+
+    centers = _median_cut(bin_colors, bin_weights, color_count)
+
+    if method is PaletteExtractionMethod.K_MEANS:
+        centers = _refine_k_means(bin_colors, bin_weights, centers, rng)
+    elif method is not PaletteExtractionMethod.MEDIAN_CUT:
+        raise ValueError(f"Unsupported palette extraction method: {method}")
+
+    colors = np.unique(np.rint(centers).clip(0, 255).astype(np.uint8), axis=0)
+
+    # Colors are sorted from dark to bright (by Rec. 601 luma)
+    luma = colors @ np.array([0.299, 0.587, 0.114])
+    colors = colors[np.argsort(luma, kind="stable")]
+
+    return [tuple(color) for color in colors.tolist()]
+
+
+def rank_palettes(
+    image_array: NDArray[np.uint8],
+    palette_colors: NDArray[np.uint8],
+    memory_budget: int = RANKING_MEMORY_BUDGET,
+) -> NDArray[np.float64]:
+    # Returns the mean squared RGB error of recoloring the image with each of the
+    # palettes, which are given as one array of shape (palettes, colors, 3).
+    # Shorter palettes must be padded with duplicates of their own colors.
+    bin_colors, bin_weights = _get_color_histogram(
+        _sample_pixels(image_array, np.random.default_rng(_PALETTE_SEED)),
+        RANKING_HISTOGRAM_BITS,
+    )
+
+    palette_count, max_color_count = palette_colors.shape[:2]
+
+    if len(bin_colors) == 0:
+        return np.zeros(palette_count)
+
+    bin_colors = bin_colors.astype(np.float32)
+
+    # The colors are ordered by slot first, so that the closest color of each
+    # palette is the minimum over a middle axis of the scores (which NumPy reduces
+    # with fast elementwise minimums instead of reducing many short rows)
+    flat_colors = palette_colors.transpose(1, 0, 2).reshape(-1, 3).astype(np.float32)
+
+    chunk_size = memory_budget // (len(flat_colors) * 4)
+    chunk_size = max(1, min(chunk_size, len(bin_colors)))
+
+    # The distance scores leave out |p|^2 of the bins, which is added to the
+    # weighted sum instead
+    errors = np.full(
+        palette_count, bin_weights @ (bin_colors.astype(np.float64) ** 2).sum(axis=-1)
+    )
+
+    for start in range(0, len(bin_colors), chunk_size):
+        stop = start + chunk_size
+
+        scores = get_distance_scores(bin_colors[start:stop], flat_colors)
+
+        closest_scores = scores.reshape(-1, max_color_count, palette_count).min(axis=1)
+        errors += bin_weights[start:stop] @ closest_scores
+
+    return np.maximum(errors, 0) / bin_weights.sum()
+
+
+def _sample_pixels(
+    image_array: NDArray[np.uint8], rng: np.random.Generator
+) -> NDArray[np.uint8]:
+    pixels = image_array.reshape(-1, image_array.shape[-1])
+
+    # Fully transparent pixels do not contribute to the palette
+    if pixels.shape[-1] == 4:
+        pixels = pixels[pixels[:, 3] > 0]
+
+    pixels = pixels[:, :3]
+
+    if len(pixels) > PALETTE_SAMPLE_SIZE:
+        pixels = pixels[rng.integers(0, len(pixels), PALETTE_SAMPLE_SIZE)]
+
+    return pixels
+
+
+def _get_color_histogram(
+    pixels: NDArray[np.uint8], bits: int
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    # Every histogram bin is represented by the mean color of its pixels instead
+    # of the bin center, so no precision is lost for images with few colors
+    bin_indices = get_cell_indices(pixels, bits)
+
+    bin_count = 1 << (3 * bits)
+    bin_weights = np.bincount(bin_indices, minlength=bin_count).astype(np.float64)
+    bin_sums = np.stack(
+        [
+            np.bincount(bin_indices, weights=pixels[:, channel], minlength=bin_count)
+            for channel in range(3)
+        ],
+        axis=-1,
+    )
+
+    used_bins = bin_weights > 0
+
+    return (
+        bin_sums[used_bins] / bin_weights[used_bins, np.newaxis],
+        bin_weights[used_bins],
+    )
+
+
+def _median_cut(
+    bin_colors: NDArray[np.float64], bin_weights: NDArray[np.float64], color_count: int
+) -> NDArray[np.float64]:
+    boxes = [np.arange(len(bin_colors))]
+    box_scores = [_get_box_score(bin_colors, bin_weights, boxes[0])]
+
+    while len(boxes) < color_count:
+        # The box with the largest weighted channel range is split next
+        box_index = int(np.argmax(box_scores))
+
+        if box_scores[box_index] == 0:
+            break
+
+        box = boxes.pop(box_index)
+        box_scores.pop(box_index)
+
+        box_colors = bin_colors[box]
+        channel = np.ptp(box_colors, axis=0).argmax()
+
+        # The box is split at the weighted median of its widest channel, keeping
+        # at least one bin on each side
+        sorted_box = box[np.argsort(box_colors[:, channel], kind="stable")]
+        cumulative_weights = np.cumsum(bin_weights[sorted_box])
+        split_index = np.searchsorted(cumulative_weights, cumulative_weights[-1] / 2)
+        split_index = min(max(split_index, 1), len(sorted_box) - 1)
+
+        for split_box in (sorted_box[:split_index], sorted_box[split_index:]):
+            boxes.append(split_box)
+            box_scores.append(_get_box_score(bin_colors, bin_weights, split_box))
+
+    return np.array(
+        [np.average(bin_colors[box], axis=0, weights=bin_weights[box]) for box in boxes]
+    )
+
+
+def _get_box_score(
+    bin_colors: NDArray[np.float64],
+    bin_weights: NDArray[np.float64],
+    box: NDArray[np.intp],
+) -> float:
+    return float(bin_weights[box].sum() * np.ptp(bin_colors[box], axis=0).max())
+
+
+def _refine_k_means(
+    bin_colors: NDArray[np.float64],
+    bin_weights: NDArray[np.float64],
+    centers: NDArray[np.float64],
+    rng: np.random.Generator,
+) -> NDArray[np.float64]:
+    # Mini-batch k-means (Sculley 2010) with batches of histogram bins drawn in
+    # proportion to their weights. Every center moves towards the mean of its
+    # batch members with a learning rate of one over its total member count.
+    centers = centers.copy()
+    center_counts = np.zeros(len(centers))
+
+    batches = rng.choice(
+        len(bin_colors),
+        size=(KMEANS_BATCH_COUNT, KMEANS_BATCH_SIZE),
+        p=bin_weights / bin_weights.sum(),
+    )
+
+    for batch in batches:
+        batch_colors = bin_colors[batch]
+
+        assignments = get_distance_scores(batch_colors, centers).argmin(axis=-1)
+
+        batch_counts = np.bincount(assignments, minlength=len(centers))
+        batch_sums = np.stack(
+            [
+                np.bincount(
+                    assignments,
+                    weights=batch_colors[:, channel],
+                    minlength=len(centers),
+                )
+                for channel in range(3)
+            ],
+            axis=-1,
+        )
+
+        center_counts += batch_counts
+        updated = batch_counts > 0
+
+        centers[updated] += (
+            batch_sums[updated] - batch_counts[updated, np.newaxis] * centers[updated]
+        ) / center_counts[updated, np.newaxis]
+
+    return centers
@@ -14,11 +14,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import json
-from typing import override
-
-from PIL import Image, ImageColor, ImageQt
-from PyQt6.QtCore import Qt, pyqtSignal
+import math
+from collections import OrderedDict
+from collections.abc import Callable
+from functools import partial
+from threading import Lock
+from typing import TYPE_CHECKING, Any, override
+
+from PIL import Image
+from PyQt6.QtCore import (
+    QObject,
+    QRunnable,
+    QSize,
+    Qt,
+    QThreadPool,
+    QTimer,
+    pyqtSignal,
+)
 from PyQt6.QtGui import (
     QAction,
     QColor,
@@ -28,10 +40,12 @@ from PyQt6.QtGui import (
     QImage,
     QKeySequence,
     QPainter,
+    QPaintEvent,
     QPixmap,
     QResizeEvent,
     QStandardItem,
     QStandardItemModel,
+    qRgb,
 )
 from PyQt6.QtWidgets import (
     QCheckBox,
@@ -43,6 +57,8 @@ from PyQt6.QtWidgets import (
     QLabel,
     QListView,
     QMainWindow,
+    QMessageBox,
+    QProgressBar,
     QPushButton,
     QSizePolicy,
     QSlider,
@@ -52,11 +68,42 @@ from PyQt6.QtWidgets import (
     QWidget,
 )
 
-from source.conversion import convert_image
+from source.dithering import DITHERING_METHOD_LABELS, DitheringMethod
+from source.metrics import COLOR_METRIC_LABELS, ColorMetric
+from source.palettes import PaletteStore, load_palette_store
+from source.profiling import ConversionProfiler
+from source.resampling import (
+    RESAMPLING_MODE_NAMES,
+    ResamplingMode,
+    get_resampling_mode,
+)
 from source.typing import RGBColor
 
-PIXEL_PRESCALE_FACTOR_BASE = 4096
-PALETTES_JSON_PATH = "resources/lospec-palettes-c16-n1024.json"
+# NumPy and the conversion internals are only imported once the first conversion
+# is started to keep the application startup fast
+if TYPE_CHECKING:
+    from source.conversion import StageCache
+
+PROGRESS_BAR_RESOLUTION = 1000
+
+DEFAULT_GENERATED_COLOR_COUNT = 16
+MAX_GENERATED_COLOR_COUNT = 256
+SUGGESTED_PALETTE_COUNT = 10
+
+# Delays (in ms) before a live preview is started after a parameter change and
+# before it is refined to full resolution once parameters stop changing
+PREVIEW_DEBOUNCE_DELAY = 40
+PREVIEW_REFINEMENT_DELAY = 600
+
+# Reduced input images decoded for the full conversion and the live preview
+REDUCED_INPUT_IMAGE_CACHE_SIZE = 2
+
+# Errors raised by Pillow for unreadable, malformed or overly large image files
+_IMAGE_DECODING_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+# Errors of conversions and palette requests, which are reported to the user.
+# Exceptions must not escape the thread pool, which would abort the application.
+_CONVERSION_ERRORS = (*_IMAGE_DECODING_ERRORS, MemoryError)
 
 
 class MainWindow(QMainWindow):
@@ -106,8 +153,15 @@ class MainWindow(QMainWindow):
         self.setMinimumSize(*min_size)
         self.setCentralWidget(gui)
 
+        status_bar = self.statusBar()
+
+        if status_bar is not None:
+            gui.status_message_changed.connect(status_bar.showMessage)
+
 
 class GUI(QWidget):
+    status_message_changed = pyqtSignal(str)
+
     def __init__(
         self, parent: QWidget | None = None, flags: Qt.WindowType | None = None
     ) -> None:
@@ -118,6 +172,7 @@ class GUI(QWidget):
 
         self._image_group_box = ImageGroupBox()
         parameter_group_box = ParameterGroupBox(self._image_group_box)
+        parameter_group_box.status_message_changed.connect(self.status_message_changed)
 
         layout = QHBoxLayout()
         layout.addWidget(parameter_group_box, stretch=1)
@@ -136,6 +191,8 @@ class GUI(QWidget):
 
 
 class DownsamplingGroupBox(QGroupBox):
+    parameters_changed = pyqtSignal()
+
     def __init__(self, parent: QWidget | None = None) -> None:
         super().__init__("Downsampling", parent)
 
@@ -143,6 +200,7 @@ class DownsamplingGroupBox(QGroupBox):
 
         self._factor_spin_box = QSpinBox()
         self._factor_spin_box.setMinimum(1)
+        self._factor_spin_box.valueChanged.connect(self.parameters_changed)
 
         factor_layout = QHBoxLayout()
         factor_layout.addWidget(factor_label)
@@ -153,9 +211,11 @@ class DownsamplingGroupBox(QGroupBox):
 
         self._resampling_combo_box = QComboBox()
 
-        for resampling_mode in Image.Resampling.__members__:
+        for resampling_mode in RESAMPLING_MODE_NAMES:
             self._resampling_combo_box.addItem(resampling_mode.capitalize())
 
+        self._resampling_combo_box.currentIndexChanged.connect(self.parameters_changed)
+
         resampling_layout = QHBoxLayout()
         resampling_layout.addWidget(resampling_label)
         resampling_layout.addStretch(stretch=1)
@@ -177,6 +237,8 @@ class DownsamplingGroupBox(QGroupBox):
 
 
 class ParameterSlider(QWidget):
+    value_changed = pyqtSignal(int)
+
     def __init__(
         self,
         text: str,
@@ -202,6 +264,7 @@ class ParameterSlider(QWidget):
         self._slider.valueChanged.connect(
             lambda: spin_box.setValue(self._slider.value())
         )
+        self._slider.valueChanged.connect(self.value_changed)
 
         if tick_interval is not None:
             self._slider.setTickPosition(QSlider.TickPosition.TicksBelow)
@@ -243,17 +306,23 @@ class ParameterSlider(QWidget):
 
 
 class PreprocessingGroupBox(QGroupBox):
+    parameters_changed = pyqtSignal()
+
     def __init__(self, parent: QWidget | None = None) -> None:
         super().__init__("Preprocessing", parent)
 
         self._grayscale_check_box = QCheckBox("Grayscale conversion")
+        self._grayscale_check_box.toggled.connect(self.parameters_changed)
 
         self._brightness_slider = ParameterSlider(
             "Brightness:", -100, 100, tick_interval=50, min_slider_width=128
         )
+        self._brightness_slider.value_changed.connect(self.parameters_changed)
+
         self._contrast_slider = ParameterSlider(
             "Contrast:", -100, 100, tick_interval=50, min_slider_width=128
         )
+        self._contrast_slider.value_changed.connect(self.parameters_changed)
 
         layout = QVBoxLayout()
         layout.addWidget(self._grayscale_check_box)
@@ -309,6 +378,11 @@ class ColorItem(QStandardItem):
 
 
 class PaletteGroupBox(QGroupBox):
+    parameters_changed = pyqtSignal()
+    palettes_loaded = pyqtSignal()
+    generate_requested = pyqtSignal(int)
+    suggest_requested = pyqtSignal()
+
     def __init__(self, parent: QWidget | None = None) -> None:
         super().__init__("Color Palette", parent)
 
@@ -317,25 +391,26 @@ class PaletteGroupBox(QGroupBox):
             QSizePolicy.Policy.Ignored,
             self._palettes_combo_box.sizePolicy().verticalPolicy(),
         )
-        self._palettes_combo_box.addItem("(Empty Palette)", userData=[])
-
-        with open(PALETTES_JSON_PATH) as json_file:
-            palettes = json.load(json_file)
+        self._palettes_combo_box.addItem("(Empty Palette)", userData=None)
 
-        for palette in palettes.values():
-            palette_text = palette["name"]
-            author = palette["author"]
+        # The palette list is filled after the window is first painted
+        self._palette_store: PaletteStore | None = None
+        self._palettes_scheduled = False
 
-            if author is not None:
-                palette_text += f" ({author})"
-
-            colors = [ImageColor.getrgb(hex_color) for hex_color in palette["colors"]]
+        self._palettes_combo_box.currentIndexChanged.connect(self._load_palette)
 
-            self._palettes_combo_box.addItem(palette_text, userData=colors)
+        self._suggest_button = QPushButton("Suggest")
+        self._suggest_button.clicked.connect(self.suggest_requested)
 
-        self._palettes_combo_box.currentIndexChanged.connect(self._load_palette)
+        palettes_layout = QHBoxLayout()
+        palettes_layout.addWidget(self._palettes_combo_box, stretch=1)
+        palettes_layout.addWidget(self._suggest_button)
 
         self._color_items_model = QStandardItemModel()
+        self._color_items_model.rowsInserted.connect(self.parameters_changed)
+        self._color_items_model.rowsRemoved.connect(self.parameters_changed)
+        self._color_items_model.dataChanged.connect(self.parameters_changed)
+        self._color_items_model.modelReset.connect(self.parameters_changed)
 
         self._color_items_view = QListView()
         self._color_items_view.setModel(self._color_items_model)
@@ -354,13 +429,69 @@ class PaletteGroupBox(QGroupBox):
         bottom_layout.addWidget(self._edit_button)
         bottom_layout.addWidget(self._remove_button)
 
+        color_count_label = QLabel("Colors from image:")
+
+        self._color_count_spin_box = QSpinBox()
+        self._color_count_spin_box.setRange(2, MAX_GENERATED_COLOR_COUNT)
+        self._color_count_spin_box.setValue(DEFAULT_GENERATED_COLOR_COUNT)
+
+        self._generate_button = QPushButton("Generate")
+        self._generate_button.clicked.connect(self._request_generation)
+
+        generate_layout = QHBoxLayout()
+        generate_layout.addWidget(color_count_label)
+        generate_layout.addStretch(stretch=1)
+        generate_layout.addWidget(self._color_count_spin_box)
+        generate_layout.addWidget(self._generate_button)
+
+        dithering_label = QLabel("Dithering:")
+
+        self._dithering_combo_box = QComboBox()
+
+        for dithering_method, dithering_label_text in DITHERING_METHOD_LABELS.items():
+            self._dithering_combo_box.addItem(
+                dithering_label_text, userData=dithering_method
+            )
+
+        self._dithering_combo_box.currentIndexChanged.connect(self.parameters_changed)
+
+        dithering_layout = QHBoxLayout()
+        dithering_layout.addWidget(dithering_label)
+        dithering_layout.addStretch(stretch=1)
+        dithering_layout.addWidget(self._dithering_combo_box)
+
+        metric_label = QLabel("Color distance:")
+
+        self._metric_combo_box = QComboBox()
+
+        for color_metric, metric_label_text in COLOR_METRIC_LABELS.items():
+            self._metric_combo_box.addItem(metric_label_text, userData=color_metric)
+
+        self._metric_combo_box.currentIndexChanged.connect(self.parameters_changed)
+
+        metric_layout = QHBoxLayout()
+        metric_layout.addWidget(metric_label)
+        metric_layout.addStretch(stretch=1)
+        metric_layout.addWidget(self._metric_combo_box)
+
         layout = QVBoxLayout()
-        layout.addWidget(self._palettes_combo_box)
+        layout.addLayout(palettes_layout)
         layout.addWidget(self._color_items_view)
         layout.addLayout(bottom_layout)
+        layout.addLayout(generate_layout)
+        layout.addLayout(dithering_layout)
+        layout.addLayout(metric_layout)
 
         self.setLayout(layout)
 
+    @override
+    def paintEvent(self, event: QPaintEvent) -> None:
+        super().paintEvent(event)
+
+        if self._palette_store is None and not self._palettes_scheduled:
+            QTimer.singleShot(0, self._populate_palettes)
+            self._palettes_scheduled = True
+
     @property
     def colors(self) -> list[RGBColor]:
         colors: list[RGBColor] = []
@@ -373,12 +504,77 @@ class PaletteGroupBox(QGroupBox):
 
         return colors
 
+    @property
+    def dithering(self) -> DitheringMethod:
+        return self._dithering_combo_box.currentData()
+
+    @property
+    def color_metric(self) -> ColorMetric:
+        return self._metric_combo_box.currentData()
+
+    def set_colors(self, colors: list[RGBColor]) -> None:
+        # Setting colors deselects the bundled palette they would otherwise
+        # appear to belong to
+        self._palettes_combo_box.setCurrentIndex(0)
+        self._color_items_model.clear()
+
+        for color in colors:
+            self._color_items_model.appendRow(ColorItem(color))
+
+    def set_suggested_palettes(self, palette_indices: list[int]) -> None:
+        self._populate_palettes()
+
+        if self._palette_store is None:
+            return
+
+        # Suggested palettes are listed first (best first) above the full list,
+        # and the best one is selected
+        self._palettes_combo_box.blockSignals(True)
+        self._palettes_combo_box.clear()
+        self._palettes_combo_box.addItem("(Empty Palette)", userData=None)
+
+        for palette_index in palette_indices:
+            self._palettes_combo_box.addItem(
+                f"Suggested: {self._palette_store.get_label(palette_index)}",
+                userData=palette_index,
+            )
+
+        self._palettes_combo_box.insertSeparator(self._palettes_combo_box.count())
+        self._add_palette_items()
+
+        self._palettes_combo_box.setCurrentIndex(1 if palette_indices else 0)
+        self._palettes_combo_box.blockSignals(False)
+
+        self._load_palette()
+
+    def _populate_palettes(self) -> None:
+        if self._palette_store is not None:
+            return
+
+        # Palette colors are only decoded from the store once a palette is selected
+        self._palette_store = load_palette_store()
+        self._add_palette_items()
+
+        self.palettes_loaded.emit()
+
+    def _add_palette_items(self) -> None:
+        if self._palette_store is None:
+            return
+
+        for palette_index in range(len(self._palette_store)):
+            self._palettes_combo_box.addItem(
+                self._palette_store.get_label(palette_index), userData=palette_index
+            )
+
     def _load_palette(self) -> None:
         self._color_items_model.clear()
 
-        colors = self._palettes_combo_box.currentData()
+        palette_index = self._palettes_combo_box.currentData()
 
-        for color in colors:
+        if palette_index is None or self._palette_store is None:
+            return
+
+        for color in self._palette_store.get_colors(palette_index):
             color_item = ColorItem(color)
 
             self._color_items_model.appendRow(color_item)
@@ -404,6 +600,9 @@ class PaletteGroupBox(QGroupBox):
                 new_color = new_qcolor.getRgb()[:3]
                 color_item.set_color(new_color)  # type: ignore
 
+    def _request_generation(self) -> None:
+        self.generate_requested.emit(self._color_count_spin_box.value())
+
     def _remove_color(self) -> None:
         color_items = self._get_selected_color_items()
 
@@ -424,7 +623,242 @@ class PaletteGroupBox(QGroupBox):
         return selected_items
 
 
+class ConversionCancelledError(Exception):
+    pass
+
+
+class DisplayImage:
+    def __init__(self, image: Image.Image) -> None:
+        if image.mode not in ("RGB", "RGBA", "L", "P"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+        self.image = image
+
+        # The pixel data is copied once (on the thread that creates the display
+        # image) and the QImage wraps that copy, so it has to be kept alive as
+        # long as the QImage is used
+        self._data = image.tobytes()
+        bytes_per_line = len(self._data) // image.height if image.height else 0
+
+        match image.mode:
+            case "RGB":
+                image_format = QImage.Format.Format_RGB888
+            case "RGBA":
+                image_format = QImage.Format.Format_RGBA8888
+            case "P":
+                image_format = QImage.Format.Format_Indexed8
+            case _:
+                image_format = QImage.Format.Format_Grayscale8
+
+        self.qimage = QImage(
+            self._data, image.width, image.height, bytes_per_line, image_format
+        )
+
+        if image.mode == "P":
+            palette = image.getpalette() or []
+            self.qimage.setColorTable(
+                [
+                    qRgb(red, green, blue)
+                    for red, green, blue in zip(
+                        palette[0::3], palette[1::3], palette[2::3]
+                    )
+                ]
+            )
+
+    def to_pixmap(self) -> QPixmap:
+        return QPixmap.fromImage(self.qimage)
+
+
+class InputImage:
+    def __init__(self, file_path: str, image: Image.Image) -> None:
+        self.file_path = file_path
+        self.image = image
+
+        # Reduced images are decoded by the conversion and palette workers, which
+        # may run concurrently
+        self._reduced_images: OrderedDict[
+            tuple[int, ResamplingMode], Image.Image | None
+        ] = OrderedDict()
+        self._lock = Lock()
+
+    def get_image(
+        self, downsampling_factor: int | None, resampling_mode: ResamplingMode
+    ) -> tuple[Image.Image, int | None]:
+        if downsampling_factor is None:
+            return self.image, downsampling_factor
+
+        reduced_image_key = (downsampling_factor, resampling_mode)
+
+        with self._lock:
+            is_cached = reduced_image_key in self._reduced_images
+            reduced_image = self._reduced_images.get(reduced_image_key)
+
+            if is_cached:
+                self._reduced_images.move_to_end(reduced_image_key)
+
+        if not is_cached:
+            reduced_image = self._decode_reduced_image(
+                downsampling_factor, resampling_mode
+            )
+
+            with self._lock:
+                # The first of two concurrently decoded images is kept so that the
+                # stage cache always sees the same source image
+                reduced_image = self._reduced_images.setdefault(
+                    reduced_image_key, reduced_image
+                )
+
+                while len(self._reduced_images) > REDUCED_INPUT_IMAGE_CACHE_SIZE:
+                    self._reduced_images.popitem(last=False)
+
+        # The input image may already be downsampled while decoding, in which case
+        # no further downsampling is necessary
+        if reduced_image is not None:
+            return reduced_image, None
+
+        return self.image, downsampling_factor
+
+    def _decode_reduced_image(
+        self, downsampling_factor: int, resampling_mode: ResamplingMode
+    ) -> Image.Image | None:
+        from source.conversion import can_decode_reduced, decode_image
+
+        try:
+            with Image.open(self.file_path) as image_file:
+                if not can_decode_reduced(
+                    image_file, downsampling_factor, resampling_mode
+                ):
+                    return None
+
+                return decode_image(image_file, downsampling_factor, resampling_mode)
+        except _IMAGE_DECODING_ERRORS:
+            return None
+
+
+class ConversionWorkerSignals(QObject):
+    progress = pyqtSignal(int, float)
+    finished = pyqtSignal(int, DisplayImage, ConversionProfiler)
+    failed = pyqtSignal(int, str)
+
+
+class ConversionWorker(QRunnable):
+    def __init__(
+        self,
+        generation: int,
+        input_image: InputImage,
+        conversion_kwargs: dict[str, Any],
+    ) -> None:
+        super().__init__()
+
+        self.signals = ConversionWorkerSignals()
+
+        self._generation = generation
+        self._input_image = input_image
+        self._conversion_kwargs = conversion_kwargs
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    @override
+    def run(self) -> None:
+        from source.conversion import convert_image
+        from source.matching import DEFAULT_WORKER_COUNT
+
+        # Workers may have been cancelled while waiting for a free thread
+        if self._cancelled:
+            return
+
+        profiler = ConversionProfiler()
+        conversion_kwargs = self._conversion_kwargs.copy()
+
+        try:
+            image, conversion_kwargs["downsampling_factor"] = (
+                self._input_image.get_image(
+                    conversion_kwargs["downsampling_factor"],
+                    conversion_kwargs["resampling_mode"],
+                )
+            )
+            converted_image = convert_image(
+                image,
+                workers=DEFAULT_WORKER_COUNT,
+                progress_callback=self._on_progress,
+                profiler=profiler,
+                **conversion_kwargs,
+            )
+        except ConversionCancelledError:
+            return
+        except _CONVERSION_ERRORS as exception:
+            self.signals.failed.emit(self._generation, str(exception))
+            return
+
+        # The display buffer is created here so that the main thread only has to
+        # upload it to a pixmap
+        self.signals.finished.emit(
+            self._generation, DisplayImage(converted_image), profiler
+        )
+
+    def _on_progress(self, progress: float) -> None:
+        # Raising here aborts the conversion at the next stage boundary
+        if self._cancelled:
+            raise ConversionCancelledError
+
+        self.signals.progress.emit(self._generation, progress)
+
+
+class PaletteWorkerSignals(QObject):
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+
+class PaletteWorker(QRunnable):
+    def __init__(
+        self,
+        generation: int,
+        input_image: InputImage,
+        preprocessing_kwargs: dict[str, Any],
+        stage_cache: "StageCache",
+        palette_function: Callable[[Image.Image], Any],
+    ) -> None:
+        super().__init__()
+
+        self.signals = PaletteWorkerSignals()
+
+        self._generation = generation
+        self._input_image = input_image
+        self._preprocessing_kwargs = preprocessing_kwargs
+        self._stage_cache = stage_cache
+        self._palette_function = palette_function
+
+    @override
+    def run(self) -> None:
+        from source.conversion import convert_image
+
+        preprocessing_kwargs = self._preprocessing_kwargs.copy()
+
+        # Palettes are generated and suggested for the downsampled and
+        # preprocessed image, which is what gets recolored
+        try:
+            image, preprocessing_kwargs["downsampling_factor"] = (
+                self._input_image.get_image(
+                    preprocessing_kwargs["downsampling_factor"],
+                    preprocessing_kwargs["resampling_mode"],
+                )
+            )
+            preprocessed_image = convert_image(
+                image, stage_cache=self._stage_cache, **preprocessing_kwargs
+            )
+            result = self._palette_function(preprocessed_image)
+        except _CONVERSION_ERRORS as exception:
+            self.signals.failed.emit(self._generation, str(exception))
+            return
+
+        self.signals.finished.emit(self._generation, result)
+
+
 class ParameterGroupBox(QGroupBox):
+    status_message_changed = pyqtSignal(str)
+
     def __init__(
         self,
         image_group_box: "ImageGroupBox",
@@ -433,19 +867,73 @@ class ParameterGroupBox(QGroupBox):
         super().__init__("Parameters", parent)
 
         self._image_group_box = image_group_box
+        self._image_group_box.image_loaded.connect(self._on_image_loaded)
+
+        # Keeps intermediate results so that only stages affected by changed
+        # parameters are recomputed (created on the first conversion)
+        self._stage_cache: StageCache | None = None
+
+        # Incremented for every started or cancelled conversion so that results
+        # of outdated conversions can be discarded
+        self._generation = 0
+        self._conversion_worker: ConversionWorker | None = None
+        self._converting_preview = False
+
+        # Incremented for every palette generation or suggestion request and when
+        # a new image is loaded
+        self._palette_generation = 0
+
+        # Live previews are converted at the size of the viewport shortly after
+        # parameters change and refined once they stop changing
+        self._preview_timer = QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(PREVIEW_DEBOUNCE_DELAY)
+        self._preview_timer.timeout.connect(self._convert_preview)
+
+        self._refinement_timer = QTimer(self)
+        self._refinement_timer.setSingleShot(True)
+        self._refinement_timer.setInterval(PREVIEW_REFINEMENT_DELAY)
+        self._refinement_timer.timeout.connect(self._convert_image)
+
+        # Previews run on their own thread so that they never wait for an
+        # outdated full resolution conversion that has not noticed its
+        # cancellation yet
+        self._preview_thread_pool = QThreadPool(self)
+        self._preview_thread_pool.setMaxThreadCount(1)
 
         self._downsampling_group_box = DownsamplingGroupBox()
+        self._downsampling_group_box.parameters_changed.connect(
+            self._on_parameters_changed
+        )
+
         self._preprocessing_group_box = PreprocessingGroupBox()
+        self._preprocessing_group_box.parameters_changed.connect(
+            self._on_parameters_changed
+        )
+
         self._palette_group_box = PaletteGroupBox()
+        self._palette_group_box.parameters_changed.connect(self._on_parameters_changed)
+        self._palette_group_box.generate_requested.connect(self._generate_palette)
+        self._palette_group_box.suggest_requested.connect(self._suggest_palettes)
+
+        self._live_preview_check_box = QCheckBox("Live preview")
+        self._live_preview_check_box.toggled.connect(self._on_live_preview_toggled)
 
         convert_button = QPushButton("Convert image")
         convert_button.clicked.connect(self._convert_image)
 
+        self._progress_bar = QProgressBar()
+        self._progress_bar.setRange(0, PROGRESS_BAR_RESOLUTION)
+        self._progress_bar.setTextVisible(False)
+        self._progress_bar.hide()
+
         layout = QVBoxLayout()
         layout.addWidget(self._downsampling_group_box)
         layout.addWidget(self._preprocessing_group_box)
         layout.addWidget(self._palette_group_box)
         layout.addStretch(stretch=1)
+        layout.addWidget(self._progress_bar)
+        layout.addWidget(self._live_preview_check_box)
         layout.addWidget(convert_button)
 
         self.setLayout(layout)
@@ -454,51 +942,271 @@ class ParameterGroupBox(QGroupBox):
         )
 
     def _convert_image(self) -> None:
-        input_pixmap = self._image_group_box.input_pixmap
+        input_image, preprocessing_kwargs = self._get_preprocessing_parameters()
 
-        if input_pixmap is None:
+        if input_image is None:
             return
 
-        input_image = ImageQt.fromqpixmap(input_pixmap)
+        self._start_conversion(input_image, preprocessing_kwargs)
 
-        downsampling_factor = self._downsampling_group_box.factor
+    def _convert_preview(self) -> None:
+        input_image, preprocessing_kwargs = self._get_preprocessing_parameters()
 
-        if downsampling_factor == 1:
-            downsampling_factor = None
+        if input_image is None:
+            return
 
-        resampling_mode_str = self._downsampling_group_box.resampling_mode
-        resampling_mode = Image.Resampling[resampling_mode_str.upper()]
+        # The preview is downsampled further so that it is not larger than the
+        # viewport, which keeps it fast regardless of the input image size
+        downsampling_factor = preprocessing_kwargs["downsampling_factor"] or 1
+        output_width = input_image.image.width / downsampling_factor
+        output_height = input_image.image.height / downsampling_factor
+
+        viewport_size = self._image_group_box.viewport_size
+        preview_factor = math.ceil(
+            max(
+                output_width / max(viewport_size.width(), 1),
+                output_height / max(viewport_size.height(), 1),
+            )
+        )
+
+        # Without further downsampling the preview would be the final result
+        if preview_factor <= 1:
+            self._start_conversion(input_image, preprocessing_kwargs)
+            return
+
+        preprocessing_kwargs["downsampling_factor"] = (
+            downsampling_factor * preview_factor
+        )
+
+        self._start_conversion(input_image, preprocessing_kwargs, preview=True)
 
-        enable_grayscale = self._preprocessing_group_box.grayscale
-        brightness_adjustment = self._preprocessing_group_box.brightness / 100
-        contrast_adjustment = self._preprocessing_group_box.contrast / 100
+    def _start_conversion(
+        self,
+        input_image: InputImage,
+        preprocessing_kwargs: dict[str, Any],
+        preview: bool = False,
+    ) -> None:
+        self._cancel_conversion()
+        self._preview_timer.stop()
+        self._refinement_timer.stop()
 
         colors: list[RGBColor] | None = self._palette_group_box.colors
 
         if not colors:
             colors = None
 
-        converted_image = convert_image(
+        conversion_kwargs = {
+            **preprocessing_kwargs,
+            "colors": colors,
+            "dithering": self._palette_group_box.dithering,
+            "color_metric": self._palette_group_box.color_metric,
+            "indexed_output": True,
+            "stage_cache": self._get_stage_cache(),
+        }
+
+        self._conversion_worker = ConversionWorker(
+            self._generation, input_image, conversion_kwargs
+        )
+        self._conversion_worker.signals.progress.connect(self._on_conversion_progress)
+        self._conversion_worker.signals.finished.connect(self._on_conversion_finished)
+        self._conversion_worker.signals.failed.connect(self._on_conversion_failed)
+        self._converting_preview = preview
+
+        # Previews finish too quickly for the progress bar to be useful
+        if not preview:
+            self._progress_bar.setValue(0)
+            self._progress_bar.show()
+
+        if preview:
+            self._preview_thread_pool.start(self._conversion_worker)
+        else:
+            thread_pool = QThreadPool.globalInstance()
+
+            if thread_pool is not None:
+                thread_pool.start(self._conversion_worker)
+
+    def _generate_palette(self, color_count: int) -> None:
+        from source.conversion import extract_palette
+
+        self._start_palette_worker(
+            partial(extract_palette, color_count=color_count),
+            self._on_palette_generated,
+            "Generating palette...",
+        )
+
+    def _suggest_palettes(self) -> None:
+        from source.conversion import suggest_palettes
+
+        self._start_palette_worker(
+            partial(
+                suggest_palettes,
+                palette_store=load_palette_store(),
+                count=SUGGESTED_PALETTE_COUNT,
+            ),
+            self._on_palettes_suggested,
+            "Suggesting palettes...",
+        )
+
+    def _start_palette_worker(
+        self,
+        palette_function: Callable[[Image.Image], Any],
+        finished_slot: Callable[[int, Any], None],
+        status_message: str,
+    ) -> None:
+        input_image, preprocessing_kwargs = self._get_preprocessing_parameters()
+
+        if input_image is None:
+            return
+
+        # Only the result of the latest palette request is used
+        self._palette_generation += 1
+
+        palette_worker = PaletteWorker(
+            self._palette_generation,
             input_image,
-            downsampling_factor=downsampling_factor,
-            resampling_mode=resampling_mode,
-            grayscale=enable_grayscale,
-            brightness_adjustment=brightness_adjustment,
-            contrast_adjustment=contrast_adjustment,
-            colors=colors,
+            preprocessing_kwargs,
+            self._get_stage_cache(),
+            palette_function,
         )
-        converted_qimage = QImage(
-            converted_image.tobytes(),
-            converted_image.width,
-            converted_image.height,
-            converted_image.width * 3,
-            QImage.Format.Format_RGB888,
+        palette_worker.signals.finished.connect(finished_slot)
+        palette_worker.signals.failed.connect(self._on_palette_worker_failed)
+
+        thread_pool = QThreadPool.globalInstance()
+
+        if thread_pool is not None:
+            self.status_message_changed.emit(status_message)
+            thread_pool.start(palette_worker)
+
+    def _get_preprocessing_parameters(
+        self,
+    ) -> tuple[InputImage | None, dict[str, Any]]:
+        downsampling_factor: int | None = self._downsampling_group_box.factor
+
+        if downsampling_factor == 1:
+            downsampling_factor = None
+
+        resampling_mode_str = self._downsampling_group_box.resampling_mode
+        resampling_mode = get_resampling_mode(resampling_mode_str)
+
+        # Reduced input images are decoded by the workers to keep the GUI responsive
+        input_image = self._image_group_box.input_image
+
+        preprocessing_kwargs = {
+            "downsampling_factor": downsampling_factor,
+            "resampling_mode": resampling_mode,
+            "grayscale": self._preprocessing_group_box.grayscale,
+            "brightness_adjustment": self._preprocessing_group_box.brightness / 100,
+            "contrast_adjustment": self._preprocessing_group_box.contrast / 100,
+        }
+
+        return input_image, preprocessing_kwargs
+
+    def _get_stage_cache(self) -> "StageCache":
+        if self._stage_cache is None:
+            from source.conversion import StageCache
+
+            self._stage_cache = StageCache()
+
+        return self._stage_cache
+
+    def _cancel_conversion(self) -> None:
+        self._generation += 1
+
+        if self._conversion_worker is not None:
+            self._conversion_worker.cancel()
+            self._conversion_worker = None
+
+        self._progress_bar.hide()
+
+    def _on_parameters_changed(self) -> None:
+        self._cancel_conversion()
+        self._refinement_timer.stop()
+
+        # Consecutive changes (e.g. while dragging a slider) are combined into a
+        # single preview
+        if self._live_preview_check_box.isChecked():
+            self._preview_timer.start()
+        else:
+            self._preview_timer.stop()
+
+    def _on_live_preview_toggled(self, checked: bool) -> None:
+        if checked:
+            self._preview_timer.start()
+        else:
+            self._preview_timer.stop()
+            self._refinement_timer.stop()
+
+    def _on_image_loaded(self) -> None:
+        self._palette_generation += 1
+
+        if self._stage_cache is not None:
+            self._stage_cache.clear()
+
+        self._on_parameters_changed()
+
+    def _on_conversion_progress(self, generation: int, progress: float) -> None:
+        if generation == self._generation:
+            self._progress_bar.setValue(round(progress * PROGRESS_BAR_RESOLUTION))
+
+    def _on_conversion_finished(
+        self,
+        generation: int,
+        display_image: DisplayImage,
+        profiler: ConversionProfiler,
+    ) -> None:
+        if generation != self._generation:
+            return
+
+        output_width, output_height = display_image.image.size
+        status_prefix = "Preview at" if self._converting_preview else "Converted to"
+
+        self.status_message_changed.emit(
+            f"{status_prefix} {output_width}x{output_height}: "
+            + profiler.format_summary()
         )
-        converted_image_pixmap = QPixmap(converted_qimage)
 
-        self._image_group_box.set_output_pixmap(converted_image_pixmap)
+        self._conversion_worker = None
+        self._progress_bar.hide()
+
+        self._image_group_box.set_output_image(
+            display_image, preview=self._converting_preview
+        )
         self._image_group_box.display_output_image()
 
+        if self._converting_preview and self._live_preview_check_box.isChecked():
+            self._refinement_timer.start()
+
+    def _on_palette_generated(self, generation: int, colors: list[RGBColor]) -> None:
+        if generation != self._palette_generation:
+            return
+
+        self._palette_group_box.set_colors(colors)
+        self.status_message_changed.emit(f"Generated a palette of {len(colors)} colors")
+
+    def _on_palettes_suggested(
+        self, generation: int, palette_indices: list[int]
+    ) -> None:
+        if generation != self._palette_generation:
+            return
+
+        self._palette_group_box.set_suggested_palettes(palette_indices)
+        self.status_message_changed.emit(
+            f"Suggested {len(palette_indices)} best fitting palettes"
+        )
+
+    def _on_palette_worker_failed(self, generation: int, message: str) -> None:
+        if generation == self._palette_generation:
+            self.status_message_changed.emit(f"Palette request failed: {message}")
+
+    def _on_conversion_failed(self, generation: int, message: str) -> None:
+        if generation != self._generation:
+            return
+
+        self.status_message_changed.emit(f"Conversion failed: {message}")
+
+        self._conversion_worker = None
+        self._progress_bar.hide()
+
 
 class ImageLabel(QLabel):
     def __init__(
@@ -516,6 +1224,10 @@ class ImageLabel(QLabel):
         self.true_pixmap = pixmap
         self._pixel_mode = pixel_mode
 
+        # Pixel mode paints a nearest-neighbor scaled copy of the true pixmap,
+        # which is only recomputed when the widget size changes
+        self._pixel_scaled_pixmap: QPixmap | None = None
+
         self.setSizePolicy(QSizePolicy.Policy.Ignored, QSizePolicy.Policy.Ignored)
         self.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self._set_resized_pixmap()
@@ -524,33 +1236,42 @@ class ImageLabel(QLabel):
     def resizeEvent(self, event: QResizeEvent) -> None:
         self._set_resized_pixmap()
 
+    @override
+    def paintEvent(self, event: QPaintEvent) -> None:
+        if not self._pixel_mode or self.true_pixmap is None:
+            super().paintEvent(event)
+            return
+
+        scaled_pixmap = self._get_pixel_scaled_pixmap()
+
+        painter = QPainter(self)
+        painter.drawPixmap(
+            (self.width() - scaled_pixmap.width()) // 2,
+            (self.height() - scaled_pixmap.height()) // 2,
+            scaled_pixmap,
+        )
+        painter.end()
+
     @override
     def setPixmap(self, pixmap: QPixmap) -> None:
         self.true_pixmap = pixmap
+        self._pixel_scaled_pixmap = None
         self._set_resized_pixmap()
 
     def remove_pixmap(self) -> None:
         self.true_pixmap = None
+        self._pixel_scaled_pixmap = None
         self.clear()
 
     def _set_resized_pixmap(self) -> None:
-        if self.true_pixmap is not None:
-            if self._pixel_mode:
-                true_width = self.true_pixmap.height()
-                true_height = self.true_pixmap.width()
-
-                prescale_factor = max(
-                    1, PIXEL_PRESCALE_FACTOR_BASE // min(true_width, true_height)
-                )
-
-                prescaled_pixmap = self.true_pixmap.scaled(
-                    self.true_pixmap.size() * prescale_factor,
-                    transformMode=Qt.TransformationMode.FastTransformation,
-                )
-            else:
-                prescaled_pixmap = self.true_pixmap
+        if self.true_pixmap is None:
+            return
 
-            scaled_pixmap = prescaled_pixmap.scaled(
+        if self._pixel_mode:
+            # Scaling is deferred to the next paint event
+            self.update()
+        else:
+            scaled_pixmap = self.true_pixmap.scaled(
                 self.size(),
                 aspectRatioMode=Qt.AspectRatioMode.KeepAspectRatio,
                 transformMode=Qt.TransformationMode.SmoothTransformation,
@@ -558,6 +1279,25 @@ class ImageLabel(QLabel):
 
             super().setPixmap(scaled_pixmap)
 
+    def _get_pixel_scaled_pixmap(self) -> QPixmap:
+        if self.true_pixmap is None:
+            raise ValueError("Image label has no pixmap")
+
+        target_size = self.true_pixmap.size().scaled(
+            self.size(), Qt.AspectRatioMode.KeepAspectRatio
+        )
+
+        if (
+            self._pixel_scaled_pixmap is None
+            or self._pixel_scaled_pixmap.size() != target_size
+        ):
+            self._pixel_scaled_pixmap = self.true_pixmap.scaled(
+                target_size,
+                transformMode=Qt.TransformationMode.FastTransformation,
+            )
+
+        return self._pixel_scaled_pixmap
+
 
 class ImageLabelStack(QStackedWidget):
     image_dropped = pyqtSignal(str)
@@ -600,10 +1340,15 @@ class ImageLabelStack(QStackedWidget):
 
 
 class ImageGroupBox(QGroupBox):
+    image_loaded = pyqtSignal()
+
     def __init__(self, parent: QWidget | None = None) -> None:
         super().__init__("Image (Empty)", parent)
 
         self._output_file_path: str | None = None
+        self._input_image: InputImage | None = None
+        self._output_image: Image.Image | None = None
+        self._output_is_preview = False
 
         self._input_image_label = ImageLabel()
         self._output_image_label = ImageLabel(pixel_mode=True)
@@ -626,15 +1371,28 @@ class ImageGroupBox(QGroupBox):
         self.setLayout(layout)
 
     @property
-    def input_pixmap(self) -> QPixmap | None:
-        return self._input_image_label.true_pixmap
+    def input_image(self) -> InputImage | None:
+        return self._input_image
+
+    @property
+    def viewport_size(self) -> QSize:
+        return self._image_label_stack.size()
 
-    def set_output_pixmap(self, pixmap: QPixmap) -> None:
-        self._output_image_label.setPixmap(pixmap)
+    def set_output_image(
+        self, display_image: DisplayImage, preview: bool = False
+    ) -> None:
+        # Previews are only displayed, saving requires the full resolution image
+        self._output_image = None if preview else display_image.image
+        self._output_image_label.setPixmap(display_image.to_pixmap())
+        self._output_is_preview = preview
 
     def display_output_image(self) -> None:
         self._image_label_stack.setCurrentWidget(self._output_image_label)
-        self.setTitle("Converted Image")
+        self.setTitle(
+            "Converted Image (Preview)"
+            if self._output_is_preview
+            else "Converted Image"
+        )
         self._show_original_button.setChecked(False)
 
     def open_image(self) -> None:
@@ -648,31 +1406,25 @@ class ImageGroupBox(QGroupBox):
     def save_output(self) -> None:
         if self._output_file_path is None:
             self.save_output_as()
-        else:
-            output_pixmap = self._output_image_label.true_pixmap
+        elif self._output_image is not None:
+            from source.conversion import save_image
 
-            if output_pixmap is None:
-                return
-
-            self._save_output_pixmap(output_pixmap, self._output_file_path)
+            # The converted image is saved directly instead of the displayed pixmap
+            save_image(self._output_image, self._output_file_path)
 
     def save_output_as(self) -> None:
-        output_pixmap = self._output_image_label.true_pixmap
-
-        if output_pixmap is None:
+        if self._output_image is None:
             return
 
-        file_path = QFileDialog.getSaveFileName(filter="Images (*.png *.jpg)")[0]
+        file_path = QFileDialog.getSaveFileName(filter="Images (*.png *.gif *.jpg)")[0]
 
         if file_path == "":
             return
 
-        self._save_output_pixmap(output_pixmap, file_path)
-        self._output_file_path = file_path
+        from source.conversion import save_image
 
-    def _save_output_pixmap(self, output_pixmap: QPixmap, file_path: str) -> None:
-        output_image = ImageQt.fromqpixmap(output_pixmap)
-        output_image.save(file_path)
+        save_image(self._output_image, file_path)
+        self._output_file_path = file_path
 
     def _on_display_toggle(self, checked: bool) -> None:
         if checked:
@@ -687,7 +1439,24 @@ class ImageGroupBox(QGroupBox):
         self.setTitle("Original Image")
 
     def _load_image(self, file_path: str) -> None:
-        self._input_image_label.setPixmap(QPixmap(file_path))
+        from source.conversion import decode_image
+
+        try:
+            with Image.open(file_path) as image_file:
+                input_image = decode_image(image_file)
+        except _IMAGE_DECODING_ERRORS as exception:
+            QMessageBox.warning(
+                self, "Open Image", f"Could not open '{file_path}':\n{exception}"
+            )
+            return
+
+        # The decoded image is kept for conversions (so that repeated conversions
+        # can reuse cached intermediate results) and only uploaded for display
+        self._input_image_label.setPixmap(DisplayImage(input_image).to_pixmap())
+        self._input_image = InputImage(file_path, input_image)
+        self._output_image = None
         self._output_image_label.remove_pixmap()
         self._display_input_image()
         self._output_file_path = None
+
+        self.image_loaded.emit()
@@ -0,0 +1,1059 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, auto
+from functools import lru_cache
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .dithering import DitheringMethod
+from .metrics import ColorMetric
+from .typing import RGBColor
+
+# Upper bound for the temporary distance arrays allocated while matching
+RECOLOR_MEMORY_BUDGET = 256 * 1024**2
+
+# The lookup table partitions the RGB cube into cells of 2^(8 - bits) values per
+# channel. Cells whose pixels may have different closest colors are marked as
+# ambiguous and refined by exact matching.
+LOOKUP_TABLE_BITS = 6
+LOOKUP_TABLE_CACHE_SIZE = 32
+
+# Building a lookup table costs about as much as matching one pixel per cell, so
+# smaller images are matched directly when using automatic method selection
+LOOKUP_TABLE_MIN_PIXELS = 2 ** (3 * LOOKUP_TABLE_BITS)
+
+# The grid index partitions the RGB cube like the lookup table but stores all
+# candidate colors of each cell, so pixels only need to be compared with a few
+# nearby palette colors instead of the whole palette
+GRID_INDEX_BITS = 5
+GRID_INDEX_CACHE_SIZE = 32
+
+# Palettes with at least this many colors are matched with the grid index
+# instead of brute force when using automatic method selection
+GRID_INDEX_MIN_COLORS = 16
+
+# Pixels are deduplicated before matching if the estimated ratio of distinct
+# colors to pixels does not exceed this value when using automatic detection
+DEDUPLICATION_MAX_COLOR_RATIO = 0.5
+
+_DEDUPLICATION_SAMPLE_SIZE = 65536
+
+# NumPy releases the GIL in the matching kernels, so row bands of the image can be
+# matched concurrently by a thread pool
+DEFAULT_WORKER_COUNT = os.cpu_count() or 1
+
+# Bands smaller than this do not amortize the overhead of dispatching them
+PARALLEL_MIN_BAND_PIXELS = 16384
+
+# Per pixel and palette color: int32 difference vector (3 * 4 bytes) plus the
+# int32 squared distance (4 bytes)
+_BYTES_PER_DISTANCE = 16
+
+# Perceptual metrics are matched in float32 coordinates in chunks whose
+# temporaries stay in the CPU cache, since the conversion and especially the
+# CIEDE2000 formula take many passes over them
+PERCEPTUAL_CHUNK_BUDGET = 8 * 1024**2
+PALETTE_COORDINATES_CACHE_SIZE = 32
+
+# Per pixel and palette color: one float32 score (plus the pixel coordinates), or
+# about two dozen float32 temporaries of the CIEDE2000 formula
+_BYTES_PER_PERCEPTUAL_SCORE = 8
+_BYTES_PER_CIEDE2000_DISTANCE = 96
+
+_AMBIGUOUS_CELL = -1
+_GRID_SENTINEL_VALUE = 10_000
+
+BLUE_NOISE_TILE_SIZE = 64
+
+# Generating the blue noise mask takes a noticeable amount of time in every new
+# process, so it is shipped as a resource and only regenerated if that is missing
+BLUE_NOISE_RANKS_PATH = f"resources/blue-noise-{BLUE_NOISE_TILE_SIZE}.npy"
+
+_BLUE_NOISE_SIGMA = 1.5
+_BLUE_NOISE_INITIAL_DENSITY = 0.1
+_BLUE_NOISE_SEED = 0
+
+# Linear RGB values of all 8-bit sRGB values, so that the transfer function is
+# never evaluated per pixel
+_SRGB_LINEARIZATION_TABLE = np.where(
+    np.arange(256) / 255 <= 0.04045,
+    np.arange(256) / 255 / 12.92,
+    ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4,
+).astype(np.float32)
+
+# Linear RGB -> LMS and LMS' -> Lab matrices of OKLab (Ottosson 2020)
+_OKLAB_LMS_MATRIX = np.array(
+    [
+        [0.4122214708, 0.5363325363, 0.0514459929],
+        [0.2119034982, 0.6806995451, 0.1073969566],
+        [0.0883024619, 0.2817188376, 0.6299787005],
+    ],
+    dtype=np.float32,
+)
+_OKLAB_LAB_MATRIX = np.array(
+    [
+        [0.2104542553, 0.7936177850, -0.0040720468],
+        [1.9779984951, -2.4285922050, 0.4505937099],
+        [0.0259040371, 0.7827717662, -0.8086757660],
+    ],
+    dtype=np.float32,
+)
+
+# Linear RGB -> XYZ matrix with the rows divided by the D65 white point, so that
+# the CIELAB nonlinearity can be applied directly. L*, a* and b* are then linear
+# combinations of the three transformed values.
+_CIELAB_XYZ_MATRIX = (
+    np.array(
+        [
+            [0.4124564, 0.3575761, 0.1804375],
+            [0.2126729, 0.7151522, 0.0721750],
+            [0.0193339, 0.1191920, 0.9503041],
+        ]
+    )
+    / np.array([[0.95047], [1.0], [1.08883]])
+).astype(np.float32)
+_CIELAB_LAB_MATRIX = np.array(
+    [[0, 116, 0], [500, -500, 0], [0, 200, -200]], dtype=np.float32
+)
+_CIELAB_EPSILON = 216 / 24389
+_CIELAB_KAPPA = 24389 / 27
+
+# (row offset, column offset, weight) of the neighbors that receive the
+# quantization error of a pixel. Atkinson only diffuses 6/8 of the error.
+_ERROR_DIFFUSION_KERNELS = {
+    DitheringMethod.FLOYD_STEINBERG: [
+        (0, 1, 7 / 16),
+        (1, -1, 3 / 16),
+        (1, 0, 5 / 16),
+        (1, 1, 1 / 16),
+    ],
+    DitheringMethod.ATKINSON: [
+        (0, 1, 1 / 8),
+        (0, 2, 1 / 8),
+        (1, -1, 1 / 8),
+        (1, 0, 1 / 8),
+        (1, 1, 1 / 8),
+        (2, 0, 1 / 8),
+    ],
+}
+
+
+class MatchingMethod(Enum):
+    AUTO = auto()
+    BRUTE_FORCE = auto()
+    LOOKUP_TABLE = auto()
+    GRID_INDEX = auto()
+
+
+def find_closest_color_indices(
+    image_array: NDArray[np.uint8],
+    colors_array: NDArray[np.integer],
+    memory_budget: int = RECOLOR_MEMORY_BUDGET,
+    method: MatchingMethod = MatchingMethod.AUTO,
+    deduplicate: bool | None = None,
+    workers: int = 1,
+    metric: ColorMetric = ColorMetric.RGB,
+) -> NDArray[np.intp]:
+    pixels = image_array.reshape(-1, 3)
+    int_colors_array = colors_array.astype(np.int32)
+
+    if deduplicate is None:
+        deduplicate = _estimate_color_ratio(pixels) <= DEDUPLICATION_MAX_COLOR_RATIO
+
+    if deduplicate:
+        # Only the distinct colors are matched, the results are then scattered
+        # back to all pixels sharing the same color
+        unique_colors, inverse_indices = find_unique_colors(pixels)
+        unique_color_indices = _match_pixels_parallel(
+            unique_colors,
+            int_colors_array,
+            memory_budget,
+            method,
+            workers,
+            metric,
+        )
+        closest_color_indices = unique_color_indices[inverse_indices]
+    else:
+        closest_color_indices = _match_pixels_parallel(
+            pixels, int_colors_array, memory_budget, method, workers, metric
+        )
+
+    return closest_color_indices.reshape(image_array.shape[:-1])
+
+
+def find_dithered_color_indices(
+    image_array: NDArray[np.uint8],
+    colors_array: NDArray[np.integer],
+    dithering: DitheringMethod,
+    memory_budget: int = RECOLOR_MEMORY_BUDGET,
+    method: MatchingMethod = MatchingMethod.AUTO,
+    workers: int = 1,
+    metric: ColorMetric = ColorMetric.RGB,
+) -> NDArray[np.intp]:
+    match dithering:
+        case DitheringMethod.NONE:
+            return find_closest_color_indices(
+                image_array,
+                colors_array,
+                memory_budget,
+                method,
+                workers=workers,
+                metric=metric,
+            )
+        case (
+            DitheringMethod.BAYER_2X2
+            | DitheringMethod.BAYER_4X4
+            | DitheringMethod.BAYER_8X8
+            | DitheringMethod.BLUE_NOISE
+        ):
+            # Ordered dithering only offsets the pixels, so the offset image can
+            # still be matched with all the fast matching methods
+            dithered_image_array = _apply_threshold_map(
+                image_array, colors_array, _get_threshold_map(dithering)
+            )
+
+            return find_closest_color_indices(
+                dithered_image_array,
+                colors_array,
+                memory_budget,
+                method,
+                workers=workers,
+                metric=metric,
+            )
+        case DitheringMethod.FLOYD_STEINBERG | DitheringMethod.ATKINSON:
+            return _diffuse_errors(
+                image_array,
+                colors_array,
+                _ERROR_DIFFUSION_KERNELS[dithering],
+                memory_budget,
+                metric,
+            )
+        case _:
+            raise ValueError(f"Unsupported dithering method: {dithering}")
+
+
+def find_unique_colors(
+    image_array: NDArray[np.uint8],
+) -> tuple[NDArray[np.uint8], NDArray[np.intp]]:
+    # Returns the distinct colors and the index of every pixel's color among them
+    unique_packed_colors, inverse_indices = np.unique(
+        _pack_colors(image_array.reshape(-1, 3)), return_inverse=True
+    )
+
+    return _unpack_colors(unique_packed_colors), inverse_indices
+
+
+def clear_palette_caches() -> None:
+    _get_lookup_table.cache_clear()
+    _get_grid_index.cache_clear()
+    _get_palette_coordinates.cache_clear()
+
+
+def _match_pixels_parallel(
+    pixels: NDArray[np.uint8],
+    colors_array: NDArray[np.int32],
+    memory_budget: int,
+    method: MatchingMethod,
+    workers: int,
+    metric: ColorMetric,
+) -> NDArray[np.intp]:
+    # The method is selected for the whole image so that all bands use the same
+    method = _resolve_method(len(pixels), colors_array, method, metric)
+    closest_color_indices = np.empty(len(pixels), dtype=np.intp)
+
+    band_count = min(workers, len(pixels) // PARALLEL_MIN_BAND_PIXELS)
+
+    if band_count <= 1:
+        _match_pixels(
+            pixels, colors_array, memory_budget, method, metric, closest_color_indices
+        )
+        return closest_color_indices
+
+    # Cached palette structures are built once up front instead of concurrently by
+    # every band
+    _prepare_palette_structures(colors_array, method, metric)
+
+    band_size = -(-len(pixels) // band_count)
+    band_memory_budget = memory_budget // band_count
+
+    def match_band(start: int) -> None:
+        stop = start + band_size
+
+        _match_pixels(
+            pixels[start:stop],
+            colors_array,
+            band_memory_budget,
+            method,
+            metric,
+            closest_color_indices[start:stop],
+        )
+
+    executor = _get_thread_pool(workers)
+
+    for future in [
+        executor.submit(match_band, start) for start in range(0, len(pixels), band_size)
+    ]:
+        future.result()
+
+    return closest_color_indices
+
+
+def _match_pixels(
+    pixels: NDArray[np.uint8],
+    colors_array: NDArray[np.int32],
+    memory_budget: int,
+    method: MatchingMethod,
+    metric: ColorMetric,
+    out: NDArray[np.intp],
+) -> None:
+    match _resolve_method(len(pixels), colors_array, method, metric):
+        case MatchingMethod.BRUTE_FORCE if metric is not ColorMetric.RGB:
+            _match_perceptual(pixels, colors_array, metric, memory_budget, out)
+        case MatchingMethod.BRUTE_FORCE:
+            _match_brute_force(pixels, colors_array, memory_budget, out)
+        case MatchingMethod.LOOKUP_TABLE:
+            _match_lookup_table(pixels, colors_array, memory_budget, out)
+        case MatchingMethod.GRID_INDEX:
+            _match_grid_index(pixels, colors_array, memory_budget, out)
+        case _:
+            raise ValueError(f"Unsupported matching method: {method}")
+
+
+def _resolve_method(
+    pixel_count: int,
+    colors_array: NDArray[np.int32],
+    method: MatchingMethod,
+    metric: ColorMetric,
+) -> MatchingMethod:
+    # The lookup table and grid index rely on distance bounds of RGB cells, so
+    # perceptual metrics are always matched by brute force in their coordinates
+    if metric is not ColorMetric.RGB:
+        if method not in (MatchingMethod.AUTO, MatchingMethod.BRUTE_FORCE):
+            raise ValueError(f"Matching method {method} only supports RGB distances")
+
+        return MatchingMethod.BRUTE_FORCE
+
+    if method is not MatchingMethod.AUTO:
+        return method
+
+    if pixel_count >= LOOKUP_TABLE_MIN_PIXELS:
+        return MatchingMethod.LOOKUP_TABLE
+
+    return _select_exact_method(colors_array)
+
+
+def _prepare_palette_structures(
+    colors_array: NDArray[np.int32], method: MatchingMethod, metric: ColorMetric
+) -> None:
+    colors_key = _get_colors_key(colors_array)
+
+    if metric is not ColorMetric.RGB:
+        _get_palette_coordinates(colors_key, metric)
+        return
+
+    if method is MatchingMethod.LOOKUP_TABLE:
+        _get_lookup_table(colors_key, LOOKUP_TABLE_BITS)
+
+        # Ambiguous cells are refined with the exact method
+        method = _select_exact_method(colors_array)
+
+    if method is MatchingMethod.GRID_INDEX:
+        _get_grid_index(colors_key, GRID_INDEX_BITS)
+
+
+@lru_cache
+def _get_thread_pool(workers: int) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recolor")
+
+
+def _get_colors_key(colors_array: NDArray[np.integer]) -> tuple[RGBColor, ...]:
+    return tuple(map(tuple, colors_array.tolist()))
+
+
+def _select_exact_method(colors_array: NDArray[np.int32]) -> MatchingMethod:
+    if len(colors_array) >= GRID_INDEX_MIN_COLORS:
+        return MatchingMethod.GRID_INDEX
+
+    return MatchingMethod.BRUTE_FORCE
+
+
+def _estimate_color_ratio(pixels: NDArray[np.uint8]) -> float:
+    sample_step = max(1, len(pixels) // _DEDUPLICATION_SAMPLE_SIZE)
+    sample = pixels[::sample_step]
+
+    if len(sample) == 0:
+        return 1
+
+    # The distinct color ratio of a sample is an upper estimate for the ratio of
+    # the whole image
+    return len(np.unique(_pack_colors(sample))) / len(sample)
+
+
+def _pack_colors(pixels: NDArray[np.uint8]) -> NDArray[np.uint32]:
+    return (
+        (pixels[:, 0].astype(np.uint32) << np.uint32(16))
+        | (pixels[:, 1].astype(np.uint32) << np.uint32(8))
+        | pixels[:, 2]
+    )
+
+
+def _unpack_colors(packed_colors: NDArray[np.uint32]) -> NDArray[np.uint8]:
+    shifts = np.array([16, 8, 0], dtype=np.uint32)
+
+    return ((packed_colors[:, np.newaxis] >> shifts) & 0xFF).astype(np.uint8)
+
+
+def _match_brute_force(
+    pixels: NDArray[np.uint8],
+    colors_array: NDArray[np.int32],
+    memory_budget: int,
+    out: NDArray[np.intp],
+) -> None:
+    # Pixels are processed in chunks (i.e. row bands for C-contiguous images) so
+    # that the pixel-palette distance arrays never exceed the memory budget
+    chunk_size = memory_budget // (len(colors_array) * _BYTES_PER_DISTANCE)
+    chunk_size = max(1, min(chunk_size, len(pixels)))
+
+    # The scratch buffers are allocated once and reused by all chunks
+    difference_buffer = np.empty((chunk_size, len(colors_array), 3), dtype=np.int32)
+    distance_buffer = np.empty((chunk_size, len(colors_array)), dtype=np.int32)
+
+    for start in range(0, len(pixels), chunk_size):
+        stop = start + chunk_size
+        pixel_chunk = pixels[start:stop]
+        chunk_length = len(pixel_chunk)
+
+        difference_vectors = difference_buffer[:chunk_length]
+        np.subtract(pixel_chunk[:, np.newaxis, :], colors_array, out=difference_vectors)
+
+        _find_closest_differences(
+            difference_vectors, distance_buffer[:chunk_length], out[start:stop]
+        )
+
+
+def _find_closest_differences(
+    difference_vectors: NDArray[np.int32],
+    distance_buffer: NDArray[np.int32],
+    out: NDArray[np.intp],
+) -> None:
+    # Squared distances are compared instead of Euclidean norms: the square root
+    # is monotonic and integer squared distances map to distinct floats, so the
+    # resulting indices (including tie-breaking) are identical
+    difference_vectors *= difference_vectors
+
+    # Adding the channels explicitly is much faster than reducing the short last
+    # axis with sum()
+    squared_distances = np.add(
+        difference_vectors[..., 0], difference_vectors[..., 1], out=distance_buffer
+    )
+    squared_distances += difference_vectors[..., 2]
+    squared_distances.argmin(axis=-1, out=out)
+
+
+def _match_lookup_table(
+    pixels: NDArray[np.uint8],
+    colors_array: NDArray[np.int32],
+    memory_budget: int,
+    out: NDArray[np.intp],
+) -> None:
+    lookup_table = _get_lookup_table(_get_colors_key(colors_array), LOOKUP_TABLE_BITS)
+
+    cell_indices = get_cell_indices(pixels, LOOKUP_TABLE_BITS)
+    out[:] = lookup_table[cell_indices]
+
+    ambiguous_indices = np.flatnonzero(out == _AMBIGUOUS_CELL)
+
+    if len(ambiguous_indices) > 0:
+        ambiguous_color_indices = np.empty(len(ambiguous_indices), dtype=np.intp)
+
+        _match_pixels(
+            pixels[ambiguous_indices],
+            colors_array,
+            memory_budget,
+            _select_exact_method(colors_array),
+            ColorMetric.RGB,
+            ambiguous_color_indices,
+        )
+
+        out[ambiguous_indices] = ambiguous_color_indices
+
+
+def _match_grid_index(
+    pixels: NDArray[np.uint8],
+    colors_array: NDArray[np.int32],
+    memory_budget: int,
+    out: NDArray[np.intp],
+) -> None:
+    cell_candidates = _get_grid_index(_get_colors_key(colors_array), GRID_INDEX_BITS)
+
+    # Padded candidate slots refer to a sentinel color that is farther away from
+    # every pixel than any palette color
+    sentinel_color = np.full((1, 3), _GRID_SENTINEL_VALUE, dtype=np.int32)
+    extended_colors_array = np.concatenate([colors_array, sentinel_color])
+
+    candidate_count = cell_candidates.shape[-1]
+    chunk_size = memory_budget // (candidate_count * _BYTES_PER_DISTANCE)
+    chunk_size = max(1, min(chunk_size, len(pixels)))
+
+    difference_buffer = np.empty((chunk_size, candidate_count, 3), dtype=np.int32)
+    distance_buffer = np.empty((chunk_size, candidate_count), dtype=np.int32)
+    closest_candidates_buffer = np.empty(chunk_size, dtype=np.intp)
+
+    for start in range(0, len(pixels), chunk_size):
+        stop = start + chunk_size
+        pixel_chunk = pixels[start:stop]
+        chunk_length = len(pixel_chunk)
+
+        candidate_indices = cell_candidates[
+            get_cell_indices(pixel_chunk, GRID_INDEX_BITS)
+        ]
+
+        # The candidate colors are gathered into the scratch buffer and the
+        # pixels subtracted in place (the flipped sign does not matter)
+        difference_vectors = difference_buffer[:chunk_length]
+        np.take(
+            extended_colors_array, candidate_indices, axis=0, out=difference_vectors
+        )
+        difference_vectors -= pixel_chunk[:, np.newaxis, :]
+
+        # Candidates are sorted by palette index, so ties still resolve to the
+        # lowest index like with brute force
+        closest_candidates = closest_candidates_buffer[:chunk_length]
+        _find_closest_differences(
+            difference_vectors, distance_buffer[:chunk_length], closest_candidates
+        )
+        out[start:stop] = np.take_along_axis(
+            candidate_indices, closest_candidates[:, np.newaxis], axis=-1
+        )[:, 0]
+
+
+def get_cell_indices(pixels: NDArray[np.uint8], bits: int) -> NDArray[np.int32]:
+    cell_coords = pixels >> (8 - bits)
+
+    return (
+        (cell_coords[:, 0].astype(np.int32) << (2 * bits))
+        | (cell_coords[:, 1].astype(np.int32) << bits)
+        | cell_coords[:, 2]
+    )
+
+
+@lru_cache(maxsize=LOOKUP_TABLE_CACHE_SIZE)
+def _get_lookup_table(colors: tuple[RGBColor, ...], bits: int) -> NDArray[np.int16]:
+    candidate_mask = _get_cell_candidate_mask(np.asarray(colors, dtype=np.int32), bits)
+    candidate_counts = candidate_mask.sum(axis=-1)
+
+    lookup_table = np.where(
+        candidate_counts == 1, candidate_mask.argmax(axis=-1), _AMBIGUOUS_CELL
+    )
+
+    return lookup_table.astype(np.int16)
+
+
+@lru_cache(maxsize=GRID_INDEX_CACHE_SIZE)
+def _get_grid_index(colors: tuple[RGBColor, ...], bits: int) -> NDArray[np.int32]:
+    candidate_mask = _get_cell_candidate_mask(np.asarray(colors, dtype=np.int32), bits)
+    max_candidate_count = candidate_mask.sum(axis=-1).max()
+
+    # Stable sorting moves the candidates of each cell to the front while keeping
+    # them in palette order, the remaining slots are replaced with the sentinel
+    sorted_indices = np.argsort(~candidate_mask, axis=-1, kind="stable")
+    cell_candidates = sorted_indices[:, :max_candidate_count].astype(np.int32)
+
+    sorted_mask = np.take_along_axis(candidate_mask, cell_candidates, axis=-1)
+    cell_candidates[~sorted_mask] = len(colors)
+
+    return cell_candidates
+
+
+def _get_cell_candidate_mask(
+    colors_array: NDArray[np.int32], bits: int
+) -> NDArray[np.bool_]:
+    # A palette color can only be the closest color for any pixel of a cell if
+    # its minimum distance to the cell does not exceed the smallest maximum
+    # distance of all palette colors to the cell. If only a single candidate
+    # remains, it is strictly closer than all other colors for the whole cell.
+    cell_count = 1 << bits
+    cell_size = 256 >> bits
+
+    cell_starts = np.arange(0, 256, cell_size, dtype=np.int32)[:, np.newaxis]
+    cell_ends = cell_starts + cell_size - 1
+
+    min_squared_distances: list[NDArray[np.int32]] = []
+    max_squared_distances: list[NDArray[np.int32]] = []
+
+    for channel in range(3):
+        start_offsets = cell_starts - colors_array[:, channel]
+        end_offsets = colors_array[:, channel] - cell_ends
+
+        min_distances = np.maximum(np.maximum(start_offsets, end_offsets), 0)
+        max_distances = np.maximum(np.abs(start_offsets), np.abs(end_offsets))
+
+        min_squared_distances.append(min_distances**2)
+        max_squared_distances.append(max_distances**2)
+
+    min_green_blue = (
+        min_squared_distances[1][:, np.newaxis, :]
+        + min_squared_distances[2][np.newaxis, :, :]
+    )
+    max_green_blue = (
+        max_squared_distances[1][:, np.newaxis, :]
+        + max_squared_distances[2][np.newaxis, :, :]
+    )
+
+    candidate_mask = np.empty(
+        (cell_count, cell_count, cell_count, len(colors_array)), dtype=np.bool_
+    )
+
+    # One red slice at a time to keep the temporary arrays small for large
+    # palettes
+    for red_index in range(cell_count):
+        cell_min_distances = min_squared_distances[0][red_index] + min_green_blue
+        cell_max_distances = max_squared_distances[0][red_index] + max_green_blue
+
+        distance_bounds = cell_max_distances.min(axis=-1, keepdims=True)
+        candidate_mask[red_index] = cell_min_distances <= distance_bounds
+
+    return candidate_mask.reshape(-1, len(colors_array))
+
+
+def _match_perceptual(
+    pixels: NDArray[np.uint8],
+    colors_array: NDArray[np.integer],
+    metric: ColorMetric,
+    memory_budget: int,
+    out: NDArray[np.intp],
+) -> None:
+    palette_coordinates = _get_palette_coordinates(
+        _get_colors_key(colors_array), metric
+    )
+
+    if metric is ColorMetric.CIELAB_DE2000:
+        bytes_per_distance = _BYTES_PER_CIEDE2000_DISTANCE
+    else:
+        bytes_per_distance = _BYTES_PER_PERCEPTUAL_SCORE
+
+    chunk_size = min(memory_budget, PERCEPTUAL_CHUNK_BUDGET) // (
+        len(colors_array) * bytes_per_distance
+    )
+    chunk_size = max(1, min(chunk_size, len(pixels)))
+
+    score_buffer = np.empty((chunk_size, len(colors_array)), dtype=np.float32)
+
+    for start in range(0, len(pixels), chunk_size):
+        stop = start + chunk_size
+        pixel_coordinates = _convert_to_perceptual(pixels[start:stop], metric)
+
+        if metric is ColorMetric.CIELAB_DE2000:
+            scores = _get_ciede2000_squared_distances(
+                pixel_coordinates, palette_coordinates
+            )
+        else:
+            scores = get_distance_scores(
+                pixel_coordinates,
+                palette_coordinates,
+                out=score_buffer[: len(pixel_coordinates)],
+            )
+
+        scores.argmin(axis=-1, out=out[start:stop])
+
+
+def get_distance_scores(
+    points: NDArray[np.floating],
+    colors: NDArray[np.floating],
+    out: NDArray[np.floating] | None = None,
+) -> NDArray[np.floating]:
+    # |p - c|^2 = |p|^2 - 2 p.c + |c|^2, where |p|^2 is the same for all colors
+    # and can be left out, so the squared distances of all points to all colors
+    # are ranked by a single matrix product
+    scores = np.matmul(points, -2 * colors.T, out=out)
+    scores += (colors**2).sum(axis=-1)
+
+    return scores
+
+
+@lru_cache(maxsize=PALETTE_COORDINATES_CACHE_SIZE)
+def _get_palette_coordinates(
+    colors: tuple[RGBColor, ...], metric: ColorMetric
+) -> NDArray[np.float32]:
+    return _convert_to_perceptual(np.asarray(colors, dtype=np.uint8), metric)
+
+
+def _convert_to_perceptual(
+    pixels: NDArray[np.uint8], metric: ColorMetric
+) -> NDArray[np.float32]:
+    linear_pixels = _SRGB_LINEARIZATION_TABLE[pixels]
+
+    match metric:
+        case ColorMetric.OKLAB:
+            lms_pixels: NDArray[np.float32] = linear_pixels @ _OKLAB_LMS_MATRIX.T
+            np.cbrt(lms_pixels, out=lms_pixels)
+
+            return lms_pixels @ _OKLAB_LAB_MATRIX.T
+        case ColorMetric.CIELAB_DE76 | ColorMetric.CIELAB_DE2000:
+            xyz_pixels = linear_pixels @ _CIELAB_XYZ_MATRIX.T
+            xyz_pixels = np.where(
+                xyz_pixels > _CIELAB_EPSILON,
+                np.cbrt(xyz_pixels),
+                (_CIELAB_KAPPA * xyz_pixels + 16) / 116,
+            )
+
+            lab_pixels = xyz_pixels @ _CIELAB_LAB_MATRIX.T
+            lab_pixels[:, 0] -= 16
+
+            return lab_pixels
+        case _:
+            raise ValueError(f"Unsupported color metric: {metric}")
+
+
+def _get_ciede2000_squared_distances(
+    pixel_coordinates: NDArray[np.float32], palette_coordinates: NDArray[np.float32]
+) -> NDArray[np.float32]:
+    # CIEDE2000 (Sharma et al. 2005) between all pixels (rows) and palette colors
+    # (columns). The squared color difference is returned since only its order
+    # matters for matching.
+    pixel_l, pixel_a, pixel_b = pixel_coordinates.T[:, :, np.newaxis]
+    color_l, color_a, color_b = palette_coordinates.T
+
+    pixel_chroma = np.sqrt(pixel_a**2 + pixel_b**2)
+    color_chroma = np.sqrt(color_a**2 + color_b**2)
+    mean_chroma_7 = ((pixel_chroma + color_chroma) / 2) ** 7
+    a_scale = 1.5 - 0.5 * np.sqrt(mean_chroma_7 / (mean_chroma_7 + 25.0**7))
+
+    pixel_a_prime = pixel_a * a_scale
+    color_a_prime = color_a * a_scale
+    pixel_chroma_prime = np.sqrt(pixel_a_prime**2 + pixel_b**2)
+    color_chroma_prime = np.sqrt(color_a_prime**2 + color_b**2)
+
+    # The hue difference is the signed angle between the (a', b) vectors, which is
+    # exactly 180 degrees for opposite hues. The reference formulation (with hue
+    # angles in [0, 360) degrees) resolves these by the order of the hues. The
+    # hue difference is zero and the mean hue does not matter if either color is
+    # achromatic.
+    pixel_hue = np.arctan2(pixel_b, pixel_a_prime)
+    pixel_hue = np.where(pixel_hue < 0, pixel_hue + 2 * np.pi, pixel_hue)
+
+    hue_difference = np.arctan2(
+        pixel_a_prime * color_b - pixel_b * color_a_prime,
+        pixel_a_prime * color_a_prime + pixel_b * color_b,
+    )
+    half_turn = np.float32(np.pi)
+    hue_difference = np.where(
+        np.abs(hue_difference) == half_turn,
+        np.where(pixel_hue < half_turn, half_turn, -half_turn),
+        hue_difference,
+    )
+    hue_distance = (
+        2
+        * np.sqrt(pixel_chroma_prime * color_chroma_prime)
+        * np.sin(hue_difference / 2)
+    )
+
+    # Halfway from the pixel hue to the palette color hue, which is the mean of
+    # both hue angles after wrapping pairs more than 180 degrees apart
+    mean_hue = pixel_hue + hue_difference / 2
+    mean_hue = np.where(mean_hue < 0, mean_hue + 2 * np.pi, mean_hue)
+    mean_hue = np.where(mean_hue >= 2 * np.pi, mean_hue - 2 * np.pi, mean_hue)
+
+    mean_lightness_offset = ((pixel_l + color_l) / 2 - 50) ** 2
+    mean_chroma = (pixel_chroma_prime + color_chroma_prime) / 2
+    mean_chroma_prime_7 = mean_chroma**7
+
+    hue_weighting = (
+        1
+        - 0.17 * np.cos(mean_hue - np.pi / 6)
+        + 0.24 * np.cos(2 * mean_hue)
+        + 0.32 * np.cos(3 * mean_hue + np.pi / 30)
+        - 0.20 * np.cos(4 * mean_hue - 0.35 * np.pi)
+    )
+
+    rotation_angle = (
+        np.pi
+        / 6
+        * np.exp(-(((mean_hue - 275 / 180 * np.pi) / (25 / 180 * np.pi)) ** 2))
+    )
+    rotation = (
+        -2
+        * np.sqrt(mean_chroma_prime_7 / (mean_chroma_prime_7 + 25.0**7))
+        * np.sin(2 * rotation_angle)
+    )
+
+    lightness_term = (color_l - pixel_l) / (
+        1 + 0.015 * mean_lightness_offset / np.sqrt(20 + mean_lightness_offset)
+    )
+    chroma_term = (color_chroma_prime - pixel_chroma_prime) / (1 + 0.045 * mean_chroma)
+    hue_term = hue_distance / (1 + 0.015 * mean_chroma * hue_weighting)
+
+    return (
+        lightness_term**2
+        + chroma_term**2
+        + hue_term**2
+        + rotation * chroma_term * hue_term
+    )
+
+
+def _apply_threshold_map(
+    image_array: NDArray[np.uint8],
+    colors_array: NDArray[np.integer],
+    threshold_map: NDArray[np.float32],
+) -> NDArray[np.uint8]:
+    img_height, img_width = image_array.shape[:2]
+    map_height, map_width = threshold_map.shape
+
+    # The threshold map is tiled over the image by indexing instead of copying
+    tiled_thresholds = threshold_map[
+        (np.arange(img_height) % map_height)[:, np.newaxis],
+        np.arange(img_width) % map_width,
+    ]
+    offsets = tiled_thresholds * _get_dithering_spread(colors_array)
+
+    dithered_image_array = image_array + offsets[:, :, np.newaxis]
+    np.round(dithered_image_array, out=dithered_image_array)
+    np.clip(dithered_image_array, 0, 255, out=dithered_image_array)
+
+    return dithered_image_array.astype(np.uint8)
+
+
+def _get_dithering_spread(colors_array: NDArray[np.integer]) -> float:
+    if len(colors_array) < 2:
+        return 0
+
+    # Pixels are offset along the gray axis by up to half the typical distance
+    # between neighboring palette colors, so that pixels between two neighboring
+    # palette colors are dithered between them. The distance is scaled to a
+    # per-channel offset since the same offset is added to every channel
+    float_colors = colors_array.astype(np.float32)
+    squared_distances = ((float_colors[:, np.newaxis, :] - float_colors) ** 2).sum(
+        axis=-1
+    )
+    np.fill_diagonal(squared_distances, np.inf)
+
+    return float(
+        np.median(np.sqrt(squared_distances.min(axis=-1) / colors_array.shape[-1]))
+    )
+
+
+@lru_cache
+def _get_threshold_map(dithering: DitheringMethod) -> NDArray[np.float32]:
+    match dithering:
+        case DitheringMethod.BAYER_2X2:
+            ranks = _get_bayer_matrix(1)
+        case DitheringMethod.BAYER_4X4:
+            ranks = _get_bayer_matrix(2)
+        case DitheringMethod.BAYER_8X8:
+            ranks = _get_bayer_matrix(3)
+        case DitheringMethod.BLUE_NOISE:
+            ranks = _load_blue_noise_ranks(BLUE_NOISE_TILE_SIZE)
+        case _:
+            raise ValueError(f"Unsupported ordered dithering method: {dithering}")
+
+    # Ranks are mapped to thresholds that are centered around zero
+    return ((ranks + 0.5) / ranks.size - 0.5).astype(np.float32)
+
+
+def _get_bayer_matrix(order: int) -> NDArray[np.int32]:
+    bayer_matrix = np.zeros((1, 1), dtype=np.int32)
+
+    for _ in range(order):
+        bayer_matrix = np.block(
+            [
+                [4 * bayer_matrix, 4 * bayer_matrix + 2],
+                [4 * bayer_matrix + 3, 4 * bayer_matrix + 1],
+            ]
+        )
+
+    return bayer_matrix
+
+
+def _load_blue_noise_ranks(
+    size: int, ranks_path: str = BLUE_NOISE_RANKS_PATH
+) -> NDArray[np.int32]:
+    try:
+        ranks: NDArray[np.int32] = np.load(ranks_path)
+
+        if ranks.shape == (size, size) and ranks.dtype == np.int32:
+            return ranks
+    except (OSError, ValueError):
+        pass
+
+    ranks = _get_blue_noise_ranks(size)
+
+    # Writing to a temporary file first prevents partially written masks, even
+    # if several worker processes regenerate the mask at the same time
+    temp_ranks_path = f"{ranks_path}.{os.getpid()}.tmp"
+
+    try:
+        with open(temp_ranks_path, "wb") as ranks_file:
+            np.save(ranks_file, ranks)
+
+        os.replace(temp_ranks_path, ranks_path)
+    except OSError:
+        # The mask still works from memory if the resources are read-only
+        pass
+
+    return ranks
+
+
+def _get_blue_noise_ranks(size: int) -> NDArray[np.int32]:
+    # Void-and-cluster algorithm (Ulichney 1993): pixels are ranked by repeatedly
+    # removing the tightest cluster or filling the largest void of a binary
+    # pattern, measured with a toroidally wrapped Gaussian filter
+    offsets = np.minimum(np.arange(size), size - np.arange(size))
+    gaussian_kernel = np.exp(
+        -(offsets[:, np.newaxis] ** 2 + offsets**2) / (2 * _BLUE_NOISE_SIGMA**2)
+    )
+
+    def toggle(
+        pattern: NDArray[np.bool_], energy: NDArray[np.float64], index: int
+    ) -> None:
+        row, column = divmod(index, size)
+        sign = -1 if pattern[row, column] else 1
+
+        pattern[row, column] = not pattern[row, column]
+        energy += sign * np.roll(gaussian_kernel, (row, column), axis=(0, 1))
+
+    def get_energy(pattern: NDArray[np.bool_]) -> NDArray[np.float64]:
+        return np.real(
+            np.fft.ifft2(np.fft.fft2(pattern) * np.fft.fft2(gaussian_kernel))
+        )
+
+    def tightest_cluster(
+        pattern: NDArray[np.bool_], energy: NDArray[np.float64]
+    ) -> int:
+        return int(np.where(pattern, energy, -np.inf).argmax())
+
+    def largest_void(pattern: NDArray[np.bool_], energy: NDArray[np.float64]) -> int:
+        return int(np.where(pattern, np.inf, energy).argmin())
+
+    rng = np.random.default_rng(_BLUE_NOISE_SEED)
+    initial_pattern = rng.random((size, size)) < _BLUE_NOISE_INITIAL_DENSITY
+    initial_energy = get_energy(initial_pattern)
+
+    # The initial pattern is made homogeneous by moving the tightest cluster
+    # into the largest void until that would not change the pattern anymore
+    while True:
+        cluster_index = tightest_cluster(initial_pattern, initial_energy)
+        toggle(initial_pattern, initial_energy, cluster_index)
+        void_index = largest_void(initial_pattern, initial_energy)
+
+        if void_index == cluster_index:
+            toggle(initial_pattern, initial_energy, cluster_index)
+            break
+
+        toggle(initial_pattern, initial_energy, void_index)
+
+    ranks = np.empty(size * size, dtype=np.int32)
+    initial_point_count = int(initial_pattern.sum())
+
+    # Phase 1: the initial points are ranked by removing the tightest clusters
+    pattern = initial_pattern.copy()
+    energy = initial_energy.copy()
+
+    for rank in range(initial_point_count - 1, -1, -1):
+        cluster_index = tightest_cluster(pattern, energy)
+        toggle(pattern, energy, cluster_index)
+        ranks[cluster_index] = rank
+
+    # Phase 2: the largest voids are filled until half of the pixels are set
+    pattern = initial_pattern
+    energy = initial_energy
+
+    for rank in range(initial_point_count, size * size // 2):
+        void_index = largest_void(pattern, energy)
+        toggle(pattern, energy, void_index)
+        ranks[void_index] = rank
+
+    # Phase 3: the remaining pixels are ranked by the tightest clusters of the
+    # unset pixels
+    pattern = ~pattern
+    energy = get_energy(pattern)
+
+    for rank in range(size * size // 2, size * size):
+        cluster_index = tightest_cluster(pattern, energy)
+        toggle(pattern, energy, cluster_index)
+        ranks[cluster_index] = rank
+
+    return ranks.reshape(size, size)
+
+
+def _diffuse_errors(
+    image_array: NDArray[np.uint8],
+    colors_array: NDArray[np.integer],
+    kernel: list[tuple[int, int, float]],
+    memory_budget: int,
+    metric: ColorMetric,
+) -> NDArray[np.intp]:
+    img_height, img_width = image_array.shape[:2]
+
+    float_colors = colors_array.astype(np.float32)
+
+    closest_color_indices = np.empty((img_height, img_width), dtype=np.intp)
+
+    # Every kernel only diffuses errors to the right in the same row and to the
+    # rows below, within two columns to the left. Pixel (y, x) therefore only
+    # depends on pixels with a smaller x + 2y, so all pixels on a wavefront with
+    # the same x + 2y can be quantized at once. A neighbor at (dy, dx) is on the
+    # wavefront dx + 2dy ahead.
+    wavefront_offsets = [
+        column_offset + 2 * row_offset for row_offset, column_offset, _ in kernel
+    ]
+    max_row_offset = max(row_offset for row_offset, _, _ in kernel)
+
+    # Diffused errors are accumulated per wavefront and row in a ring buffer that
+    # only covers the wavefronts that can still receive errors
+    ring_size = max(wavefront_offsets) + 1
+    error_ring = np.zeros((ring_size, img_height + max_row_offset, 3), dtype=np.float32)
+
+    for wavefront in range(img_width + 2 * (img_height - 1)):
+        first_row = max(0, (wavefront - img_width + 2) // 2)
+        last_row = min(img_height - 1, wavefront // 2)
+
+        rows = np.arange(first_row, last_row + 1)
+        columns = wavefront - 2 * rows
+
+        wavefront_errors = error_ring[wavefront % ring_size]
+        pixels = image_array[rows, columns] + wavefront_errors[first_row : last_row + 1]
+        np.clip(pixels, 0, 255, out=pixels)
+        wavefront_errors.fill(0)
+
+        if metric is ColorMetric.RGB:
+            pixel_color_indices = get_distance_scores(pixels, float_colors).argmin(
+                axis=-1
+            )
+        else:
+            # Perceptual coordinates are only tabulated for 8-bit values
+            pixel_color_indices = np.empty(len(pixels), dtype=np.intp)
+            _match_perceptual(
+                np.rint(pixels).astype(np.uint8),
+                colors_array,
+                metric,
+                memory_budget,
+                pixel_color_indices,
+            )
+        closest_color_indices[rows, columns] = pixel_color_indices
+
+        errors = pixels - float_colors[pixel_color_indices]
+
+        for (row_offset, _, weight), wavefront_offset in zip(kernel, wavefront_offsets):
+            neighbor_errors = error_ring[(wavefront + wavefront_offset) % ring_size]
+            neighbor_errors[first_row + row_offset : last_row + 1 + row_offset] += (
+                errors * weight
+            )
+
+    return closest_color_indices
@@ -0,0 +1,43 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from enum import Enum, auto
+
+
+class ColorMetric(Enum):
+    RGB = auto()
+    OKLAB = auto()
+    CIELAB_DE76 = auto()
+    CIELAB_DE2000 = auto()
+
+
+COLOR_METRIC_LABELS = {
+    ColorMetric.RGB: "RGB",
+    ColorMetric.OKLAB: "OKLab",
+    ColorMetric.CIELAB_DE76: "CIELAB ΔE76",
+    ColorMetric.CIELAB_DE2000: "CIELAB ΔE2000",
+}
+
+COLOR_METRIC_NAMES = [metric.name.lower().replace("_", "-") for metric in ColorMetric]
+
+
+def get_color_metric(name: str) -> ColorMetric:
+    member_name = name.upper().replace("-", "_")
+
+    if member_name in ColorMetric.__members__:
+        return ColorMetric[member_name]
+
+    raise ValueError(f"Unknown color metric: '{name}'")
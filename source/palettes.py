@@ -0,0 +1,196 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import struct
+from functools import lru_cache
+
+from PIL import ImageColor
+
+from .typing import RGBColor
+
+PALETTES_JSON_PATH = "resources/lospec-palettes-c16-n1024.json"
+PALETTE_STORE_PATH = "resources/lospec-palettes-c16-n1024.bin"
+
+# Store layout: header, (palette count + 1) uint32 color offsets, packed RGB bytes
+# of all palettes, and a UTF-8 table of NUL-separated keys, names and authors
+_STORE_MAGIC = b"PPCS"
+_STORE_VERSION = 1
+_STORE_HEADER = struct.Struct("<4sHI")
+_STORE_TEXT_SEPARATOR = "\0"
+
+
+class PaletteStore:
+    def __init__(
+        self,
+        keys: list[str],
+        names: list[str],
+        authors: list[str | None],
+        color_offsets: tuple[int, ...],
+        color_data: bytes,
+    ) -> None:
+        self.keys = keys
+        self.names = names
+        self.authors = authors
+
+        # Colors of palette i are stored in color_data[3 * color_offsets[i] :
+        # 3 * color_offsets[i + 1]] and only decoded when requested
+        self.color_offsets = color_offsets
+        self.color_data = color_data
+
+    @classmethod
+    def from_json(cls, json_path: str = PALETTES_JSON_PATH) -> "PaletteStore":
+        with open(json_path) as json_file:
+            palettes = json.load(json_file)
+
+        keys: list[str] = []
+        names: list[str] = []
+        authors: list[str | None] = []
+        color_offsets = [0]
+        color_data = bytearray()
+
+        for key, palette in palettes.items():
+            keys.append(key)
+            names.append(palette["name"])
+            authors.append(palette["author"])
+
+            for color in parse_hex_colors(palette["colors"]):
+                color_data.extend(color)
+
+            color_offsets.append(len(color_data) // 3)
+
+        return cls(keys, names, authors, tuple(color_offsets), bytes(color_data))
+
+    @classmethod
+    def load(cls, store_path: str = PALETTE_STORE_PATH) -> "PaletteStore":
+        with open(store_path, "rb") as store_file:
+            store_data = store_file.read()
+
+        magic, version, palette_count = _STORE_HEADER.unpack_from(store_data)
+
+        if magic != _STORE_MAGIC or version != _STORE_VERSION:
+            raise ValueError(f"Unsupported palette store: '{store_path}'")
+
+        offsets_format = f"<{palette_count + 1}I"
+        color_offsets = struct.unpack_from(
+            offsets_format, store_data, _STORE_HEADER.size
+        )
+
+        color_data_start = _STORE_HEADER.size + struct.calcsize(offsets_format)
+        text_start = color_data_start + 3 * color_offsets[-1]
+
+        color_data = store_data[color_data_start:text_start]
+        text_fields = store_data[text_start:].decode().split(_STORE_TEXT_SEPARATOR)
+
+        keys = text_fields[:palette_count]
+        names = text_fields[palette_count : 2 * palette_count]
+        authors: list[str | None] = [
+            author or None for author in text_fields[2 * palette_count :]
+        ]
+
+        return cls(keys, names, authors, color_offsets, color_data)
+
+    def save(self, store_path: str = PALETTE_STORE_PATH) -> None:
+        text_fields = [
+            *self.keys,
+            *self.names,
+            *(author or "" for author in self.authors),
+        ]
+
+        store_data = b"".join(
+            [
+                _STORE_HEADER.pack(_STORE_MAGIC, _STORE_VERSION, len(self)),
+                struct.pack(f"<{len(self.color_offsets)}I", *self.color_offsets),
+                self.color_data,
+                _STORE_TEXT_SEPARATOR.join(text_fields).encode(),
+            ]
+        )
+
+        # Writing to a temporary file first prevents partially written stores
+        temp_store_path = f"{store_path}.tmp"
+
+        with open(temp_store_path, "wb") as store_file:
+            store_file.write(store_data)
+
+        os.replace(temp_store_path, store_path)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get_label(self, index: int) -> str:
+        label = self.names[index]
+        author = self.authors[index]
+
+        if author is not None:
+            label += f" ({author})"
+
+        return label
+
+    def get_colors(self, index: int) -> list[RGBColor]:
+        color_bytes = self.color_data[
+            3 * self.color_offsets[index] : 3 * self.color_offsets[index + 1]
+        ]
+
+        return [
+            (color_bytes[i], color_bytes[i + 1], color_bytes[i + 2])
+            for i in range(0, len(color_bytes), 3)
+        ]
+
+    def find(self, palette_name: str) -> int:
+        # Palettes can be referenced by their lospec slug (e.g. "sweetie-16") or
+        # by their display name (e.g. "Sweetie 16")
+        if palette_name in self.keys:
+            return self.keys.index(palette_name)
+
+        for index, name in enumerate(self.names):
+            if name.casefold() == palette_name.casefold():
+                return index
+
+        raise ValueError(f"Unknown palette: '{palette_name}'")
+
+
+@lru_cache(maxsize=1)
+def load_palette_store(
+    json_path: str = PALETTES_JSON_PATH, store_path: str = PALETTE_STORE_PATH
+) -> PaletteStore:
+    # The compact store is rebuilt whenever it is missing or older than the JSON
+    # file it was created from
+    try:
+        if os.path.getmtime(store_path) >= os.path.getmtime(json_path):
+            return PaletteStore.load(store_path)
+    except (OSError, ValueError, struct.error):
+        pass
+
+    palette_store = PaletteStore.from_json(json_path)
+
+    try:
+        palette_store.save(store_path)
+    except OSError:
+        # The store still works from memory if the resources are read-only
+        pass
+
+    return palette_store
+
+
+def get_palette_colors(palette_name: str) -> list[RGBColor]:
+    palette_store = load_palette_store()
+
+    return palette_store.get_colors(palette_store.find(palette_name))
+
+
+def parse_hex_colors(hex_colors: list[str]) -> list[RGBColor]:
+    return [ImageColor.getrgb(hex_color)[:3] for hex_color in hex_colors]
@@ -0,0 +1,117 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class StageRecord:
+    name: str
+    duration: float
+    input_shape: tuple[int, ...]
+    output_shape: tuple[int, ...]
+    output_bytes: int
+    cached: bool
+
+    # Peak NumPy and Python allocations during the stage (only if memory tracing
+    # is enabled, allocations made by Pillow itself are not traced)
+    allocated_bytes: int | None = None
+
+
+class ConversionProfiler:
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.records: list[StageRecord] = []
+
+        self._trace_memory = trace_memory
+        self._started_tracing = False
+        self._stage_start_time = 0.0
+        self._stage_start_memory = 0
+
+    @property
+    def total_duration(self) -> float:
+        return sum(record.duration for record in self.records)
+
+    def begin_stage(self) -> None:
+        if self._trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+
+            tracemalloc.reset_peak()
+            self._stage_start_memory = tracemalloc.get_traced_memory()[0]
+
+        self._stage_start_time = time.perf_counter()
+
+    def end_stage(
+        self,
+        name: str,
+        input_image: Image.Image,
+        output_image: Image.Image,
+        cached: bool,
+        input_shape: tuple[int, ...] | None = None,
+    ) -> None:
+        duration = time.perf_counter() - self._stage_start_time
+        allocated_bytes: int | None = None
+
+        if self._trace_memory:
+            allocated_bytes = tracemalloc.get_traced_memory()[1]
+            allocated_bytes -= self._stage_start_memory
+
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+        # Images that are changed by the stage itself (e.g. draft decoding) need
+        # their original shape to be passed explicitly
+        if input_shape is None:
+            input_shape = get_image_shape(input_image)
+
+        output_shape = get_image_shape(output_image)
+
+        self.records.append(
+            StageRecord(
+                name,
+                duration,
+                input_shape,
+                output_shape,
+                output_shape[0] * output_shape[1] * output_shape[2],
+                cached,
+                allocated_bytes,
+            )
+        )
+
+    def format_summary(self) -> str:
+        stage_strs: list[str] = []
+
+        for record in self.records:
+            stage_str = f"{record.name} {record.duration * 1000:.1f} ms"
+
+            if record.cached:
+                stage_str += " (cached)"
+
+            stage_strs.append(stage_str)
+
+        stage_strs.append(f"total {self.total_duration * 1000:.1f} ms")
+
+        return " | ".join(stage_strs)
+
+
+def get_image_shape(image: Image.Image) -> tuple[int, int, int]:
+    return (image.height, image.width, len(image.getbands()))
@@ -0,0 +1,44 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from enum import Enum, auto
+
+from PIL import Image
+
+
+# Downsampling modes that reduce each factor x factor block of pixels to a single
+# pixel instead of resampling with a filter
+class BlockResampling(Enum):
+    MEAN = auto()
+    MEDIAN = auto()
+    MAJORITY = auto()
+
+
+type ResamplingMode = Image.Resampling | BlockResampling
+
+RESAMPLING_MODE_NAMES = [*Image.Resampling.__members__, *BlockResampling.__members__]
+
+
+def get_resampling_mode(name: str) -> ResamplingMode:
+    name = name.upper()
+
+    if name in BlockResampling.__members__:
+        return BlockResampling[name]
+
+    if name in Image.Resampling.__members__:
+        return Image.Resampling[name]
+
+    raise ValueError(f"Unknown resampling mode: '{name}'")
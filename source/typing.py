@@ -14,4 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from collections.abc import Callable
+
 type RGBColor = tuple[int, int, int]
+
+# Receives the completed fraction of a conversion (from 0 to 1)
+type ProgressCallback = Callable[[float], None]
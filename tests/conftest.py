@@ -0,0 +1,31 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+
+import pytest
+
+_REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The tests import the application modules like the entry point script does
+sys.path.insert(0, _REPOSITORY_PATH)
+
+
+@pytest.fixture(autouse=True)
+def _repository_directory(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Resources are loaded relative to the repository directory
+    monkeypatch.chdir(_REPOSITORY_PATH)
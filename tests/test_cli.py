@@ -0,0 +1,95 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from source.cli import _collect_input_paths, _get_output_paths, main
+
+
+def _create_image_file(image_path: Path) -> Path:
+    image_path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (8, 6), (200, 30, 40)).save(image_path)
+
+    return image_path
+
+
+def test_input_paths_are_collected_without_duplicates(tmp_path: Path) -> None:
+    image_paths = [
+        _create_image_file(tmp_path / "b.png"),
+        _create_image_file(tmp_path / "a.bmp"),
+    ]
+    (tmp_path / "notes.txt").write_text("")
+
+    assert _collect_input_paths(
+        [str(tmp_path / "b.png"), str(tmp_path), str(tmp_path / "*.png")]
+    ) == [image_paths[0], image_paths[1]]
+
+
+def test_output_paths_keep_the_format_of_inputs_with_equal_names(
+    tmp_path: Path,
+) -> None:
+    input_paths = [tmp_path / "a.png", tmp_path / "a.JPG", tmp_path / "b.bmp"]
+    output_dir = tmp_path / "output"
+
+    assert _get_output_paths(input_paths, output_dir, ".png", []) == {
+        input_paths[0]: output_dir / "a-png.png",
+        input_paths[1]: output_dir / "a-jpg.png",
+        input_paths[2]: output_dir / "b.png",
+    }
+
+
+def test_output_paths_must_not_overwrite_inputs(tmp_path: Path) -> None:
+    input_paths = [tmp_path / "a.bmp", tmp_path / "a-sweetie-16.png"]
+
+    _get_output_paths(input_paths, tmp_path, "png", ["pico-8"])
+
+    with pytest.raises(ValueError, match="overwrite an input image"):
+        _get_output_paths(input_paths, tmp_path, "png", ["sweetie-16"])
+
+
+def test_output_paths_must_not_collide(tmp_path: Path) -> None:
+    input_paths = [tmp_path / "first" / "a.png", tmp_path / "second" / "a.png"]
+
+    with pytest.raises(ValueError, match="would both be written to"):
+        _get_output_paths(input_paths, tmp_path / "output", "png", [])
+
+
+def test_main_writes_one_image_per_palette(tmp_path: Path) -> None:
+    input_path = _create_image_file(tmp_path / "input" / "a.png")
+    output_dir = tmp_path / "output"
+
+    exit_code = main(
+        [str(input_path), "-o", str(output_dir), "-p", "1bit-monitor-glow"]
+        + ["-p", "sweetie-16", "-j", "1"]
+    )
+
+    assert exit_code == 0
+    assert sorted(path.name for path in output_dir.iterdir()) == [
+        "a-1bit-monitor-glow.png",
+        "a-sweetie-16.png",
+    ]
+
+
+def test_main_rejects_colliding_outputs(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    input_path = _create_image_file(tmp_path / "a.png")
+
+    assert main([str(input_path), "-o", str(tmp_path), "-j", "1"]) == 1
+    assert "overwrite an input image" in capsys.readouterr().out
@@ -0,0 +1,409 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import itertools
+from collections import Counter
+from typing import Any
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from source.conversion import (
+    StageCache,
+    convert_image,
+    convert_image_with_palettes,
+    create_contact_sheet,
+)
+from source.dithering import DitheringMethod
+from source.matching import MatchingMethod, find_closest_color_indices
+from source.profiling import ConversionProfiler
+from source.resampling import BlockResampling
+
+_RNG_SEED = 0
+
+
+def _create_image(mode: str, width: int, height: int, levels: int = 256) -> Image.Image:
+    # Fewer levels give images with repeated colors
+    rng = np.random.default_rng(_RNG_SEED)
+    step = 256 // levels
+    image_array = rng.integers(0, levels, (height, width, len(mode))) * step
+
+    return Image.fromarray(image_array.astype(np.uint8).squeeze(), mode)
+
+
+def _create_colors(color_count: int) -> list[tuple[int, int, int]]:
+    rng = np.random.default_rng(_RNG_SEED + color_count)
+
+    return [tuple(color) for color in rng.integers(0, 256, (color_count, 3)).tolist()]
+
+
+# Reference implementations of the original, unoptimized conversion steps
+def _adjust_brightness_and_contrast_reference(
+    image: Image.Image, brightness_adjustment: float, contrast_adjustment: float
+) -> Image.Image:
+    image_array = np.asarray(image) / 255
+
+    if brightness_adjustment == 0:
+        pass
+    elif brightness_adjustment < 0:
+        image_array *= 1 + 0.5 * brightness_adjustment
+    else:
+        image_array = image_array + (1 - image_array) * 0.5 * brightness_adjustment
+
+    if contrast_adjustment != 0:
+        contrast_factor = np.tan(0.25 * (1 + contrast_adjustment) * np.pi)
+        image_array = (image_array - 0.5) * contrast_factor + 0.5
+
+    image_array = (image_array.clip(min=0, max=1) * 255).astype(np.uint8)
+
+    return Image.fromarray(image_array, image.mode)
+
+
+def _recolor_image_reference(
+    image: Image.Image, colors: list[tuple[int, int, int]]
+) -> Image.Image:
+    image_array = np.asarray(image)[:, :, :3]
+    colors_array = np.asarray(colors)
+    rgb_difference_vectors = image_array[:, :, np.newaxis, :] - colors_array
+    rgb_distances = np.linalg.norm(rgb_difference_vectors, axis=-1)
+    closest_color_indices = rgb_distances.argmin(axis=-1)
+
+    return Image.fromarray(colors_array[closest_color_indices].astype(np.uint8))
+
+
+def _downsample_image_blocks_reference(
+    image: Image.Image, factor: int, resampling_mode: BlockResampling
+) -> Image.Image:
+    image_array = np.asarray(image)
+    new_height = image.height // factor
+    new_width = image.width // factor
+    new_image_array = np.zeros((new_height, new_width, len(image.getbands())), np.uint8)
+
+    for row, column in itertools.product(range(new_height), range(new_width)):
+        block = image_array[
+            row * factor : (row + 1) * factor, column * factor : (column + 1) * factor
+        ]
+        block_pixels = block.reshape(factor * factor, -1).astype(np.int64)
+
+        match resampling_mode:
+            case BlockResampling.MEAN:
+                block_size = factor * factor
+                pixel = (block_pixels.sum(axis=0) + block_size // 2) // block_size
+            case BlockResampling.MEDIAN:
+                pixel = np.median(block_pixels, axis=0).round()
+            case BlockResampling.MAJORITY:
+                # Ties resolve to the color that occurs first in the block
+                block_colors = [tuple(block_pixel) for block_pixel in block_pixels]
+                color_counts = Counter(block_colors)
+                pixel = np.array(max(block_colors, key=color_counts.__getitem__))
+
+        new_image_array[row, column] = pixel
+
+    return Image.fromarray(
+        new_image_array.reshape(new_height, new_width, *image_array.shape[2:]),
+        image.mode,
+    )
+
+
+def _assert_images_equal(image: Image.Image, expected_image: Image.Image) -> None:
+    assert image.size == expected_image.size
+    assert np.array_equal(
+        np.asarray(image.convert("RGB")), np.asarray(expected_image.convert("RGB"))
+    )
+
+
+@pytest.mark.parametrize(
+    ("mode", "grayscale", "brightness_adjustment", "contrast_adjustment"),
+    [
+        ("RGB", True, 0, 0),
+        ("RGB", False, 0.3, 0),
+        ("RGB", False, 0, -0.6),
+        ("RGB", True, -0.5, 0.7),
+        ("RGBA", False, 1, 0.99),
+        ("RGBA", True, 0.2, -1),
+    ],
+)
+@pytest.mark.parametrize("color_count", [1, 4, 16, 256])
+@pytest.mark.parametrize(
+    "dithering",
+    [DitheringMethod.NONE, DitheringMethod.BAYER_4X4, DitheringMethod.FLOYD_STEINBERG],
+)
+def test_fused_conversion_matches_staged_conversion(
+    mode: str,
+    grayscale: bool,
+    brightness_adjustment: float,
+    contrast_adjustment: float,
+    color_count: int,
+    dithering: DitheringMethod,
+) -> None:
+    image = _create_image(mode, 67, 45)
+    conversion_kwargs = {
+        "downsampling_factor": 2,
+        "grayscale": grayscale,
+        "brightness_adjustment": brightness_adjustment,
+        "contrast_adjustment": contrast_adjustment,
+        "colors": _create_colors(color_count),
+        "dithering": dithering,
+    }
+
+    fused_image = convert_image(image, fused=True, **conversion_kwargs)
+    staged_image = convert_image(image, fused=False, **conversion_kwargs)
+
+    _assert_images_equal(fused_image, staged_image)
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+@pytest.mark.parametrize("color_count", [1, 7, 64, 200])
+@pytest.mark.parametrize("matching_method", list(MatchingMethod))
+@pytest.mark.parametrize("memory_budget", [1, 4096, 2**28])
+def test_recoloring_matches_reference(
+    mode: str,
+    color_count: int,
+    matching_method: MatchingMethod,
+    memory_budget: int,
+) -> None:
+    image = _create_image(mode, 53, 38)
+    colors = _create_colors(color_count)
+
+    recolored_image = convert_image(
+        image,
+        colors=colors,
+        memory_budget=memory_budget,
+        matching_method=matching_method,
+    )
+
+    _assert_images_equal(recolored_image, _recolor_image_reference(image, colors))
+
+
+@pytest.mark.parametrize("levels", [4, 256])
+@pytest.mark.parametrize("deduplicate", [None, True, False])
+@pytest.mark.parametrize("matching_method", list(MatchingMethod))
+def test_deduplicated_matching_matches_reference(
+    levels: int, deduplicate: bool | None, matching_method: MatchingMethod
+) -> None:
+    image = _create_image("RGB", 71, 29, levels)
+    colors = _create_colors(12)
+
+    closest_color_indices = find_closest_color_indices(
+        np.asarray(image),
+        np.asarray(colors),
+        method=matching_method,
+        deduplicate=deduplicate,
+    )
+    recolored_image = Image.fromarray(
+        np.asarray(colors, dtype=np.uint8)[closest_color_indices]
+    )
+
+    _assert_images_equal(recolored_image, _recolor_image_reference(image, colors))
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+def test_brightness_and_contrast_match_reference(mode: str) -> None:
+    image = _create_image(mode, 16, 16)
+    adjustments = [-1, -0.55, -0.1, 0, 0.25, 0.7, 1]
+
+    for brightness_adjustment, contrast_adjustment in itertools.product(
+        adjustments, adjustments
+    ):
+        adjusted_image = convert_image(
+            image,
+            brightness_adjustment=brightness_adjustment,
+            contrast_adjustment=contrast_adjustment,
+        )
+        expected_image = _adjust_brightness_and_contrast_reference(
+            image, brightness_adjustment, contrast_adjustment
+        )
+
+        assert adjusted_image.mode == expected_image.mode
+        assert np.array_equal(np.asarray(adjusted_image), np.asarray(expected_image))
+
+
+@pytest.mark.parametrize(
+    "resampling_mode",
+    [Image.Resampling.NEAREST, Image.Resampling.LANCZOS] + list(BlockResampling),
+)
+def test_downsampling_below_one_pixel_fails(
+    resampling_mode: Image.Resampling | BlockResampling,
+) -> None:
+    image = _create_image("RGB", 10, 12)
+
+    with pytest.raises(ValueError):
+        convert_image(image, downsampling_factor=11, resampling_mode=resampling_mode)
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+@pytest.mark.parametrize("factor", [2, 3, 5])
+@pytest.mark.parametrize("levels", [2, 256])
+@pytest.mark.parametrize("resampling_mode", list(BlockResampling))
+def test_block_downsampling_matches_reference(
+    mode: str, factor: int, levels: int, resampling_mode: BlockResampling
+) -> None:
+    # The image size is not a multiple of the factor, so edge pixels are cropped
+    image = _create_image(mode, 23, 17, levels)
+
+    downsampled_image = convert_image(
+        image, downsampling_factor=factor, resampling_mode=resampling_mode
+    )
+    expected_image = _downsample_image_blocks_reference(image, factor, resampling_mode)
+
+    assert downsampled_image.mode == expected_image.mode
+    assert np.array_equal(np.asarray(downsampled_image), np.asarray(expected_image))
+
+
+def test_block_majority_prefers_first_color_on_ties() -> None:
+    image = Image.fromarray(
+        np.array([[[9, 9, 9], [200, 0, 0]], [[200, 0, 0], [9, 9, 9]]], np.uint8)
+    )
+
+    downsampled_image = convert_image(
+        image, downsampling_factor=2, resampling_mode=BlockResampling.MAJORITY
+    )
+
+    assert downsampled_image.getpixel((0, 0)) == (9, 9, 9)
+
+
+def _convert_with_profiler(
+    image: Image.Image, **conversion_kwargs: Any
+) -> tuple[Image.Image, dict[str, bool]]:
+    profiler = ConversionProfiler()
+    converted_image = convert_image(image, profiler=profiler, **conversion_kwargs)
+
+    return converted_image, {record.name: record.cached for record in profiler.records}
+
+
+def test_stage_cache_only_recomputes_changed_stages() -> None:
+    image = _create_image("RGB", 40, 30)
+    conversion_kwargs = {
+        "downsampling_factor": 2,
+        "brightness_adjustment": 0.3,
+        "colors": _create_colors(8),
+        "fused": False,
+        "stage_cache": StageCache(),
+    }
+
+    converted_image, cached_stages = _convert_with_profiler(image, **conversion_kwargs)
+    assert cached_stages == {
+        "downsample": False,
+        "brightness_contrast": False,
+        "recolor": False,
+    }
+
+    cached_image, cached_stages = _convert_with_profiler(image, **conversion_kwargs)
+    assert all(cached_stages.values())
+    _assert_images_equal(cached_image, converted_image)
+
+    # Only the stages following a changed parameter are recomputed
+    conversion_kwargs["colors"] = _create_colors(4)
+    _, cached_stages = _convert_with_profiler(image, **conversion_kwargs)
+    assert cached_stages == {
+        "downsample": True,
+        "brightness_contrast": True,
+        "recolor": False,
+    }
+
+    conversion_kwargs["downsampling_factor"] = 3
+    _, cached_stages = _convert_with_profiler(image, **conversion_kwargs)
+    assert not any(cached_stages.values())
+
+    # Source images are identified by object identity, not by their content
+    _, cached_stages = _convert_with_profiler(image.copy(), **conversion_kwargs)
+    assert not any(cached_stages.values())
+
+
+def test_stage_cache_evicts_least_recently_used_images() -> None:
+    # Every image takes up 100 bytes
+    images = [Image.new("L", (10, 10), value) for value in range(4)]
+    stage_cache = StageCache(max_bytes=200)
+
+    stage_cache.put("a", images[0])
+    stage_cache.put("b", images[1])
+    assert stage_cache.get("a") is images[0]
+
+    stage_cache.put("c", images[2])
+    assert stage_cache.get("b") is None
+    assert stage_cache.get("a") is images[0]
+    assert stage_cache.get("c") is images[2]
+    assert stage_cache.size_bytes == 200
+
+    # Images larger than the cache are not stored and do not evict others
+    stage_cache.put("d", Image.new("L", (20, 20)))
+    assert stage_cache.get("d") is None
+    assert stage_cache.size_bytes == 200
+
+    stage_cache.clear()
+    assert stage_cache.get("a") is None
+    assert stage_cache.size_bytes == 0
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+@pytest.mark.parametrize(
+    "dithering", [DitheringMethod.NONE, DitheringMethod.FLOYD_STEINBERG]
+)
+@pytest.mark.parametrize("indexed_output", [False, True])
+def test_conversion_with_palettes_matches_conversion(
+    mode: str, dithering: DitheringMethod, indexed_output: bool
+) -> None:
+    image = _create_image(mode, 37, 29, levels=8)
+    palettes = [_create_colors(color_count) for color_count in (1, 5, 16)]
+    conversion_kwargs: dict[str, Any] = {
+        "downsampling_factor": 2,
+        "grayscale": True,
+        "brightness_adjustment": 0.2,
+        "dithering": dithering,
+        "indexed_output": indexed_output,
+    }
+
+    converted_images = convert_image_with_palettes(image, palettes, **conversion_kwargs)
+
+    assert len(converted_images) == len(palettes)
+
+    for converted_image, colors in zip(converted_images, palettes):
+        expected_image = convert_image(image, colors=colors, **conversion_kwargs)
+
+        assert converted_image.mode == expected_image.mode
+        _assert_images_equal(converted_image, expected_image)
+
+
+def test_contact_sheet_arranges_images_in_grid() -> None:
+    images = [
+        Image.new("RGB", (4, 3), (255, 0, 0)),
+        Image.new("L", (2, 5), 80),
+        Image.new("RGB", (4, 3), (0, 0, 255)).convert("P"),
+    ]
+
+    contact_sheet = create_contact_sheet(
+        images, spacing=1, background_color=(0, 255, 0)
+    )
+    sheet_array = np.asarray(contact_sheet)
+
+    # Two columns and two rows of cells with the size of the largest image
+    assert contact_sheet.mode == "RGB"
+    assert contact_sheet.size == (2 * 4 + 3 * 1, 2 * 5 + 3 * 1)
+    assert (sheet_array[1:4, 1:5] == (255, 0, 0)).all()
+    assert (sheet_array[1:6, 6:8] == (80, 80, 80)).all()
+    assert (sheet_array[7:10, 1:5] == (0, 0, 255)).all()
+    assert (sheet_array[1:6, 8:10] == (0, 255, 0)).all()
+    assert (sheet_array[:, 0] == (0, 255, 0)).all()
+    assert (sheet_array[4:7, 1:5] == (0, 255, 0)).all()
+    assert (sheet_array[7:13, 6:11] == (0, 255, 0)).all()
+
+    assert create_contact_sheet(images, column_count=3, spacing=0).size == (12, 5)
+
+
+def test_contact_sheet_needs_images() -> None:
+    with pytest.raises(ValueError):
+        create_contact_sheet([])
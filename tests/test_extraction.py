@@ -0,0 +1,139 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+from PIL import Image
+
+from source.conversion import extract_palette, suggest_palettes
+from source.extraction import PaletteExtractionMethod, rank_palettes
+from source.palettes import PaletteStore
+
+_RNG_SEED = 0
+
+# Colors that fall into different histogram bins, sorted from dark to bright
+_IMAGE_COLORS = [(20, 20, 90), (200, 30, 40), (40, 160, 60), (230, 220, 120)]
+
+
+def _create_image(
+    colors: list[tuple[int, int, int]], width: int = 40, height: int = 30
+) -> Image.Image:
+    rng = np.random.default_rng(_RNG_SEED)
+    color_indices = rng.integers(0, len(colors), (height, width))
+
+    return Image.fromarray(np.asarray(colors, dtype=np.uint8)[color_indices])
+
+
+def _get_mean_squared_error(
+    image_array: NDArray[np.uint8], colors: NDArray[np.uint8]
+) -> float:
+    pixels = image_array.reshape(-1, 3).astype(np.int64)
+    squared_distances = ((pixels[:, np.newaxis] - colors) ** 2).sum(axis=-1)
+
+    return float(squared_distances.min(axis=-1).mean())
+
+
+def _create_palette_store(palettes: list[list[tuple[int, int, int]]]) -> PaletteStore:
+    color_offsets = np.cumsum([0] + [len(colors) for colors in palettes])
+    color_data = bytes(
+        channel for colors in palettes for color in colors for channel in color
+    )
+
+    return PaletteStore(
+        [f"palette-{index}" for index in range(len(palettes))],
+        [f"Palette {index}" for index in range(len(palettes))],
+        [None] * len(palettes),
+        tuple(color_offsets.tolist()),
+        color_data,
+    )
+
+
+@pytest.mark.parametrize("method", list(PaletteExtractionMethod))
+@pytest.mark.parametrize("color_count", [4, 16])
+def test_extracted_palette_recovers_image_colors(
+    method: PaletteExtractionMethod, color_count: int
+) -> None:
+    image = _create_image(_IMAGE_COLORS)
+
+    assert extract_palette(image, color_count, method) == _IMAGE_COLORS
+
+
+@pytest.mark.parametrize("method", list(PaletteExtractionMethod))
+def test_extracted_palette_is_limited_to_color_count(
+    method: PaletteExtractionMethod,
+) -> None:
+    image = _create_image([(value, value, value) for value in range(0, 256, 8)])
+
+    colors = extract_palette(image, 5, method)
+
+    assert 0 < len(colors) <= 5
+    assert colors == sorted(colors)
+    assert extract_palette(image, 5, method) == colors
+
+
+def test_extracted_palette_ignores_transparent_pixels() -> None:
+    image = _create_image(_IMAGE_COLORS).convert("RGBA")
+    image.paste((255, 0, 255, 0), (0, 0, 20, 30))
+    image_array = np.asarray(image)
+
+    colors = extract_palette(image, 8)
+
+    assert (255, 0, 255) not in colors
+    assert set(colors) <= set(
+        map(tuple, image_array[:, 20:, :3].reshape(-1, 3).tolist())
+    )
+
+    image.putalpha(0)
+
+    assert extract_palette(image, 8) == []
+
+
+@pytest.mark.parametrize("memory_budget", [1, 2**26])
+def test_palette_ranking_matches_recoloring_error(memory_budget: int) -> None:
+    image_array = np.asarray(_create_image(_IMAGE_COLORS))
+
+    # Palettes are padded with duplicates of their own colors
+    palettes = np.array(
+        [
+            [(0, 0, 0), (255, 255, 255), (255, 255, 255)],
+            [(20, 20, 90), (200, 30, 40), (230, 220, 120)],
+            [(10, 200, 10), (10, 200, 10), (10, 200, 10)],
+        ],
+        dtype=np.uint8,
+    )
+
+    errors = rank_palettes(image_array, palettes, memory_budget)
+    expected_errors = [
+        _get_mean_squared_error(image_array, palette) for palette in palettes
+    ]
+
+    assert errors == pytest.approx(expected_errors, rel=1e-5)
+
+
+def test_suggested_palettes_are_sorted_by_fit() -> None:
+    palette_store = _create_palette_store(
+        [
+            [(0, 0, 0), (255, 255, 255)],
+            _IMAGE_COLORS,
+            [(10, 200, 10)],
+            _IMAGE_COLORS[:3],
+        ]
+    )
+    image = _create_image(_IMAGE_COLORS)
+
+    assert suggest_palettes(image, palette_store, 2) == [1, 3]
+    assert suggest_palettes(image.convert("P"), palette_store, 4)[:2] == [1, 3]
@@ -0,0 +1,348 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import itertools
+from pathlib import Path
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from source.dithering import DitheringMethod
+from source.matching import (
+    BLUE_NOISE_RANKS_PATH,
+    BLUE_NOISE_TILE_SIZE,
+    _convert_to_perceptual,
+    _get_bayer_matrix,
+    _get_blue_noise_ranks,
+    _get_ciede2000_squared_distances,
+    _get_threshold_map,
+    _load_blue_noise_ranks,
+    find_closest_color_indices,
+    find_dithered_color_indices,
+    get_distance_scores,
+)
+from source.metrics import ColorMetric
+
+_RNG_SEED = 0
+
+# Palette colors of evenly spaced gray levels, for which the dithering spread and
+# therefore all ordered dithering offsets are exact
+_GRAY_LEVEL_COLORS = np.array([[level] * 3 for level in range(0, 256, 51)])
+
+# sRGB colors and their OKLab (Ottosson 2020) and CIELAB (D65) coordinates
+_PERCEPTUAL_TEST_DATA = [
+    (ColorMetric.OKLAB, (255, 255, 255), (1.0, 0.0, 0.0)),
+    (ColorMetric.OKLAB, (0, 0, 0), (0.0, 0.0, 0.0)),
+    (ColorMetric.OKLAB, (255, 0, 0), (0.627955, 0.224863, 0.125846)),
+    (ColorMetric.OKLAB, (0, 255, 0), (0.866440, -0.233888, 0.179498)),
+    (ColorMetric.OKLAB, (0, 0, 255), (0.452014, -0.032457, -0.311528)),
+    (ColorMetric.CIELAB_DE76, (255, 255, 255), (100.0, 0.0, 0.0)),
+    (ColorMetric.CIELAB_DE76, (0, 0, 0), (0.0, 0.0, 0.0)),
+    (ColorMetric.CIELAB_DE76, (128, 128, 128), (53.5850, 0.0, 0.0)),
+    (ColorMetric.CIELAB_DE76, (255, 0, 0), (53.2408, 80.0925, 67.2032)),
+    (ColorMetric.CIELAB_DE76, (0, 255, 0), (87.7347, -86.1827, 83.1793)),
+    (ColorMetric.CIELAB_DE76, (0, 0, 255), (32.2970, 79.1875, -107.8602)),
+]
+
+# (row offset, column offset, weight) of the error diffusion kernels
+_ERROR_DIFFUSION_KERNELS = {
+    DitheringMethod.FLOYD_STEINBERG: [
+        (0, 1, 7 / 16),
+        (1, -1, 3 / 16),
+        (1, 0, 5 / 16),
+        (1, 1, 1 / 16),
+    ],
+    DitheringMethod.ATKINSON: [
+        (0, 1, 1 / 8),
+        (0, 2, 1 / 8),
+        (1, -1, 1 / 8),
+        (1, 0, 1 / 8),
+        (1, 1, 1 / 8),
+        (2, 0, 1 / 8),
+    ],
+}
+
+# CIEDE2000 test data of Sharma et al. (2005): CIELAB coordinates of both colors
+# and their color difference
+_CIEDE2000_TEST_DATA = [
+    ((50.0000, 2.6772, -79.7751), (50.0000, 0.0000, -82.7485), 2.0425),
+    ((50.0000, 3.1571, -77.2803), (50.0000, 0.0000, -82.7485), 2.8615),
+    ((50.0000, 2.8361, -74.0200), (50.0000, 0.0000, -82.7485), 3.4412),
+    ((50.0000, -1.3802, -84.2814), (50.0000, 0.0000, -82.7485), 1.0000),
+    ((50.0000, -1.1848, -84.8006), (50.0000, 0.0000, -82.7485), 1.0000),
+    ((50.0000, -0.9009, -85.5211), (50.0000, 0.0000, -82.7485), 1.0000),
+    ((50.0000, 0.0000, 0.0000), (50.0000, -1.0000, 2.0000), 2.3669),
+    ((50.0000, -1.0000, 2.0000), (50.0000, 0.0000, 0.0000), 2.3669),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0009), 7.1792),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0010), 7.1792),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0011), 7.2195),
+    ((50.0000, 2.4900, -0.0010), (50.0000, -2.4900, 0.0012), 7.2195),
+    ((50.0000, -0.0010, 2.4900), (50.0000, 0.0009, -2.4900), 4.8045),
+    ((50.0000, -0.0010, 2.4900), (50.0000, 0.0010, -2.4900), 4.8045),
+    ((50.0000, -0.0010, 2.4900), (50.0000, 0.0011, -2.4900), 4.7461),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 0.0000, -2.5000), 4.3065),
+    ((50.0000, 2.5000, 0.0000), (73.0000, 25.0000, -18.0000), 27.1492),
+    ((50.0000, 2.5000, 0.0000), (61.0000, -5.0000, 29.0000), 22.8977),
+    ((50.0000, 2.5000, 0.0000), (56.0000, -27.0000, -3.0000), 31.9030),
+    ((50.0000, 2.5000, 0.0000), (58.0000, 24.0000, 15.0000), 19.4535),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 3.1736, 0.5854), 1.0000),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 3.2972, 0.0000), 1.0000),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 1.8634, 0.5757), 1.0000),
+    ((50.0000, 2.5000, 0.0000), (50.0000, 3.2592, 0.3350), 1.0000),
+    ((60.2574, -34.0099, 36.2677), (60.4626, -34.1751, 39.4387), 1.2644),
+    ((63.0109, -31.0961, -5.8663), (62.8187, -29.7946, -4.0864), 1.2630),
+    ((61.2901, 3.7196, -5.3901), (61.4292, 2.2480, -4.9620), 1.8731),
+    ((35.0831, -44.1164, 3.7933), (35.0232, -40.0716, 1.5901), 1.8645),
+    ((22.7233, 20.0904, -46.6940), (23.0331, 14.9730, -42.5619), 2.0373),
+    ((36.4612, 47.8580, 18.3852), (36.2715, 50.5065, 21.2231), 1.4146),
+    ((90.8027, -2.0831, 1.4410), (91.1528, -1.6435, 0.0447), 1.4441),
+    ((90.9257, -0.5406, -0.9208), (88.6381, -0.8985, -0.7239), 1.5381),
+    ((6.7747, -0.2908, -2.4247), (5.8714, -0.0985, -2.2286), 0.6377),
+    ((2.0776, 0.0795, -1.1350), (0.9033, -0.0636, -0.5514), 0.9082),
+]
+
+
+def _create_image_array(width: int, height: int) -> NDArray[np.uint8]:
+    rng = np.random.default_rng(_RNG_SEED)
+
+    return rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def _create_colors(color_count: int) -> NDArray[np.int64]:
+    rng = np.random.default_rng(_RNG_SEED + color_count)
+
+    return rng.integers(0, 256, (color_count, 3))
+
+
+# Reference implementations that dither one pixel at a time
+def _apply_ordered_dithering_reference(
+    image_array: NDArray[np.uint8],
+    colors_array: NDArray[np.integer],
+    threshold_map: NDArray[np.float32],
+) -> NDArray[np.intp]:
+    img_height, img_width = image_array.shape[:2]
+    map_height, map_width = threshold_map.shape
+
+    # Pixels are offset by up to half the median distance between neighboring
+    # palette colors (per channel)
+    squared_distances = ((colors_array[:, np.newaxis] - colors_array) ** 2).sum(-1)
+    np.fill_diagonal(squared_distances, np.iinfo(squared_distances.dtype).max)
+    spread = np.median(np.sqrt(squared_distances.min(axis=-1) / 3))
+
+    color_indices = np.empty((img_height, img_width), dtype=np.intp)
+
+    for row, column in itertools.product(range(img_height), range(img_width)):
+        offset = threshold_map[row % map_height, column % map_width] * spread
+        pixel = np.clip(np.round(image_array[row, column] + offset), 0, 255)
+        distances = np.linalg.norm(pixel - colors_array, axis=-1)
+        color_indices[row, column] = distances.argmin()
+
+    return color_indices
+
+
+def _diffuse_errors_reference(
+    image_array: NDArray[np.uint8],
+    colors_array: NDArray[np.integer],
+    kernel: list[tuple[int, int, float]],
+    metric: ColorMetric,
+) -> NDArray[np.intp]:
+    img_height, img_width = image_array.shape[:2]
+    float_colors = colors_array.astype(np.float32)
+
+    # Padded so that errors diffused past the image edges can be ignored
+    errors = np.zeros((img_height + 2, img_width + 4, 3), dtype=np.float32)
+    color_indices = np.empty((img_height, img_width), dtype=np.intp)
+
+    for row, column in itertools.product(range(img_height), range(img_width)):
+        pixel = image_array[row, column] + errors[row, column + 2]
+        np.clip(pixel, 0, 255, out=pixel)
+
+        if metric is ColorMetric.RGB:
+            color_index = get_distance_scores(pixel[np.newaxis], float_colors).argmin()
+        else:
+            color_index = find_closest_color_indices(
+                np.rint(pixel).astype(np.uint8)[np.newaxis],
+                colors_array,
+                metric=metric,
+            )[0]
+
+        color_indices[row, column] = color_index
+        error = pixel - float_colors[color_index]
+
+        for row_offset, column_offset, weight in kernel:
+            errors[row + row_offset, column + 2 + column_offset] += error * weight
+
+    return color_indices
+
+
+@pytest.mark.parametrize(
+    "metric, rgb_color, expected_coordinates", _PERCEPTUAL_TEST_DATA
+)
+def test_perceptual_coordinates_match_reference_data(
+    metric: ColorMetric,
+    rgb_color: tuple[int, int, int],
+    expected_coordinates: tuple[float, float, float],
+) -> None:
+    coordinates = _convert_to_perceptual(np.array([rgb_color], np.uint8), metric)
+
+    # Four significant digits, like the reference data
+    tolerance = 1e-4 * max(abs(value) for value in expected_coordinates) or 1e-5
+
+    assert coordinates.dtype == np.float32
+    assert coordinates[0] == pytest.approx(expected_coordinates, abs=tolerance)
+
+
+@pytest.mark.parametrize(
+    "metric",
+    [ColorMetric.OKLAB, ColorMetric.CIELAB_DE76, ColorMetric.CIELAB_DE2000],
+)
+@pytest.mark.parametrize("memory_budget", [1, 2**28])
+@pytest.mark.parametrize("deduplicate", [True, False])
+def test_perceptual_matching_finds_closest_colors(
+    metric: ColorMetric, memory_budget: int, deduplicate: bool
+) -> None:
+    image_array = _create_image_array(37, 29)
+    colors_array = _create_colors(24)
+
+    color_indices = find_closest_color_indices(
+        image_array,
+        colors_array,
+        memory_budget=memory_budget,
+        deduplicate=deduplicate,
+        metric=metric,
+    ).reshape(-1)
+
+    pixel_coordinates = _convert_to_perceptual(image_array.reshape(-1, 3), metric)
+    palette_coordinates = _convert_to_perceptual(colors_array.astype(np.uint8), metric)
+
+    if metric is ColorMetric.CIELAB_DE2000:
+        squared_distances = _get_ciede2000_squared_distances(
+            pixel_coordinates.astype(np.float64), palette_coordinates.astype(np.float64)
+        )
+    else:
+        squared_distances = (
+            (pixel_coordinates[:, np.newaxis] - palette_coordinates) ** 2
+        ).sum(axis=-1, dtype=np.float64)
+
+    # Colors may only differ from the exact closest colors by float32 rounding
+    matched_distances = squared_distances[np.arange(len(color_indices)), color_indices]
+
+    assert np.allclose(matched_distances, squared_distances.min(axis=-1), atol=1e-5)
+
+
+def test_shipped_blue_noise_mask_matches_generated_mask() -> None:
+    ranks = _load_blue_noise_ranks(BLUE_NOISE_TILE_SIZE)
+
+    assert np.array_equal(np.load(BLUE_NOISE_RANKS_PATH), ranks)
+    assert np.array_equal(ranks, _get_blue_noise_ranks(BLUE_NOISE_TILE_SIZE))
+
+
+def test_blue_noise_mask_is_regenerated_if_missing(tmp_path: Path) -> None:
+    ranks_path = str(tmp_path / "blue-noise.npy")
+    ranks = _load_blue_noise_ranks(8, ranks_path)
+
+    assert sorted(ranks.ravel()) == list(range(64))
+    assert np.array_equal(np.load(ranks_path), ranks)
+    assert np.array_equal(_load_blue_noise_ranks(8, ranks_path), ranks)
+
+
+@pytest.mark.parametrize("lab_1, lab_2, expected_distance", _CIEDE2000_TEST_DATA)
+def test_ciede2000_matches_reference_data(
+    lab_1: tuple[float, float, float],
+    lab_2: tuple[float, float, float],
+    expected_distance: float,
+) -> None:
+    coordinates_1 = np.array([lab_1], dtype=np.float32)
+    coordinates_2 = np.array([lab_2], dtype=np.float32)
+
+    # The color difference is symmetric
+    for pixel_coordinates, palette_coordinates in [
+        (coordinates_1, coordinates_2),
+        (coordinates_2, coordinates_1),
+    ]:
+        squared_distances = _get_ciede2000_squared_distances(
+            pixel_coordinates, palette_coordinates
+        )
+
+        assert squared_distances.dtype == np.float32
+        assert np.sqrt(squared_distances[0, 0]) == pytest.approx(
+            expected_distance, abs=1e-4
+        )
+
+
+def test_bayer_matrices_rank_all_pixels() -> None:
+    assert _get_bayer_matrix(1).tolist() == [[0, 2], [3, 1]]
+
+    for order in [2, 3]:
+        bayer_matrix = _get_bayer_matrix(order)
+
+        assert sorted(bayer_matrix.ravel()) == list(range(4**order))
+
+
+@pytest.mark.parametrize(
+    "dithering",
+    [
+        DitheringMethod.BAYER_2X2,
+        DitheringMethod.BAYER_4X4,
+        DitheringMethod.BAYER_8X8,
+        DitheringMethod.BLUE_NOISE,
+    ],
+)
+def test_ordered_dithering_matches_reference(dithering: DitheringMethod) -> None:
+    image_array = _create_image_array(70, 67)
+
+    color_indices = find_dithered_color_indices(
+        image_array, _GRAY_LEVEL_COLORS, dithering
+    )
+    expected_color_indices = _apply_ordered_dithering_reference(
+        image_array, _GRAY_LEVEL_COLORS, _get_threshold_map(dithering)
+    )
+
+    assert np.array_equal(color_indices, expected_color_indices)
+
+
+def test_ordered_dithering_mixes_neighboring_colors() -> None:
+    # A quarter of the pixels of a dark gray area are dithered to white
+    image_array = np.full((16, 16, 3), 64, dtype=np.uint8)
+    colors_array = np.array([[0, 0, 0], [255, 255, 255]])
+
+    color_indices = find_dithered_color_indices(
+        image_array, colors_array, DitheringMethod.BAYER_4X4
+    )
+
+    assert color_indices.mean() == 0.25
+
+
+@pytest.mark.parametrize(
+    "dithering", [DitheringMethod.FLOYD_STEINBERG, DitheringMethod.ATKINSON]
+)
+@pytest.mark.parametrize("metric", [ColorMetric.RGB, ColorMetric.OKLAB])
+@pytest.mark.parametrize("color_count", [2, 9])
+def test_wavefront_error_diffusion_matches_sequential_reference(
+    dithering: DitheringMethod, metric: ColorMetric, color_count: int
+) -> None:
+    image_array = _create_image_array(31, 23)
+    colors_array = _create_colors(color_count)
+
+    color_indices = find_dithered_color_indices(
+        image_array, colors_array, dithering, metric=metric
+    )
+    expected_color_indices = _diffuse_errors_reference(
+        image_array, colors_array, _ERROR_DIFFUSION_KERNELS[dithering], metric
+    )
+
+    assert np.array_equal(color_indices, expected_color_indices)
@@ -0,0 +1,123 @@
+# This file is part of pixelart-palette-converter.
+# Copyright (C) 2023  Jan Mittendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import struct
+from pathlib import Path
+
+import pytest
+
+from source.palettes import (
+    PALETTES_JSON_PATH,
+    PaletteStore,
+    load_palette_store,
+    parse_hex_colors,
+)
+
+_PALETTES = {
+    "two-tone": {"name": "Two Tone", "author": None, "colors": ["#000000", "#ffffff"]},
+    "sunset-3": {
+        "name": "Sunset 3",
+        "author": "Ána Müller",
+        "colors": ["#ff7f50", "#6a0dad", "#ffd700"],
+    },
+    "single": {"name": "Single", "author": "Kim", "colors": ["#123456"]},
+}
+
+
+@pytest.fixture
+def json_path(tmp_path: Path) -> str:
+    json_path = tmp_path / "palettes.json"
+    json_path.write_text(json.dumps(_PALETTES))
+
+    return str(json_path)
+
+
+def _assert_stores_equal(store: PaletteStore, expected_store: PaletteStore) -> None:
+    assert store.keys == expected_store.keys
+    assert store.names == expected_store.names
+    assert store.authors == expected_store.authors
+    assert tuple(store.color_offsets) == tuple(expected_store.color_offsets)
+    assert store.color_data == expected_store.color_data
+
+
+def test_store_from_json_decodes_palettes(json_path: str) -> None:
+    palette_store = PaletteStore.from_json(json_path)
+
+    assert len(palette_store) == len(_PALETTES)
+
+    for index, (key, palette) in enumerate(_PALETTES.items()):
+        assert palette_store.keys[index] == key
+        assert palette_store.get_colors(index) == parse_hex_colors(palette["colors"])
+
+    assert palette_store.get_label(0) == "Two Tone"
+    assert palette_store.get_label(1) == "Sunset 3 (Ána Müller)"
+
+
+@pytest.mark.parametrize("bundled", [False, True])
+def test_store_survives_round_trip(
+    json_path: str, tmp_path: Path, bundled: bool
+) -> None:
+    palette_store = PaletteStore.from_json(PALETTES_JSON_PATH if bundled else json_path)
+    store_path = str(tmp_path / "palettes.bin")
+
+    palette_store.save(store_path)
+    loaded_store = PaletteStore.load(store_path)
+
+    _assert_stores_equal(loaded_store, palette_store)
+    assert not os.path.exists(f"{store_path}.tmp")
+
+
+@pytest.mark.parametrize(
+    "header", [struct.pack("<4sHI", b"PNGX", 1, 0), struct.pack("<4sHI", b"PPCS", 2, 0)]
+)
+def test_store_with_other_format_is_rejected(tmp_path: Path, header: bytes) -> None:
+    store_path = tmp_path / "palettes.bin"
+    store_path.write_bytes(header + bytes(4))
+
+    with pytest.raises(ValueError):
+        PaletteStore.load(str(store_path))
+
+
+def test_outdated_store_is_rebuilt(json_path: str, tmp_path: Path) -> None:
+    store_path = str(tmp_path / "palettes.bin")
+
+    # The cache of loaded stores is bypassed to see the changes on disk
+    palette_store = load_palette_store.__wrapped__(json_path, store_path)
+
+    assert os.path.exists(store_path)
+    _assert_stores_equal(PaletteStore.load(store_path), palette_store)
+
+    with open(json_path, "w") as json_file:
+        json.dump({"two-tone": _PALETTES["two-tone"]}, json_file)
+
+    store_mtime = os.path.getmtime(store_path)
+    os.utime(json_path, (store_mtime + 1, store_mtime + 1))
+
+    assert len(load_palette_store.__wrapped__(json_path, store_path)) == 1
+    assert len(PaletteStore.load(store_path)) == 1
+
+
+def test_palettes_are_found_by_key_or_name(json_path: str) -> None:
+    palette_store = PaletteStore.from_json(json_path)
+
+    assert palette_store.find("sunset-3") == 1
+    assert palette_store.find("sunset 3") == 1
+    assert palette_store.find("SINGLE") == 2
+
+    with pytest.raises(ValueError):
+        palette_store.find("sunset")